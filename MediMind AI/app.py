@@ -1,28 +1,15 @@
-import base64
-import os
+import startup
 import tkinter as tk
 from tkinter import filedialog
 from tkinter.scrolledtext import ScrolledText
-from groq import Groq
-from PIL import Image
-import pytesseract
+import llm
 from llm import ChatBot
-from prescription import parse_prescription
-from dotenv import dotenv_values
+from worker import JobExecutor
+from chatview import ChatView
+from jobs import prescription_job, scan_job
+startup.mark("imports")
 
 
-# Get the parent directory path
-parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-
-# Load environment variables from parent directory .env file
-env_vars = dotenv_values(os.path.join(parent_dir, ".env"))
-
-Username = env_vars.get("Username", "User")
-Assistantname = env_vars.get("Assistantname", "MediMind AI")
-GroqAPIKey = env_vars.get("GroqAPIKey", "YOUR_GROQ_API_KEY")
-
-client = Groq(api_key=GroqAPIKey)
-
 # Dark theme colors
 BG_COLOR = "#1e1e1e"
 TEXT_COLOR = "#ffffff"
@@ -30,35 +17,32 @@ BUTTON_COLOR = "#444"
 BUTTON_HOVER = "#666"
 USER_BG = "#128C7E"
 BOT_BG = "#262626"
+ERROR_COLOR = "#ff6b6b"
 CHAT_WIDTH = 0.75  # 75% of the screen width for messages
 BORDER_RADIUS = 15
 
-# Chat history to maintain context
+# Messages shown in the chat area, kept by chat_view (the model's context lives in llm.GetContext)
 chat_history = []
 
-def encode_image(image_path):
-    try:
-        if os.path.getsize(image_path) > 4 * 1024 * 1024:
-            return None, "Error: Image size exceeds 4MB limit."
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode("utf-8"), None
-    except Exception as e:
-        return None, f"Error encoding image: {e}"
-
-def generate_context_prompt(query):
-    """Generate a prompt that includes chat history context"""
-    # Only use the last 5 exchanges (10 messages) to avoid making the prompt too long
-    recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
-    
-    context_prompt = "Previous conversation:\n"
-    for msg in recent_history:
-        role = "User" if msg["role"] == "user" else "Assistant"
-        context_prompt += f"{role}: {msg['content']}\n"
-    
-    context_prompt += f" Current query: {query} "
-    context_prompt += " Please respond to the current query with consideration of the conversation history."
-    
-    return context_prompt
+def run_bot_job(fn, *args, error_prefix="Error"):
+    # Run fn(job, *args) in the background, streaming job.emit(text) into a new bot message
+    message_id = chat_view.append("assistant", "…")
+    streamed = []
+
+    def on_progress(text):
+        streamed.append(text)
+        chat_view.set_text(message_id, "".join(streamed))
+
+    def on_done(result):
+        if result is None:
+            chat_view.set_text(message_id, "".join(streamed) + " [cancelled]")
+            return
+        chat_view.set_text(message_id, result)
+
+    def on_error(e):
+        chat_view.set_text(message_id, f"{error_prefix}: {e}")
+
+    return executor.submit(fn, *args, on_progress=on_progress, on_done=on_done, on_error=on_error)
 
 def send_message():
     query = entry.get().strip()
@@ -66,161 +50,39 @@ def send_message():
         return
     
     # Add user message to chat history
-    chat_history.append({"role": "user", "content": query})
-    
-    # Display user message in chat area
-    chat_area.config(state=tk.NORMAL)
-    chat_area.window_create(tk.END, window=create_chat_bubble(query, "user"))
-    chat_area.insert(tk.END, "\n\n")
-    chat_area.config(state=tk.DISABLED)
+    chat_view.append("user", query)
     entry.delete(0, tk.END)
     
-    # Instead of modifying the ChatBot function, we'll create a contextual prompt
-    if len(chat_history) > 1:  # If we have history
-        contextual_query = generate_context_prompt(query)
-        response = ChatBot(contextual_query)
-    else:
-        # If no history, just use the original query
-        response = ChatBot(query)
-    
-    # Add AI response to chat history
-    chat_history.append({"role": "assistant", "content": response})
-    
-    # Display AI response in chat area
-    chat_area.config(state=tk.NORMAL)
-    chat_area.window_create(tk.END, window=create_chat_bubble(response, "bot"))
-    chat_area.insert(tk.END, "\n\n")
-    chat_area.config(state=tk.DISABLED)
-    chat_area.yview(tk.END)
-
-def create_chat_bubble(text, sender):
-    # Get current window width to calculate appropriate wraplength
-    current_width = root.winfo_width()
-    # Use a minimum width for cases when the function is called before window is fully rendered
-    if current_width < 100:  # arbitrary small number
-        current_width = 600  # default fallback width
-    
-    wrap_length = int(current_width * CHAT_WIDTH)
-    
-    bubble_frame = tk.Frame(chat_area, bg=USER_BG if sender == "user" else BOT_BG, bd=0, relief=tk.FLAT)
-    bubble_label = tk.Label(
-        bubble_frame,
-        text=text,
-        wraplength=wrap_length,
-        justify=tk.LEFT if sender == "bot" else tk.RIGHT,
-        bg=USER_BG if sender == "user" else BOT_BG,
-        fg=TEXT_COLOR,
-        padx=15, pady=10,
-        font=("Arial", 12),
-        bd=0,
-        relief=tk.FLAT
-    )
-    bubble_label.pack(padx=10, pady=5)
-    
-    # Bind to configure event to update wraplength when window size changes
-    def update_wraplength(event=None):
-        new_width = root.winfo_width()
-        if new_width > 100:  # Ignore spurious resize events
-            bubble_label.config(wraplength=int(new_width * CHAT_WIDTH))
-    
-    root.bind("<Configure>", update_wraplength)
-    
-    return bubble_frame
+    # ChatBot assembles the conversation context itself under its token budget
+    run_bot_job(lambda job: ChatBot(query, on_token=job.emit, cancel=job.cancel_event))
 
 def upload_prescription():
     file_path = filedialog.askopenfilename(
         filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.bmp"), ("All files", "*.*")]
     )
     if file_path:
-        try:
-            img = Image.open(file_path)
-            prescription_text = pytesseract.image_to_string(img) or "No text detected in image."
-            
-            # Add prescription upload to chat history
-            upload_message = "I've uploaded a prescription image."
-            chat_history.append({"role": "user", "content": upload_message})
-            
-            # Display user action in chat area
-            chat_area.config(state=tk.NORMAL)
-            chat_area.window_create(tk.END, window=create_chat_bubble(upload_message, "user"))
-            chat_area.insert(tk.END, "\n\n")
-            chat_area.config(state=tk.DISABLED)
-            
-            # Generate response that's aware of chat history
-            if len(chat_history) > 1:
-                contextual_query = f"{generate_context_prompt('Analyze this prescription.')} Prescription text: {prescription_text}"
-                response = parse_prescription(prescription_text)  # Keep original parsing
-            else:
-                response = parse_prescription(prescription_text)
-            
-            # Add AI response to chat history
-            chat_history.append({"role": "assistant", "content": response})
-            
-            # Display AI response
-            chat_area.config(state=tk.NORMAL)
-            chat_area.window_create(tk.END, window=create_chat_bubble(response, "bot"))
-            chat_area.insert(tk.END, "\n\n")
-            chat_area.config(state=tk.DISABLED)
-            chat_area.yview(tk.END)
-        except Exception as e:
-            chat_area.config(state=tk.NORMAL)
-            chat_area.insert(tk.END, f"Error processing image: {e}\n", "error")
-            chat_area.config(state=tk.DISABLED)
-            chat_area.yview(tk.END)
+        # Add prescription upload to chat history
+        upload_message = "I've uploaded a prescription image."
+        chat_view.append("user", upload_message)
+        run_bot_job(prescription_job, file_path, error_prefix="Error processing image")
 
 def upload_medical_image():
-    file_path = filedialog.askopenfilename(
+    # Several files are analyzed together as views of one study (e.g. PA and lateral)
+    file_paths = filedialog.askopenfilenames(
         filetypes=[("Image files", "*.png;*.jpg;*.jpeg;*.bmp"), ("All files", "*.*")]
     )
-    if file_path:
-        image_base64, error = encode_image(file_path)
-        if error:
-            chat_area.config(state=tk.NORMAL)
-            chat_area.insert(tk.END, f"{error}\n", "error")
-            chat_area.config(state=tk.DISABLED)
-            return
-
+    if file_paths:
         # Add medical image upload to chat history
-        upload_message = "I've uploaded a medical image for analysis."
-        chat_history.append({"role": "user", "content": upload_message})
-        
-        # Display user action in chat area
-        chat_area.config(state=tk.NORMAL)
-        chat_area.window_create(tk.END, window=create_chat_bubble(upload_message, "user"))
-        chat_area.insert(tk.END, "\n\n")
-        chat_area.config(state=tk.DISABLED)
-        
-        # FIXED: Include context in the user message instead of system message
-        context_text = ""
-        if len(chat_history) > 2:
-            # Extract recent conversation context (excluding the current upload)
-            recent_msgs = chat_history[:-1]
-            recent_msgs = recent_msgs[-6:] if len(recent_msgs) > 6 else recent_msgs
-            context_text = "Based on our previous conversation: " + " ".join([f"{msg['role']}: {msg['content']}" for msg in recent_msgs]) + ". "
-        
-        prompt_text = f"{context_text}Analyze this medical image in depth. Identify all visible anatomical structures, potential abnormalities, and relevant medical findings. Compare it to normal medical standards. Explain possible conditions with causes, symptoms, and next diagnostic steps. Provide insights based on visual patterns, color variations, and any visible anomalies."
-            
-        chat_completion = client.chat.completions.create(
-            model="llama-3.2-90b-vision-preview",
-            messages=[
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt_text},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
-                ]}
-            ],
-            max_tokens=1024
-        )
-        result = chat_completion.choices[0].message.content
-        
-        # Add AI response to chat history
-        chat_history.append({"role": "assistant", "content": result})
-        
-        # Display AI response
-        chat_area.config(state=tk.NORMAL)
-        chat_area.window_create(tk.END, window=create_chat_bubble(result, "bot"))
-        chat_area.insert(tk.END, "\n\n")
-        chat_area.config(state=tk.DISABLED)
-        chat_area.yview(tk.END)
+        if len(file_paths) == 1:
+            upload_message = "I've uploaded a medical image for analysis."
+        else:
+            upload_message = f"I've uploaded {len(file_paths)} medical images of one study for analysis."
+        chat_view.append("user", upload_message)
+        run_bot_job(scan_job, list(file_paths), upload_message, error_prefix="Error analyzing image")
+
+# Function to cancel all in-flight and queued requests
+def cancel_requests():
+    executor.cancel_all()
 
 # Function to save chat history
 def save_chat():
@@ -234,42 +96,39 @@ def save_chat():
                 role = "User" if message["role"] == "user" else "MediMind AI"
                 file.write(f"{role}: {message['content']}\n\n")
         
-        save_message = "Chat history saved successfully."
-        chat_area.config(state=tk.NORMAL)
-        chat_area.window_create(tk.END, window=create_chat_bubble(save_message, "bot"))
-        chat_area.insert(tk.END, "\n\n")
-        chat_area.config(state=tk.DISABLED)
-        chat_area.yview(tk.END)
+        chat_view.append("assistant", "Chat history saved successfully.")
 
 # Function to clear chat history
 def clear_chat():
-    global chat_history
-    chat_history = []
-    chat_area.config(state=tk.NORMAL)
-    chat_area.delete(1.0, tk.END)
-    chat_area.config(state=tk.DISABLED)
+    # Replies still streaming belong to the old conversation; their messages are gone
+    executor.cancel_all()
+    chat_view.clear()
     
     # Add initial message
-    welcome_message = "Chat history cleared. How can I help you today?"
-    chat_area.config(state=tk.NORMAL)
-    chat_area.window_create(tk.END, window=create_chat_bubble(welcome_message, "bot"))
-    chat_area.insert(tk.END, "\n\n")
-    chat_area.config(state=tk.DISABLED)
-    chat_area.yview(tk.END)
-    
-    # Add welcome message to chat history
-    chat_history.append({"role": "assistant", "content": welcome_message})
+    chat_view.append("assistant", "Chat history cleared. How can I help you today?")
 
 # Function to adjust UI for window resizing
+compact_layout = None
+
 def on_window_resize(event=None):
+    global compact_layout
+    # <Configure> fires for every child widget too; only the window itself matters here
+    if event is not None and event.widget is not root:
+        return
     window_width = root.winfo_width()
     
     # Only process legitimate resize events
     if window_width < 100:
         return
     
+    # Re-pack the input row only when crossing the layout breakpoint
+    compact = window_width < 700
+    if compact == compact_layout:
+        return
+    compact_layout = compact
+    
     # Adjust button layout based on window width
-    if window_width < 700:  # For smaller screens
+    if compact:  # For smaller screens
         # Stack buttons vertically
         entry.pack(side=tk.TOP, padx=5, pady=(0, 5), expand=True, fill=tk.X, ipady=10)
         send_button.pack(side=tk.TOP, padx=5, pady=(0, 5), fill=tk.X)
@@ -281,25 +140,6 @@ def on_window_resize(event=None):
         send_button.pack(side=tk.LEFT, padx=(0, 5))
         upload_prescription_button.pack(side=tk.LEFT, padx=(0, 5))
         upload_medical_image_button.pack(side=tk.LEFT)
-    
-    # Force update of all chat bubbles by recreating them
-    update_all_chat_bubbles()
-
-# Function to recreate all chat bubbles with proper wrapping
-def update_all_chat_bubbles():
-    if not chat_history:
-        return
-    
-    chat_area.config(state=tk.NORMAL)
-    chat_area.delete(1.0, tk.END)
-    
-    for message in chat_history:
-        bubble = create_chat_bubble(message["content"], "user" if message["role"] == "user" else "bot")
-        chat_area.window_create(tk.END, window=bubble)
-        chat_area.insert(tk.END, "\n\n")
-    
-    chat_area.config(state=tk.DISABLED)
-    chat_area.yview(tk.END)
 
 # Function to set appropriate initial size based on screen dimensions
 def set_initial_window_size():
@@ -328,6 +168,11 @@ def set_initial_window_size():
 root = tk.Tk()
 root.title("MediMind AI Chat")
 root.configure(bg=BG_COLOR)
+startup.mark("create window")
+
+# LLM and OCR work runs off the UI thread; results come back through root.after
+executor = JobExecutor(root)
+root.bind("<Escape>", lambda event: cancel_requests())
 
 # Set initial window size based on screen dimensions
 set_initial_window_size()
@@ -337,11 +182,19 @@ chat_area = ScrolledText(root, wrap=tk.WORD, state=tk.DISABLED, bg=BG_COLOR, fg=
 chat_area.pack(padx=10, pady=10, expand=True, fill=tk.BOTH)
 chat_area.bind_all("<MouseWheel>", lambda event: chat_area.yview_scroll(-1*(event.delta//120), "units"))
 
+# Messages are rendered as styled text runs; wrapping on resize is handled by the widget
+chat_view = ChatView(
+    chat_area, chat_history,
+    {"user": USER_BG, "bot": BOT_BG, "text": TEXT_COLOR, "error": ERROR_COLOR},
+    width_fraction=CHAT_WIDTH
+)
+
 # Menu bar for additional options
 menubar = tk.Menu(root)
 file_menu = tk.Menu(menubar, tearoff=0)
 file_menu.add_command(label="Save Chat", command=save_chat)
 file_menu.add_command(label="Clear Chat", command=clear_chat)
+file_menu.add_command(label="Cancel Requests", command=cancel_requests, accelerator="Esc")
 file_menu.add_separator()
 file_menu.add_command(label="Exit", command=root.quit)
 menubar.add_cascade(label="File", menu=file_menu)
@@ -376,18 +229,30 @@ upload_medical_image_button.pack(side=tk.LEFT)
 # Bind the window resize event
 root.bind("<Configure>", on_window_resize)
 
-# Display welcome message
-welcome_message = "Welcome to MediMind AI Chat. How can I help you today?"
-chat_area.config(state=tk.NORMAL)
-chat_area.window_create(tk.END, window=create_chat_bubble(welcome_message, "bot"))
-chat_area.insert(tk.END, "\n\n")
-chat_area.config(state=tk.DISABLED)
-
-# Add welcome message to chat history
-chat_history.append({"role": "assistant", "content": welcome_message})
+# Display welcome message (also added to chat history)
+chat_view.append("assistant", "Welcome to MediMind AI Chat. How can I help you today?")
 
 # After window is fully loaded, trigger a resize event to properly layout elements
 root.update()
 root.after(100, on_window_resize)  # Short delay to ensure window is fully rendered
-
-root.mainloop()
\ No newline at end of file
+startup.mark("build widgets")
+
+def warm_up(job):
+    # Create the Groq client, open the chat log and index the conversation history
+    # off the UI thread while the user types
+    llm.GetClient()
+    llm.GetChatLog()
+    llm.GetContext()
+
+def on_warmed_up(result):
+    startup.mark("warm up (background)")
+    if startup.requested():
+        startup.report()
+
+def on_first_idle():
+    startup.mark("first idle")
+    executor.submit(warm_up, on_done=on_warmed_up, on_error=lambda e: None)
+
+root.after_idle(on_first_idle)
+root.mainloop()
+executor.shutdown()
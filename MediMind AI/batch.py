@@ -0,0 +1,236 @@
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import scheduler
+from llm import ChatBotStateless, CachedAnswer
+from diagnosis import analyze_symptoms, PROMPT_TEMPLATE as DIAGNOSIS_TEMPLATE
+from prescription import parse_prescription, PROMPT_TEMPLATE as PRESCRIPTION_TEMPLATE
+from rxparse import extract, format_medications
+
+# Batch mode for main.py: stream records from a JSONL/CSV file or a directory of
+# .txt files and prescription images (OCR'd first), run them with bounded
+# concurrency, and append each result to a JSONL output file as soon as it
+# completes. Their LLM calls go through the shared scheduler at batch priority,
+# so they use the API's spare capacity and give way to interactive chat; --rpm
+# adds a lower cap of its own.
+#
+# The output file doubles as the checkpoint: on restart, records whose id already
+# has a successful result there are skipped. Batch calls are stateless, so they
+# never touch the shared chat log. Prescriptions the local extractor (rxparse)
+# understands confidently are answered without a network call or a rate-limit
+# token; their results carry the structured medications and "source": "local".
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# task -> (function, prompt template, its response-cache task name)
+TASKS = {
+    "parse": (parse_prescription, PRESCRIPTION_TEMPLATE, "parse_prescription"),
+    "diagnose": (analyze_symptoms, DIAGNOSIS_TEMPLATE, "analyze_symptoms"),
+}
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` acquisitions per minute (0 = unlimited)."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1, per_minute // 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class BadRow:
+    def __init__(self, message):
+        self.message = message
+
+
+def _json_row(line):
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        return BadRow(f"Invalid JSON: {e}")
+    return row if isinstance(row, dict) else BadRow("Invalid JSON: not an object")
+
+
+def read_records(path, default_task):
+    # Yield {"id", "task", "text"} records without loading the whole input; a
+    # line that cannot be read yields {"id", "task", "error"} instead
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".txt"):
+                with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+                    yield {"id": name, "task": default_task, "text": f.read()}
+            elif name.lower().endswith(IMAGE_EXTENSIONS):
+                yield {"id": name, "task": default_task, "image": os.path.join(path, name)}
+        return
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (_json_row(line) for line in f if line.strip())
+        for number, row in enumerate(rows, 1):
+            if isinstance(row, BadRow):
+                yield {"id": str(number), "task": default_task, "error": row.message}
+                continue
+            # Falsy ids such as 0 are real ids; only a missing one (or an empty CSV cell) gets the line number
+            record_id = row.get("id")
+            yield {
+                "id": str(number if record_id is None or record_id == "" else record_id),
+                "task": row.get("task") or default_task,
+                "text": row.get("text") or "",
+            }
+
+
+def completed_ids(output_path):
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if "error" not in result:
+                    done.add(result["id"])
+    return done
+
+
+def run_record(record, limiter, cache, local=True):
+    with scheduler.priority(scheduler.BATCH):
+        return _run_record(record, limiter, cache, local)
+
+
+def _run_record(record, limiter, cache, local):
+    function, template, cache_task = TASKS[record["task"]]
+    started = time.perf_counter()
+    result = {"id": record["id"], "task": record["task"]}
+    try:
+        text = record.get("text")
+        if "image" in record:
+            from ocr import ocr_image
+            ocr = ocr_image(record["image"], use_cache=cache)
+            text = result["ocr_text"] = ocr["text"]
+            result["ocr_seconds"] = round(sum(ocr["timings"].values()), 4)
+        if local and record["task"] == "parse":
+            extraction = extract(text)
+            if extraction.is_confident():
+                result["result"] = format_medications(extraction.medications)
+                result["medications"] = [m.to_dict() for m in extraction.medications]
+                result["source"] = "local"
+                result["latency"] = round(time.perf_counter() - started, 4)
+                return result
+        cached = CachedAnswer(cache_task, template, text) if cache else None
+        if cached is not None:
+            # Served from the response cache without using the --rpm budget
+            result["result"] = cached
+            result["source"] = "cache"
+            result["latency"] = round(time.perf_counter() - started, 4)
+            return result
+        result["source"] = "llm"
+        limiter.acquire()
+        if cache:
+            kwargs = {"local": False} if record["task"] == "parse" else {}
+            result["result"] = function(text, cacheable=True, **kwargs)
+        else:
+            result["result"] = ChatBotStateless(template.format(text=text))
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_batch(input_path, output_path, task="parse", concurrency=4, rpm=0, cache=True, local=True):
+    """Process every pending record and return a summary dict."""
+    limiter = RateLimiter(rpm)
+    done = completed_ids(output_path)
+    latencies = []
+    summary = {"processed": 0, "ok": 0, "errors": 0, "skipped": 0, "local": 0}
+    started = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+
+        def write(result):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            summary["processed"] += 1
+            summary["errors" if "error" in result else "ok"] += 1
+
+        def collect(futures):
+            for future in futures:
+                result = future.result()
+                write(result)
+                latencies.append(result["latency"])
+                summary["local"] += result.get("source") == "local"
+
+        for record in read_records(input_path, task):
+            if record["id"] in done:
+                summary["skipped"] += 1
+                continue
+            # A bad record gets an error result of its own; the rest of the run goes on
+            if "error" not in record and record["task"] not in TASKS:
+                record["error"] = f"Unknown task {record['task']!r}"
+            if "error" in record:
+                write({"id": record["id"], "task": record["task"], "error": record["error"]})
+                continue
+            # Keep the number of queued records bounded so huge inputs stream through
+            if len(pending) >= concurrency * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending.add(pool.submit(run_record, record, limiter, cache, local))
+        collect(wait(pending).done)
+
+    elapsed = time.perf_counter() - started
+    summary["seconds"] = round(elapsed, 3)
+    summary["throughput_per_min"] = round(summary["processed"] / elapsed * 60, 2) if elapsed else 0.0
+    summary["latency_p50"] = percentile(latencies, 0.50)
+    summary["latency_p95"] = percentile(latencies, 0.95)
+    summary["latency_max"] = max(latencies) if latencies else 0.0
+    return summary
+
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Run prescriptions or symptom notes in bulk.")
+    parser.add_argument("input", help="JSONL or CSV file (fields: id, text, optional task) or a directory of .txt/image files")
+    parser.add_argument("-o", "--output", help="JSONL results file, also used to resume (default: <input>.results.jsonl)")
+    parser.add_argument("--task", choices=sorted(TASKS), default="parse", help="task for records without one")
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=0,
+                        help="requests per minute for this batch, 0 to only keep to the API limits (RateLimits)")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    parser.add_argument("--no-local", action="store_true", help="send every prescription to the LLM")
+    args = parser.parse_args(argv)
+
+    output = args.output or args.input.rstrip("/\\") + ".results.jsonl"
+    summary = run_batch(args.input, output, args.task, args.concurrency, args.rpm, not args.no_cache,
+                        not args.no_local)
+    print(f"Results written to {output}")
+    for key, value in summary.items():
+        print(f"{key}: {value}")
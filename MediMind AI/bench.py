@@ -0,0 +1,289 @@
+import os
+import gc
+import sys
+import importlib.util
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import llm
+from cache import ResponseCache
+from chatlog import open_chat_log
+from diagnosis import analyze_symptoms
+from prescription import parse_prescription
+from fake_groq import FakeConfig, start_server
+from hedge import HedgePolicy
+from llm_client import ResilientClient
+from scheduler import Scheduler
+from config import parent_dir, data_dir
+
+# End-to-end latency benchmarks against the local fake Groq endpoint.
+#
+#   python bench.py                      # run everything, save results, compare with the last run
+#   python bench.py --ttft 0.3 --turns 50 --concurrency 8
+#
+# Results are saved as JSON under Data/Benchmarks/ (named by time and git
+# revision) so runs can be compared across commits with --compare.
+
+results_dir = os.path.join(data_dir, "Benchmarks")
+sample_image = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xray.jpg")
+
+SYMPTOMS = "fever of 38.5C for two days, dry cough and sore throat"
+PRESCRIPTION = "Tab Amoxicillin 500mg TDS x 5 days, Tab Paracetamol 650mg SOS, Syp Benadryl 10ml HS"
+
+
+def summarize(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+
+    return {
+        "n": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+class BenchJob:
+    # Stand-in for worker.Job when driving the GUI jobs headless
+    def __init__(self):
+        self.cancel_event = threading.Event()
+        self.started = time.perf_counter()
+        self.first_token = None
+
+    def emit(self, text):
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.started
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class NullAnalysisStore:
+    # Never reuses an earlier image analysis, so every run pays for the vision call
+    def find(self, image, model, session, near=False):
+        return None
+
+    def save(self, image, model, result, session):
+        pass
+
+
+def timed_call(fn):
+    job = BenchJob()
+    fn(job)
+    return time.perf_counter() - job.started, job.first_token
+
+
+def bench_chatbot(turns):
+    totals, ttfts = [], []
+    for i in range(turns):
+        total, ttft = timed_call(lambda job: llm.ChatBot(f"Question {i}: {SYMPTOMS}", "bench-chat", on_token=job.emit))
+        totals.append(total)
+        ttfts.append(ttft or total)
+    return {"total": summarize(totals), "ttft": summarize(ttfts)}
+
+
+def bench_entry_points(repeats):
+    results = {}
+    for name, fn, text in (("analyze_symptoms", analyze_symptoms, SYMPTOMS),
+                           ("parse_prescription", parse_prescription, PRESCRIPTION)):
+        totals = [timed_call(lambda job: fn(f"{text} #{i}", on_token=job.emit))[0] for i in range(repeats)]
+        results[name] = summarize(totals)
+    return results
+
+
+def bench_gui_jobs(repeats):
+    results = {}
+    from jobs import medical_image_job
+    if importlib.util.find_spec("PIL") is None:
+        return {"skipped": "image pipeline unavailable: Pillow is not installed"}
+    totals, ttfts = [], []
+    for _ in range(repeats):
+        total, ttft = timed_call(lambda job: medical_image_job(job, sample_image, "bench upload", NullAnalysisStore()))
+        totals.append(total)
+        ttfts.append(ttft or total)
+    results["medical_image_job"] = {"total": summarize(totals), "ttft": summarize(ttfts)}
+    return results
+
+
+def bench_throughput(concurrency, requests):
+    # Unique stateless requests through a thread pool, as batch mode issues them
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        analyze_symptoms(f"{SYMPTOMS} (case {i})", cacheable=True)
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "requests": requests,
+            "requests_per_second": round(requests / elapsed, 2), "latency": summarize(latencies)}
+
+
+def bench_hedging(requests, ttft, slow_rate=0.05, slow_ttft=2.0, seed=2):
+    # Time to first token of streams with an occasional slow one, without and with hedging
+    config = FakeConfig(ttft=ttft, token_delay=0.0, slow_rate=slow_rate, slow_ttft=slow_ttft)
+    server, base_url = start_server(config)
+    messages = [{"role": "user", "content": SYMPTOMS}]
+    results = {}
+    # A short warm-up, and a fallback deadline below slow_ttft, so the policy can hedge within a short run
+    warm_policy = HedgePolicy(min_samples=5, max_delay=max(0.5, slow_ttft / 2))
+    for name, policy in (("off", None), ("on", warm_policy)):
+        client = ResilientClient("bench", base_url=base_url, hedging=policy)
+        # Both runs draw the same slow requests
+        config.random = random.Random(seed)
+        config.requests = 0
+        ttfts = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            _model, stream = client.complete(llm.ChatModel, messages, max_tokens=64, stream=True)
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+            ttfts.append(time.perf_counter() - started)
+            stream.close()
+        results[name] = {"ttft": summarize(ttfts), "upstream_requests": config.requests}
+        if policy:
+            results[name]["hedging"] = dict(policy.stats)
+    server.shutdown()
+    return results
+
+
+def bench_chat_log(messages, directory):
+    results = {}
+    for backend in ("jsonl", "sqlite"):
+        store = open_chat_log(os.path.join(directory, f"log-{backend}"), backend)
+        appends = []
+        for i in range(messages):
+            started = time.perf_counter()
+            store.append("bench", "user" if i % 2 == 0 else "assistant", f"message {i} " + "lorem ipsum " * 20)
+            appends.append(time.perf_counter() - started)
+        tails = []
+        for _ in range(50):
+            started = time.perf_counter()
+            store.tail(50, "bench")
+            tails.append(time.perf_counter() - started)
+        store.close()
+        results[backend] = {"append": summarize(appends), "tail50": summarize(tails)}
+    return results
+
+
+def bench_memory(turns):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    checkpoints = {}
+    for i in range(1, turns + 1):
+        llm.ChatBot(f"Follow-up {i}: {SYMPTOMS}", "bench-memory")
+        if i % max(1, turns // 5) == 0 or i == turns:
+            gc.collect()
+            checkpoints[i] = round((tracemalloc.get_traced_memory()[0] - baseline) / 1024, 1)
+    tracemalloc.stop()
+    return {"kib_after_turns": checkpoints}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=parent_dir, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(current, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\nCompared with {os.path.basename(previous_path)} ({previous.get('revision', '?')}):")
+    old, new = flatten(previous["results"]), flatten(current["results"])
+    for key in sorted(new):
+        if key in old and (key.endswith("_ms") or key.endswith("per_second")) and old[key]:
+            change = (new[key] - old[key]) / old[key] * 100
+            print(f"  {key:55s} {old[key]:>10} -> {new[key]:>10} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MediMind AI latency benchmarks (offline, fake Groq endpoint).")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--turns", type=int, default=30, help="ChatBot turns for latency and memory growth")
+    parser.add_argument("--repeats", type=int, default=10, help="calls per entry point")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64, help="requests for the throughput run")
+    parser.add_argument("--log-messages", type=int, default=5000)
+    parser.add_argument("--hedge-requests", type=int, default=100, help="streams per hedging run (off and on)")
+    parser.add_argument("--compare", help="results file to compare with (default: the latest saved run)")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args(argv)
+
+    server, base_url = start_server(FakeConfig(ttft=args.ttft, token_delay=args.token_delay, seed=1))
+    llm.UseEndpoint(base_url, api_key="bench")
+    llm.UseResponseCache(ResponseCache(None))
+    # The fake endpoint has no rate limits to keep to
+    llm.UseScheduler(Scheduler({}, 0, 0))
+    with tempfile.TemporaryDirectory() as directory:
+        llm.UseChatLog(open_chat_log(os.path.join(directory, "chat"), "jsonl"))
+        results = {
+            "chatbot": bench_chatbot(args.turns),
+            "entry_points": bench_entry_points(args.repeats),
+            "gui_jobs": bench_gui_jobs(args.repeats),
+            "throughput": bench_throughput(args.concurrency, args.requests),
+            "hedging": bench_hedging(args.hedge_requests, args.ttft),
+            "chat_log_io": bench_chat_log(args.log_messages, directory),
+            "memory": bench_memory(args.turns),
+        }
+        llm.GetChatLog().close()
+    server.shutdown()
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": vars(args),
+        "results": results,
+    }
+    print(json.dumps(report["results"], indent=2))
+
+    previous = args.compare
+    if previous is None and os.path.isdir(results_dir):
+        saved = sorted(name for name in os.listdir(results_dir) if name.endswith(".json"))
+        previous = os.path.join(results_dir, saved[-1]) if saved else None
+    if previous:
+        compare(report, previous)
+    if not args.no_save:
+        # Only a saved run creates the results directory
+        os.makedirs(results_dir, exist_ok=True)
+        path = os.path.join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['revision']}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import sqlite3
+import threading
+
+# Conversation stores used by llm.ChatBot.
+#
+# Both backends share the same small interface:
+#   append(session_id, role, content)  -> O(1), no rewrite of old history
+#   tail(n, session_id)                -> last n messages of a session, oldest first
+#   flush() / close()
+#
+# Writes are flushed to the OS on every append and fsync'ed in batches
+# (every `fsync_every` appends or `fsync_interval` seconds, whichever comes first).
+
+DEFAULT_SESSION = "default"
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class JSONLChatLog:
+    """Append-only JSONL store split into size-bounded segment files.
+
+    Each closed segment gets a small "segment-NNNNNN.sessions" file listing the
+    sessions it holds, so tail() only reads the segments of the session asked
+    for, however long the rest of the history is. Missing index files (older
+    logs, a crash before rotation) are rebuilt on open.
+    """
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, fsync_every=16, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segments()
+        self._index = int(segments[-1][8:14]) if segments else 1
+        self._file = open(self._segment_path(self._index), "ab")
+        # segment file name -> sessions with messages in it
+        self._sessions = {}
+        current = os.path.basename(self._segment_path(self._index))
+        for name in segments:
+            sessions = _read_session_index(self._index_path(name)) if name != current else None
+            if sessions is None:
+                sessions = _scan_sessions(os.path.join(self.directory, name))
+                if name != current:
+                    _write_session_index(self._index_path(name), sessions)
+            self._sessions[name] = sessions
+        self._sessions.setdefault(current, set())
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, f"segment-{index:06d}.jsonl")
+
+    def _index_path(self, name):
+        return os.path.join(self.directory, name[:-len(".jsonl")] + ".sessions")
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name.endswith(".jsonl"))
+
+    def is_empty(self):
+        return all(os.path.getsize(os.path.join(self.directory, name)) == 0 for name in self._segments())
+
+    def append(self, session_id, role, content):
+        record = {"session": session_id, "role": role, "content": content, "ts": time.time()}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file.tell() and self._file.tell() + len(line) > self.segment_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._sessions[os.path.basename(self._file.name)].add(session_id)
+            self._pending += 1
+            self._maybe_sync()
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        closed = os.path.basename(self._file.name)
+        _write_session_index(self._index_path(closed), self._sessions[closed])
+        self._index += 1
+        self._file = open(self._segment_path(self._index), "ab")
+        self._sessions[os.path.basename(self._file.name)] = set()
+
+    def _maybe_sync(self):
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self):
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def tail(self, n, session_id=DEFAULT_SESSION):
+        result = []
+        if n <= 0:
+            return result
+        with self._lock:
+            self._file.flush()
+            for name in reversed(self._segments()):
+                if session_id is not None and session_id not in self._sessions.get(name, ()):
+                    continue
+                for line in _reverse_lines(os.path.join(self.directory, name)):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write; skip it
+                        continue
+                    if session_id is None or record.get("session") == session_id:
+                        result.append({"role": record["role"], "content": record["content"]})
+                        if len(result) >= n:
+                            return result[::-1]
+        return result[::-1]
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._sync()
+                self._file.close()
+
+
+def _scan_sessions(path):
+    sessions = set()
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                sessions.add(json.loads(line).get("session"))
+            except ValueError:
+                continue
+    return sessions
+
+
+def _read_session_index(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def _write_session_index(path, sessions):
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(sorted(sessions, key=str), f)
+    os.replace(temporary, path)
+
+
+def _reverse_lines(path, block_size=64 * 1024):
+    # Yield the lines of a file from last to first without reading it whole
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            block = f.read(step) + remainder
+            lines = block.split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line.decode("utf-8", errors="replace")
+        if remainder.strip():
+            yield remainder.decode("utf-8", errors="replace")
+
+
+class SQLiteChatLog:
+    """SQLite store in WAL mode with batched commits."""
+
+    def __init__(self, path, fsync_every=16, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level="DEFERRED")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, ts REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session, id)")
+        self._db.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM messages LIMIT 1").fetchone() is None
+
+    def append(self, session_id, role, content):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO messages (session, role, content, ts) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, time.time()),
+            )
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def tail(self, n, session_id=DEFAULT_SESSION):
+        if n <= 0:
+            return []
+        with self._lock:
+            if session_id is None:
+                rows = self._db.execute(
+                    "SELECT role, content FROM messages ORDER BY id DESC LIMIT ?", (n,)
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT role, content FROM messages WHERE session = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, n),
+                ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._commit()
+                self._db.close()
+                self._db = None
+
+
+def migrate_json_log(json_path, store, session_id=DEFAULT_SESSION):
+    """One-time import of a legacy ChatLog.json list into `store`.
+
+    The legacy file is renamed to `<name>.migrated` so the import never runs twice.
+    Returns the number of messages imported.
+    """
+    if not os.path.exists(json_path):
+        return 0
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            messages = json.load(f)
+    except ValueError:
+        messages = []
+    count = 0
+    for msg in messages:
+        if isinstance(msg, dict) and "role" in msg and "content" in msg:
+            store.append(session_id, msg["role"], msg["content"])
+            count += 1
+    store.flush()
+    os.replace(json_path, json_path + ".migrated")
+    return count
+
+
+def open_chat_log(data_dir, backend="jsonl", legacy_path=None):
+    """Open the conversation store under `data_dir`, migrating `legacy_path` if present."""
+    if backend == "sqlite":
+        store = SQLiteChatLog(os.path.join(data_dir, "ChatLog.sqlite3"))
+    elif backend == "jsonl":
+        store = JSONLChatLog(os.path.join(data_dir, "ChatLog"))
+    else:
+        raise ValueError(f"Unknown chat log backend: {backend}")
+    if legacy_path and os.path.exists(legacy_path) and store.is_empty():
+        migrate_json_log(legacy_path, store)
+    atexit.register(store.close)
+    return store
@@ -0,0 +1,218 @@
+import tkinter as tk
+
+# Chat rendering for the Tk GUI.
+#
+# Messages are styled text runs inside the ScrolledText instead of one Frame +
+# Label per bubble: the Text widget wraps them itself, so a resize only updates
+# the margins of two tags (debounced) and never rebuilds anything. Each rendered
+# message is delimited by a pair of marks so a streaming reply can be updated in
+# place. At most `max_rendered` messages live in the widget; older ones are
+# rendered a page at a time when the user scrolls to the top (dropping the
+# newest ones), and newer ones again when they scroll back down.
+#
+# Messages are addressed by a stable id rather than their list index: clear()
+# empties the list while background jobs may still be streaming into a message,
+# and set_text() on an id that has been cleared away does nothing.
+
+
+class ChatView:
+    def __init__(self, text, messages, colors, width_fraction=0.75, page_size=50, max_rendered=200, resize_delay_ms=120):
+        self.text = text
+        self.messages = messages  # list of {"role", "content"}, shared with the caller
+        self.width_fraction = width_fraction
+        self.page_size = page_size
+        self.max_rendered = max_rendered
+        self.resize_delay_ms = resize_delay_ms
+        self.first_rendered = 0  # index of the oldest message currently in the widget
+        self.end_rendered = 0    # index after the newest one
+        self.base_id = 0         # id of messages[0]; ids are never reused
+        self._resize_job = None
+        self._loading = False
+
+        font = ("Arial", 12)
+        text.tag_configure("user", justify=tk.RIGHT, background=colors["user"], foreground=colors["text"],
+                           font=font, spacing1=6, spacing3=6, rmargin=10)
+        text.tag_configure("bot", justify=tk.LEFT, background=colors["bot"], foreground=colors["text"],
+                           font=font, spacing1=6, spacing3=6, lmargin1=10, lmargin2=10)
+        text.tag_configure("error", foreground=colors["error"], font=font, lmargin1=10, lmargin2=10)
+
+        scrollbar = getattr(text, "vbar", None)
+        self._scroll_set = scrollbar.set if scrollbar else None
+        text.configure(yscrollcommand=self._on_yscroll)
+        text.bind("<Configure>", self._on_configure, add="+")
+
+    # --- public API -------------------------------------------------------
+
+    def append(self, role, content):
+        """Add a message and render it at the bottom; returns its id."""
+        self.messages.append({"role": role, "content": content})
+        index = len(self.messages) - 1
+        if self.end_rendered < index:
+            # The user paged back through old messages; jump to the newest ones
+            self._show_latest()
+        else:
+            self._edit(lambda: self._render(index, tk.END))
+            self.end_rendered = index + 1
+            self._trim()
+        self.text.yview(tk.END)
+        return self.base_id + index
+
+    def set_text(self, message_id, content):
+        """Replace the content of message `message_id` (e.g. while a reply streams
+        in); ignored if the message has been cleared."""
+        index = message_id - self.base_id
+        if not 0 <= index < len(self.messages):
+            return
+        self.messages[index]["content"] = content
+        if not self.first_rendered <= index < self.end_rendered:
+            return
+        start, end = self._marks(index)
+        at_bottom = self.text.yview()[1] >= 0.999
+
+        def replace():
+            self.text.delete(start, end)
+            self.text.insert(end, content, self._tag(index))
+
+        self._edit(replace)
+        if at_bottom:
+            self.text.yview(tk.END)
+
+    def clear(self):
+        self._unset_marks(self.first_rendered, self.end_rendered)
+        self.base_id += len(self.messages)
+        self.messages.clear()
+        self.first_rendered = self.end_rendered = 0
+        self._edit(lambda: self.text.delete("1.0", tk.END))
+
+    # --- rendering --------------------------------------------------------
+
+    def _marks(self, index):
+        message_id = self.base_id + index
+        return f"msg{message_id}_start", f"msg{message_id}_end"
+
+    def _tag(self, index):
+        role = self.messages[index]["role"]
+        return "user" if role == "user" else "error" if role == "error" else "bot"
+
+    def _render(self, index, position):
+        # Inserts "<content>\n\n" at `position` with marks around the content.
+        # The start mark has left gravity and the end mark right gravity, so
+        # text inserted between them (set_text) stays inside the message.
+        start, end = self._marks(index)
+        at = self.text.index("end - 1 chars" if position == tk.END else position)
+        self.text.insert(at, "\n\n")
+        self.text.mark_set(start, at)
+        self.text.mark_gravity(start, tk.LEFT)
+        self.text.mark_set(end, at)
+        self.text.mark_gravity(end, tk.RIGHT)
+        self.text.insert(at, self.messages[index]["content"], self._tag(index))
+
+    def _unset_marks(self, first, end):
+        for index in range(first, end):
+            self.text.mark_unset(*self._marks(index))
+
+    def _edit(self, action):
+        self.text.config(state=tk.NORMAL)
+        try:
+            action()
+        finally:
+            self.text.config(state=tk.DISABLED)
+
+    def _show_latest(self):
+        # Re-render only the newest `max_rendered` messages
+        self._unset_marks(self.first_rendered, self.end_rendered)
+        self.first_rendered = max(0, len(self.messages) - self.max_rendered)
+        self.end_rendered = len(self.messages)
+
+        def render():
+            self.text.delete("1.0", tk.END)
+            for index in range(self.first_rendered, self.end_rendered):
+                self._render(index, tk.END)
+
+        self._edit(render)
+
+    def _trim(self):
+        # Drop the oldest rendered messages once the widget holds too many
+        excess = self.end_rendered - self.first_rendered - self.max_rendered
+        if excess <= 0:
+            return
+        cut = self.first_rendered + excess
+        self._edit(lambda: self.text.delete("1.0", self._marks(cut)[0]))
+        self._unset_marks(self.first_rendered, cut)
+        self.first_rendered = cut
+
+    def _trim_newest(self):
+        # The same from the bottom, after older messages were loaded
+        excess = self.end_rendered - self.first_rendered - self.max_rendered
+        if excess <= 0:
+            return
+        cut = self.end_rendered - excess
+        self._edit(lambda: self.text.delete(self._marks(cut)[0], tk.END))
+        self._unset_marks(cut, self.end_rendered)
+        self.end_rendered = cut
+
+    def _load_older(self):
+        self._loading = False
+        if self.first_rendered == 0:
+            return
+        anchor = self._marks(self.first_rendered)[0]
+        older = max(0, self.first_rendered - self.page_size)
+
+        def prepend():
+            for index in range(self.first_rendered - 1, older - 1, -1):
+                # The current first message starts at 1.0; let it move right of the insert
+                following = self._marks(index + 1)[0]
+                self.text.mark_gravity(following, tk.RIGHT)
+                self._render(index, "1.0")
+                self.text.mark_gravity(following, tk.LEFT)
+
+        self._edit(prepend)
+        self.first_rendered = older
+        self._trim_newest()
+        # Keep the message the user was looking at in place
+        self.text.yview(anchor)
+
+    def _load_newer(self):
+        self._loading = False
+        if self.end_rendered >= len(self.messages):
+            return
+        anchor = self._marks(self.end_rendered - 1)[0]
+        newer = min(len(self.messages), self.end_rendered + self.page_size)
+
+        def render():
+            for index in range(self.end_rendered, newer):
+                self._render(index, tk.END)
+
+        self._edit(render)
+        self.end_rendered = newer
+        self._trim()
+        self.text.yview(anchor)
+
+    def _on_yscroll(self, first, last):
+        if self._scroll_set:
+            self._scroll_set(first, last)
+        if self._loading:
+            return
+        if float(first) <= 0.0 and self.first_rendered > 0:
+            self._loading = True
+            self.text.after_idle(self._load_older)
+        elif float(last) >= 1.0 and self.end_rendered < len(self.messages):
+            self._loading = True
+            self.text.after_idle(self._load_newer)
+
+    # --- resize -----------------------------------------------------------
+
+    def _on_configure(self, event):
+        if self._resize_job is not None:
+            self.text.after_cancel(self._resize_job)
+        self._resize_job = self.text.after(self.resize_delay_ms, self._apply_width)
+
+    def _apply_width(self):
+        self._resize_job = None
+        width = self.text.winfo_width()
+        if width < 100:  # Ignore spurious resize events
+            return
+        # Bubbles use `width_fraction` of the width; the rest becomes the opposite margin
+        margin = int(width * (1 - self.width_fraction))
+        self.text.tag_configure("user", lmargin1=margin, lmargin2=margin)
+        self.text.tag_configure("bot", rmargin=margin)
@@ -0,0 +1,76 @@
+import os
+
+# Shared settings for the GUI, the CLI and the service, read once from the .env
+# file in the project root on first use (importing this module does no I/O).
+
+# Get the parent directory path
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+data_dir = os.path.join(parent_dir, "Data")
+
+
+class Config:
+    def __init__(self, env_vars):
+        self.Username = env_vars.get("Username", "User")
+        self.Assistantname = env_vars.get("Assistantname", "DoctorAI")
+        self.GroqAPIKey = env_vars.get("GroqAPIKey", "YOUR_GROQ_API_KEY")
+
+        self.ChatLogBackend = env_vars.get("ChatLogBackend", "jsonl")
+        self.HistoryLimit = int(env_vars.get("HistoryLimit", 50))
+        self.ContextTokens = int(env_vars.get("ContextTokens", 3000))
+        self.SummaryTokens = int(env_vars.get("SummaryTokens", 400))
+        # Relevance recall of earlier messages (retrieval.py)
+        self.RecallTurns = int(env_vars.get("RecallTurns", 4))
+        self.RecallTokens = int(env_vars.get("RecallTokens", 400))
+        self.RecallHistory = int(env_vars.get("RecallHistory", 5000))
+        self.ResponseCacheSize = int(env_vars.get("ResponseCacheSize", 256))
+        self.ResponseCacheTTL = float(env_vars.get("ResponseCacheTTL", 7 * 24 * 3600))
+
+        self.GroqBaseURL = env_vars.get("GroqBaseURL") or None
+        self.LLMConnectTimeout = float(env_vars.get("LLMConnectTimeout", 5))
+        self.LLMReadTimeout = float(env_vars.get("LLMReadTimeout", 60))
+        self.LLMMaxRetries = int(env_vars.get("LLMMaxRetries", 3))
+        # Provider limits per model for the shared scheduler (scheduler.py); 0 disables
+        self.RateLimitRPM = int(env_vars.get("RateLimitRPM", 30))
+        self.RateLimitTPM = int(env_vars.get("RateLimitTPM", 6000))
+        self.RateLimits = env_vars.get("RateLimits", "")
+        # Hedged streaming requests against slow first tokens (hedge.py)
+        self.Hedging = env_vars.get("Hedging", "off").lower() in ("on", "true", "1", "yes")
+        self.HedgePercentile = float(env_vars.get("HedgePercentile", 0.95))
+        self.HedgeBudget = float(env_vars.get("HedgeBudget", 0.1))
+        self.HedgeMinDelay = float(env_vars.get("HedgeMinDelay", 0.5))
+        self.HedgeMaxDelay = float(env_vars.get("HedgeMaxDelay", 3.0))
+        self.HedgeTarget = env_vars.get("HedgeTarget", "fallback")
+
+        self.MetricsTrace = env_vars.get("MetricsTrace") or None
+        self.MetricsPort = int(env_vars.get("MetricsPort") or 0)
+
+        # HTTP service (service.py)
+        self.ServiceHost = env_vars.get("ServiceHost", "127.0.0.1")
+        self.ServicePort = int(env_vars.get("ServicePort", 8080))
+        self.ServiceConcurrency = int(env_vars.get("ServiceConcurrency", 16))
+        self.ServicePoolSize = int(env_vars.get("ServicePoolSize", 32))
+        self.MaxUploadBytes = int(env_vars.get("MaxUploadBytes", 20 * 1024 * 1024))
+        # Sessions whose context window stays in memory (least recently used are dropped)
+        self.SessionCacheSize = int(env_vars.get("SessionCacheSize", 1000))
+
+        # Multi-image and tiled scan analysis (scan.py)
+        self.ScanConcurrency = int(env_vars.get("ScanConcurrency", 4))
+        self.ScanTiling = env_vars.get("ScanTiling", "on").lower() not in ("off", "false", "0", "no")
+
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        from dotenv import dotenv_values
+        # Load environment variables from parent directory .env file
+        _config = Config(dotenv_values(os.path.join(parent_dir, ".env")))
+    return _config
+
+
+def data_path(*parts):
+    # Path under Data/, creating the directory on first use
+    os.makedirs(data_dir, exist_ok=True)
+    return os.path.join(data_dir, *parts)
@@ -0,0 +1,177 @@
+import re
+from collections import deque
+
+from retrieval import HistoryIndex
+
+# Token-budgeted context assembly for ChatBot and the image analysis prompt.
+#
+# A ContextWindow holds one session's conversation as recent verbatim turns plus a
+# rolling summary. When a request would go over budget, the oldest verbatim turns
+# are folded into the summary once and never sent verbatim again, so each turn
+# appears in the prompt exactly once, either in full or as a summary line.
+#
+# Every message is also added to a BM25 index (retrieval.py), including older
+# history that is loaded from the chat log but never sent verbatim. Each request
+# recalls the `recall_turns` earlier messages most relevant to the query, within
+# `recall_tokens`, so an allergy or a medication list mentioned long ago still
+# reaches the model while unrelated small talk is left out. A recalled message
+# replaces its summary line rather than appearing twice.
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Per-message overhead the chat API adds for role markers
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text):
+    # Fast local estimate: word pieces and punctuation, with long words counted
+    # as several BPE tokens (roughly 4 characters each)
+    count = 0
+    for piece in _TOKEN_RE.findall(text):
+        count += 1 + len(piece) // 6
+    return count
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+def _summary_line(message, max_chars, first_sentence=True):
+    role = "User" if message["role"] == "user" else "Assistant"
+    text = " ".join(message["content"].split())
+    # Keep the first sentence, which usually carries the question or the conclusion
+    match = re.match(r"(.+?[.!?])(\s|$)", text) if first_sentence else None
+    if match:
+        text = match.group(1)
+    if len(text) > max_chars:
+        text = text[:max_chars - 3].rstrip() + "..."
+    return f"{role}: {text}"
+
+
+def _recall_text(recalled):
+    return "Relevant earlier messages:\n" + "\n".join(recalled.values())
+
+
+class ContextWindow:
+    def __init__(self, budget_tokens=3000, summary_tokens=400, min_recent=2, summary_line_chars=160,
+                 recall_turns=4, recall_tokens=400, recall_line_chars=600):
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.min_recent = min_recent
+        self.summary_line_chars = summary_line_chars
+        self.recall_turns = recall_turns
+        self.recall_tokens = recall_tokens
+        self.recall_line_chars = recall_line_chars
+        self.recent = deque()
+        self.summary = deque()  # (message id, line)
+        self.messages = []      # every message by id, the index's document ids
+        self.index = HistoryIndex()
+        self._recent_tokens = 0
+        self._summary_tokens = 0
+
+    def _index(self, message):
+        self.index.add(message["content"])
+        self.messages.append(message)
+
+    def add(self, role, content):
+        message = {"role": role, "content": content}
+        self._index(message)
+        self.recent.append(message)
+        self._recent_tokens += message_tokens(message)
+
+    def extend(self, messages):
+        for message in messages:
+            self.add(message["role"], message["content"])
+
+    def load(self, messages, recent_limit):
+        """Start from stored history: the last `recent_limit` messages become recent
+        turns, and the older ones are only indexed for recall."""
+        split = max(0, len(messages) - recent_limit)
+        for message in messages[:split]:
+            self._index({"role": message["role"], "content": message["content"]})
+        self.extend(messages[split:])
+
+    def _first_recent(self):
+        # Recent turns are always the newest messages
+        return len(self.messages) - len(self.recent)
+
+    def _fold_oldest(self):
+        message_id = self._first_recent()
+        message = self.recent.popleft()
+        self._recent_tokens -= message_tokens(message)
+        line = _summary_line(message, self.summary_line_chars)
+        self.summary.append((message_id, line))
+        self._summary_tokens += estimate_tokens(line) + 1
+        # The summary itself is bounded; its oldest lines drop off first
+        while self._summary_tokens > self.summary_tokens and len(self.summary) > 1:
+            self._summary_tokens -= estimate_tokens(self.summary.popleft()[1]) + 1
+
+    def _fit(self, reserved):
+        available = self.budget_tokens - reserved
+        while len(self.recent) > self.min_recent and self._recent_tokens + self._summary_tokens > available:
+            self._fold_oldest()
+
+    def recall(self, query, budget_tokens=None):
+        """-> {message id: line} for the earlier messages most relevant to `query`,
+        oldest first, within `budget_tokens` (default `recall_tokens`)."""
+        budget_tokens = self.recall_tokens if budget_tokens is None else budget_tokens
+        if not query or self.recall_turns <= 0 or budget_tokens <= 0:
+            return {}
+        chosen = {}
+        used = 0
+        for _score, message_id in self.index.search(query, self.recall_turns, before=self._first_recent()):
+            line = _summary_line(self.messages[message_id], self.recall_line_chars, first_sentence=False)
+            cost = estimate_tokens(line) + 1
+            if used + cost <= budget_tokens:
+                chosen[message_id] = line
+                used += cost
+        return dict(sorted(chosen.items()))
+
+    def _summary_block(self, recalled):
+        lines = [line for message_id, line in self.summary if message_id not in recalled]
+        if not lines:
+            return ""
+        return "Summary of earlier conversation:\n" + "\n".join(lines)
+
+    def summary_text(self, recalled=None):
+        # Summary lines of messages that were not recalled, then the recalled messages
+        recalled = recalled or {}
+        blocks = [self._summary_block(recalled)]
+        if recalled:
+            blocks.append(_recall_text(recalled))
+        return "\n\n".join(block for block in blocks if block)
+
+    def build(self, query, system_messages=()):
+        """Return the message list for a request: system, summary and recalled
+        messages, recent turns, query."""
+        reserved = sum(message_tokens(m) for m in system_messages) + estimate_tokens(query) + MESSAGE_OVERHEAD
+        self._fit(reserved + (self.recall_tokens if self.recall_turns > 0 else 0))
+        messages = list(system_messages)
+        earlier = self.summary_text(self.recall(query))
+        if earlier:
+            messages.append({"role": "system", "content": earlier})
+        messages.extend(self.recent)
+        messages.append({"role": "user", "content": query})
+        return messages
+
+    def as_text(self, budget_tokens, query=None):
+        """Render the context as plain text within `budget_tokens`, for single-message
+        prompts; with `query`, relevant earlier messages come first."""
+        recalled = self.recall(query, min(self.recall_tokens, budget_tokens // 2)) if query else {}
+        lines = []
+        used = sum(estimate_tokens(line) + 1 for line in recalled.values())
+        for message in reversed(self.recent):
+            role = "User" if message["role"] == "user" else "Assistant"
+            line = f"{role}: {message['content']}"
+            cost = estimate_tokens(line)
+            if used + cost > budget_tokens:
+                break
+            lines.append(line)
+            used += cost
+        lines.reverse()
+        if recalled:
+            lines.insert(0, _recall_text(recalled))
+        summary = self._summary_block(recalled)
+        if summary and used + estimate_tokens(summary) <= budget_tokens:
+            lines.insert(0, summary)
+        return "\n".join(lines)
@@ -1,6 +1,13 @@
-from llm import ChatBot
+import metrics
+from llm import ChatBot, CachedChatBot
 
-def analyze_symptoms(symptoms):
-    prompt = f"Patient symptoms: {symptoms}. Provide a possible diagnosis and recommended cure."
-    response = ChatBot(prompt)
+PROMPT_TEMPLATE = "Patient symptoms: {text}. Provide a possible diagnosis and recommended cure."
+
+def analyze_symptoms(symptoms, cacheable=False, on_token=None, cancel=None):
+    # cacheable=True runs statelessly and reuses earlier answers for the same symptoms
+    with metrics.span("task", task="analyze_symptoms", cached=cacheable):
+        if cacheable:
+            return CachedChatBot("analyze_symptoms", PROMPT_TEMPLATE, symptoms)
+        prompt = PROMPT_TEMPLATE.format(text=symptoms)
+        response = ChatBot(prompt, on_token=on_token, cancel=cancel, route=False)
     return response
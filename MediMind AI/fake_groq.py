@@ -0,0 +1,170 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Groq (OpenAI-compatible) chat completions endpoint.
+#
+# Serves POST /openai/v1/chat/completions, streaming (SSE) or not, with a
+# configurable time-to-first-token, inter-token delay, occasional slow responses
+# (a tail of extra first-token delay), error injection and 429s with Retry-After. Point the app at it with GroqBaseURL=http://127.0.0.1:<port>
+# in .env, or start it in-process with start_server() from benchmarks and tests.
+
+DEFAULT_REPLY = (
+    "Based on the symptoms described, a common viral infection is the most likely cause. "
+    "Rest, fluids and paracetamol for fever are usually enough. "
+    "See a doctor if the fever lasts more than three days or breathing becomes difficult."
+)
+
+
+class FakeConfig:
+    def __init__(self, ttft=0.2, token_delay=0.02, reply=DEFAULT_REPLY, error_rate=0.0,
+                 rate_limit_rate=0.0, retry_after=1.0, model_ttft=None, slow_rate=0.0, slow_ttft=2.0, seed=None):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.reply = reply
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.model_ttft = model_ttft or {}  # per-model override of ttft
+        self.slow_rate = slow_rate  # fraction of requests whose first token comes slow_ttft later
+        self.slow_ttft = slow_ttft
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def _tokens(text):
+    # Split into word-sized chunks that keep their trailing space
+    words = text.split(" ")
+    return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "not_found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            roll = config.random.random()
+            slow = config.random.random() < config.slow_rate
+
+        if roll < config.rate_limit_rate:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                            {"Retry-After": str(config.retry_after)})
+            return
+        if roll < config.rate_limit_rate + config.error_rate:
+            self._send_json(503, {"error": {"message": "Service unavailable", "type": "server_error"}})
+            return
+
+        model = request.get("model", "fake-model")
+        pieces = _tokens(config.reply)
+        completion_tokens = len(pieces)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        created = int(time.time())
+        completion_id = f"chatcmpl-fake-{config.requests}"
+        ttft = config.model_ttft.get(model, config.ttft) + (config.slow_ttft if slow else 0.0)
+
+        if not request.get("stream"):
+            time.sleep(ttft + config.token_delay * max(0, completion_tokens - 1))
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": config.reply},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            # Like the real API, a stream's headers come back at once and the first token later
+            self.wfile.flush()
+            time.sleep(ttft)
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(config.token_delay)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            pass
+
+
+def make_server(config, host="127.0.0.1", port=0):
+    handler = type("ConfiguredFakeGroqHandler", (FakeGroqHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Start the fake endpoint on a background thread; returns (server, base_url)."""
+    server = make_server(config or FakeConfig(), host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Groq chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests with a slow first token")
+    parser.add_argument("--slow-ttft", type=float, default=2.0, help="extra seconds before a slow first token")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeConfig(args.ttft, args.token_delay, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                        slow_rate=args.slow_rate, slow_ttft=args.slow_ttft, seed=args.seed)
+    server = make_server(config, args.host, args.port)
+    print(f"Fake Groq endpoint on http://{args.host}:{server.server_address[1]} (set GroqBaseURL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import threading
+from collections import deque
+
+import metrics
+
+# Hedged streaming requests against slow first tokens.
+#
+# When hedging is on, a streaming request whose first token has not arrived by a
+# deadline gets a second request, to the model's first fallback (or the same
+# model again), and whichever stream produces a token first is used; the other
+# one is closed. The deadline is the HedgePercentile of the model's recent
+# time-to-first-token, clamped to [HedgeMinDelay, HedgeMaxDelay], so only the
+# slowest few percent of requests are hedged. A hard budget caps hedges at
+# HedgeBudget of the last `window` requests, so a provider-wide slowdown cannot
+# double the traffic.
+#
+# Counter: llm_hedges_total{model, outcome="primary_won"|"hedge_won"|"failed"|
+# "over_budget"}; the per-client totals are in HedgePolicy.stats.
+
+
+class HedgePolicy:
+    def __init__(self, percentile=0.95, budget=0.1, min_delay=0.5, max_delay=3.0, target="fallback",
+                 min_samples=20, window=200):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target = target
+        self.min_samples = min_samples
+        self.window = window
+        self.samples = {}         # model -> recent time-to-first-token, seconds
+        self.hedged_at = deque()  # request numbers of recent hedges
+        self.requests = 0
+        self.stats = {"requests": 0, "hedged": 0, "primary_won": 0, "hedge_won": 0, "failed": 0, "over_budget": 0}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Count a request; -> its number, for hedge()."""
+        with self._lock:
+            self.requests += 1
+            self.stats["requests"] += 1
+            return self.requests
+
+    def observe(self, model, seconds):
+        with self._lock:
+            self.samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def deadline(self, model):
+        """Seconds to wait for the first token before hedging."""
+        with self._lock:
+            samples = sorted(self.samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return self.max_delay
+        value = samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def alternate(self, model, fallbacks):
+        if self.target == "same" or not fallbacks.get(model):
+            return model
+        return fallbacks[model][0]
+
+    def hedge(self, number, model):
+        """Take a hedge from the budget for request `number`; False if it is used up."""
+        with self._lock:
+            while self.hedged_at and self.hedged_at[0] <= self.requests - self.window:
+                self.hedged_at.popleft()
+            if len(self.hedged_at) >= max(1.0, self.budget * min(self.requests, self.window)):
+                self.stats["over_budget"] += 1
+                allowed = False
+            else:
+                self.hedged_at.append(number)
+                self.stats["hedged"] += 1
+                allowed = True
+        if not allowed:
+            metrics.inc("llm_hedges_total", model=model, outcome="over_budget")
+        return allowed
+
+    def finished(self, model, outcome):
+        """Record how a hedged request ended: "primary_won", "hedge_won" or "failed"."""
+        with self._lock:
+            self.stats[outcome] = self.stats.get(outcome, 0) + 1
+        metrics.inc("llm_hedges_total", model=model, outcome=outcome)
+
+
+def first_content(chunk):
+    return bool(chunk.choices and chunk.choices[0].delta.content)
+
+
+def read_head(stream):
+    # -> (chunks up to and including the first token, iterator over the rest)
+    head = []
+    rest = iter(stream)
+    for chunk in rest:
+        head.append(chunk)
+        if first_content(chunk):
+            break
+    return head, rest
+
+
+async def read_head_async(stream):
+    head = []
+    rest = stream.__aiter__()
+    async for chunk in rest:
+        head.append(chunk)
+        if first_content(chunk):
+            break
+    return head, rest
+
+
+class HeadStream:
+    """The winning stream: the chunks read while racing, then the rest of it."""
+
+    def __init__(self, stream, head, rest):
+        self.stream = stream
+        self.head = deque(head)
+        self.rest = rest
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.head:
+            return self.head.popleft()
+        return next(self.rest)
+
+    def close(self):
+        self.stream.close()
+
+
+class AsyncHeadStream(HeadStream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.head:
+            return self.head.popleft()
+        return await self.rest.__anext__()
+
+    async def close(self):
+        await self.stream.close()
+
+
+def from_config(config):
+    # None when hedging is off
+    if not config.Hedging:
+        return None
+    return HedgePolicy(config.HedgePercentile, config.HedgeBudget, config.HedgeMinDelay, config.HedgeMaxDelay,
+                       config.HedgeTarget)
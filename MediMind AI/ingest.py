@@ -0,0 +1,243 @@
+import io
+import os
+import time
+import base64
+import hashlib
+import sqlite3
+import threading
+
+from PIL import Image, ImageOps
+
+from config import data_path
+
+# Image ingestion for the vision model.
+#
+# Each upload is decoded once, oriented, converted to 8-bit, resized to the
+# resolution the vision model actually uses and re-encoded (without metadata)
+# to fit a byte budget, so large scans and DICOM-exported 16-bit PNGs become
+# small uploads instead of errors. A re-uploaded scan (the same file) reuses the
+# earlier analysis from the same session (see AnalysisStore). Scans much larger than that can
+# also be cut into overlapping full-resolution tiles (prepare_tiles), so fine
+# detail isn't lost in the downscale.
+
+MAX_SIDE = 1120
+TARGET_BYTES = 1024 * 1024
+# The API rejects base64 payloads over 4 MB
+MAX_BYTES = 3 * 1024 * 1024
+QUALITY_STEPS = (90, 82, 74, 66, 58, 50)
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+# Fingerprint for near-duplicate checks: a 256-bit dHash and a small grayscale thumbnail
+HASH_SIZE = 16
+THUMB_SIDE = 64
+
+
+class PreparedImage:
+    def __init__(self, data, mime, size, sha256, phash, thumb=None):
+        self.data = data
+        self.mime = mime
+        self.size = size
+        self.sha256 = sha256
+        self.phash = phash  # difference_hash(img, HASH_SIZE)
+        self.thumb = thumb  # THUMB_SIDE x THUMB_SIDE 8-bit grayscale pixels
+
+    def data_url(self):
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def to_8bit(img):
+    # 16-bit grayscale (typical for DICOM exports) is stretched to its own range
+    if img.mode in ("I;16", "I;16B", "I;16L", "I"):
+        img = img.convert("I")
+        low, high = img.getextrema()
+        scale = 255.0 / (high - low) if high > low else 1.0
+        return img.point(lambda p: (p - low) * scale).convert("L")
+    if img.mode == "F":
+        return img.convert("L")
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode not in ("L", "RGB"):
+        return img.convert("RGB")
+    return img
+
+
+def difference_hash(img, size=8):
+    # size*size-bit dHash: robust to re-encoding, resizing and small brightness changes
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def thumbnail_pixels(img):
+    return img.convert("L").resize((THUMB_SIDE, THUMB_SIDE), Image.BILINEAR).tobytes()
+
+
+def encode(img, image_format, target_bytes):
+    data = b""
+    for quality in QUALITY_STEPS:
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality, optimize=image_format == "JPEG")
+        data = buffer.getvalue()
+        if len(data) <= target_bytes:
+            break
+    return data
+
+
+def prepare_image(path, max_side=MAX_SIDE, target_bytes=TARGET_BYTES, image_format="JPEG"):
+    """Decode, normalize and re-encode an image file for the vision API."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    sha256 = hashlib.sha256(raw).hexdigest()
+    img = Image.open(io.BytesIO(raw))
+    img.draft(img.mode, (max_side, max_side))  # JPEG: decode at reduced scale directly
+    img = to_8bit(ImageOps.exif_transpose(img))
+    del raw
+    return finish_image(img, sha256, max_side, target_bytes, image_format)
+
+
+def finish_image(img, sha256, max_side=MAX_SIDE, target_bytes=TARGET_BYTES, image_format="JPEG"):
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    phash = difference_hash(img, HASH_SIZE)
+    thumb = thumbnail_pixels(img)
+    data = encode(img, image_format, target_bytes)
+    # Keep shrinking if quality alone was not enough
+    while len(data) > MAX_BYTES and max(img.size) > 256:
+        img = img.resize((img.width * 3 // 4, img.height * 3 // 4), Image.LANCZOS)
+        data = encode(img, image_format, target_bytes)
+    return PreparedImage(data, MIME_TYPES[image_format], img.size, sha256, phash, thumb)
+
+
+ROW_NAMES = {1: ("",), 2: ("upper", "lower"), 3: ("upper", "middle", "lower")}
+COLUMN_NAMES = {1: ("",), 2: ("left", "right"), 3: ("left", "centre", "right")}
+
+
+def tile_boxes(width, height, max_side=MAX_SIDE, overlap=0.1, max_grid=3):
+    """Overlapping crop boxes that keep each tile near `max_side` at full resolution.
+
+    Returns [(label, (left, top, right, bottom))]; a single box means no tiling is needed.
+    """
+    # A side is split once it is about twice what one request keeps (1.75x and up)
+    columns = min(max_grid, max(1, int(width / max_side + 0.25)))
+    rows = min(max_grid, max(1, int(height / max_side + 0.25)))
+    if columns == rows == 1:
+        return [("whole image", (0, 0, width, height))]
+    tile_width = width / (columns - (columns - 1) * overlap)
+    tile_height = height / (rows - (rows - 1) * overlap)
+    boxes = []
+    for row in range(rows):
+        for column in range(columns):
+            left = int(column * tile_width * (1 - overlap))
+            top = int(row * tile_height * (1 - overlap))
+            right = width if column == columns - 1 else int(left + tile_width)
+            bottom = height if row == rows - 1 else int(top + tile_height)
+            label = " ".join(name for name in (ROW_NAMES[rows][row], COLUMN_NAMES[columns][column]) if name)
+            boxes.append((label, (left, top, right, bottom)))
+    return boxes
+
+
+def tile_count(path, max_side=MAX_SIDE, max_grid=3):
+    # Reads the header only
+    with Image.open(path) as img:
+        return len(tile_boxes(img.width, img.height, max_side, max_grid=max_grid))
+
+
+def prepare_tiles(path, max_side=MAX_SIDE, overlap=0.1, max_grid=3):
+    """-> [(label, PreparedImage)] overlapping full-resolution regions of a large scan,
+    or [] when the image already fits in one request without losing detail."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    sha256 = hashlib.sha256(raw).hexdigest()
+    img = to_8bit(ImageOps.exif_transpose(Image.open(io.BytesIO(raw))))
+    del raw
+    boxes = tile_boxes(img.width, img.height, max_side, overlap, max_grid)
+    if len(boxes) == 1:
+        return []
+    tiles = []
+    for label, box in boxes:
+        # Tiles get their own content hash so AnalysisStore can reuse them individually
+        tile_hash = hashlib.sha256(f"{sha256}:{box}".encode("ascii")).hexdigest()
+        tiles.append((label, finish_image(img.crop(box), tile_hash, max_side)))
+    return tiles
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class AnalysisStore:
+    """Previous image analyses by session, found by exact content hash.
+
+    An analysis is written with the session's conversation as context, so it is
+    only reused within that session. Near-duplicate lookup (near=True) is for
+    re-encoded copies of one file: it needs a 256-bit dHash within
+    `max_distance` bits and every thumbnail pixel within `max_pixel_diff` grey
+    levels, so a scan with a new local finding never matches its predecessor.
+    """
+
+    def __init__(self, path, max_distance=6, max_pixel_diff=12):
+        self.max_distance = max_distance
+        self.max_pixel_diff = max_pixel_diff
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_analyses (sha256 TEXT, model TEXT, session TEXT, dhash TEXT, "
+            "thumb BLOB, result TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (sha256, model, session))"
+        )
+        self._db.commit()
+        # Hashes are scanned in memory; 32 bytes each, so this stays small
+        self._hashes = [(int(dhash, 16), sha256, model, session) for dhash, sha256, model, session in
+                        self._db.execute("SELECT dhash, sha256, model, session FROM image_analyses")]
+
+    def find(self, image, model, session, near=False):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM image_analyses WHERE sha256 = ? AND model = ? AND session = ?",
+                (image.sha256, model, session)
+            ).fetchone()
+            if row or not near or image.thumb is None:
+                return row[0] if row else None
+            for stored, sha256, stored_model, stored_session in self._hashes:
+                if (stored_model, stored_session) != (model, session) or \
+                        hamming(stored, image.phash) > self.max_distance:
+                    continue
+                row = self._db.execute(
+                    "SELECT thumb, result FROM image_analyses WHERE sha256 = ? AND model = ? AND session = ?",
+                    (sha256, model, session)
+                ).fetchone()
+                if row and row[0] and self.same_pixels(row[0], image.thumb):
+                    return row[1]
+            return None
+
+    def same_pixels(self, a, b):
+        return len(a) == len(b) and max(abs(x - y) for x, y in zip(a, b)) <= self.max_pixel_diff
+
+    def save(self, image, model, result, session):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO image_analyses (sha256, model, session, dhash, thumb, result, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image.sha256, model, session, format(image.phash, "x"), image.thumb, result, time.time()),
+            )
+            self._db.commit()
+            self._hashes.append((image.phash, image.sha256, model, session))
+
+
+_store = None
+
+
+def get_analysis_store():
+    global _store
+    if _store is None:
+        _store = AnalysisStore(data_path("ImageAnalyses.sqlite3"))
+    return _store
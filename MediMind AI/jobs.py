@@ -0,0 +1,124 @@
+import time
+
+import llm
+import metrics
+from chatlog import DEFAULT_SESSION
+from config import get_config
+from llm_client import LLMError, error_message, stream_error
+from prescription import parse_prescription
+from singleflight import request_key
+
+# Background jobs behind the GUI upload buttons. They run on worker threads as
+# fn(job, *args) (see worker.JobExecutor) and never touch Tk, so they can also be
+# driven headless, e.g. by bench.py. `job` needs emit(text), cancelled() and
+# cancel_event. The OCR and imaging modules (PIL, pytesseract) are imported by
+# the jobs themselves so that opening the window doesn't pay for them.
+
+# Token budget for the conversation context pasted into the image analysis prompt
+IMAGE_CONTEXT_TOKENS = 600
+VISION_MODEL = "llama-3.2-90b-vision-preview"
+
+IMAGE_PROMPT = "Analyze this medical image in depth. Identify all visible anatomical structures, potential abnormalities, and relevant medical findings. Compare it to normal medical standards. Explain possible conditions with causes, symptoms, and next diagnostic steps. Provide insights based on visual patterns, color variations, and any visible anomalies."
+
+# Recalls what the patient said earlier that bears on reading a scan
+IMAGE_RECALL_QUERY = "symptoms pain injury history allergies allergic medications taking diagnosis condition surgery"
+
+def image_messages(image, session_id=DEFAULT_SESSION):
+    # Include a token-budgeted view of the conversation in the user message
+    context_text = llm.ContextText(IMAGE_CONTEXT_TOKENS, session_id, query=IMAGE_RECALL_QUERY)
+    if context_text:
+        context_text = f"Based on our previous conversation:\n{context_text}\n"
+    return [
+        {"role": "user", "content": [
+            {"type": "text", "text": f"{context_text}{IMAGE_PROMPT}"},
+            {"type": "image_url", "image_url": {"url": image.data_url()}}
+        ]}
+    ]
+
+def prescription_job(job, file_path):
+    # Worker thread: OCR the image, then stream the parsed prescription
+    from ocr import ocr_image
+    ocr = ocr_image(file_path)
+    for stage, seconds in ocr["timings"].items():
+        metrics.observe("ocr_stage_seconds", seconds, stage=stage)
+    metrics.inc("ocr_requests_total", cached=ocr["cached"])
+    prescription_text = ocr["text"] or "No text detected in image."
+    if job.cancelled():
+        return None
+    # parse_prescription goes through ChatBot, which adds the conversation context
+    return parse_prescription(prescription_text, on_token=job.emit, cancel=job.cancel_event)
+
+def medical_image_job(job, file_path, upload_message, store=None):
+    # Worker thread: downscale/re-encode the image and stream the vision model's analysis
+    from ingest import prepare_image, get_analysis_store
+    with metrics.span("image_prepare"):
+        image = prepare_image(file_path)
+
+    # The same file analyzed before in this conversation reuses that analysis
+    store = store or get_analysis_store()
+    previous = store.find(image, VISION_MODEL, DEFAULT_SESSION)
+    if previous:
+        result = f"(This image matches one analyzed earlier.)\n{previous}"
+        job.emit(result)
+        llm.RecordTurn(upload_message, result)
+        return result
+
+    # Shared resilient client: timeouts, retries, circuit breaker and fallback models
+    client = llm.GetClient()
+    started = time.perf_counter()
+    try:
+        # Staff uploading the same scan at the same time share one vision request
+        messages = image_messages(image)
+        model, stream = client.complete(
+            VISION_MODEL,
+            messages,
+            cancel=job.cancel_event,
+            coalesce_key=request_key(VISION_MODEL, messages, max_tokens=1024, stream=True),
+            max_tokens=1024,
+            stream=True
+        )
+        parts = []
+        try:
+            for chunk in stream:
+                if job.cancelled():
+                    stream.close()
+                    return None
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        metrics.observe("llm_ttft_seconds", time.perf_counter() - started, model=model)
+                    parts.append(chunk.choices[0].delta.content)
+                    job.emit(chunk.choices[0].delta.content)
+        except Exception as e:
+            raise stream_error(e, model) from e
+        metrics.observe("llm_stream_seconds", time.perf_counter() - started, model=model)
+    except LLMError as e:
+        if e.kind == "cancelled":
+            return None
+        metrics.inc("llm_errors_total", kind=e.kind)
+        return error_message(e)
+    result = "".join(parts)
+    # Only analyses from the primary vision model are reused later
+    if result and model == VISION_MODEL:
+        store.save(image, VISION_MODEL, result, DEFAULT_SESSION)
+    llm.RecordTurn(upload_message, result)
+    return result
+
+def scan_job(job, file_paths, upload_message):
+    # Worker thread: several views of a study and/or the tiles of a large scan,
+    # analyzed in parallel and merged into one report; progress lines stream as
+    # regions complete. A single image that needs no tiling streams as before.
+    from ingest import tile_count
+    if len(file_paths) == 1 and not (get_config().ScanTiling and tile_count(file_paths[0]) > 1):
+        return medical_image_job(job, file_paths[0], upload_message)
+    from scan import analyze_scan
+    try:
+        result = analyze_scan(file_paths, on_progress=job.emit, cancel=job.cancel_event)
+    except LLMError as e:
+        if e.kind == "cancelled":
+            return None
+        metrics.inc("llm_errors_total", kind=e.kind)
+        return error_message(e)
+    if result is None:
+        return None
+    llm.RecordTurn(upload_message, result)
+    return result
@@ -1,34 +1,207 @@
-import os
+import time
 import datetime
-import json
-from groq import Groq
-from dotenv import dotenv_values
+import threading
+from collections import OrderedDict
+import metrics
+import triage
+from config import get_config, data_path
+from chatlog import DEFAULT_SESSION, open_chat_log
+from context import ContextWindow
+from llm_client import LLMError, error_message, stream_error
+from singleflight import request_key
 
-# Get the parent directory path
-parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Everything expensive (the .env file, the Groq client, the chat log, the
+# response cache) is created on first use, so importing this module is cheap.
 
-# Load environment variables from parent directory .env file
-env_vars = dotenv_values(os.path.join(parent_dir, ".env"))
+ChatModel = "llama3-70b-8192"
 
-Username = env_vars.get("Username", "User")
-Assistantname = env_vars.get("Assistantname", "DoctorAI")
-GroqAPIKey = env_vars.get("GroqAPIKey", "YOUR_GROQ_API_KEY")
+_client = None
+_async_client = None
+_scheduler = None
+_chat_log = None
+_response_cache = None
+_init_lock = threading.RLock()  # GetClient creates the scheduler while holding it
 
-client = Groq(api_key=GroqAPIKey)
+# In-memory context window per session, seeded once from the tail of the store.
+# ChatBot may run on GUI worker threads, so window access is serialized. Only the
+# SessionCacheSize most recently used windows are kept; an evicted one is
+# rebuilt from the chat log on next use. Loading reads the log outside the
+# shared lock (one loader per session), so a slow first load of one session
+# doesn't hold up the others.
+_windows = OrderedDict()
+_context_lock = threading.RLock()
+_loading = {}  # session -> lock held while its window is being loaded
 
-# Define the path for the chat log
-chat_log_path = os.path.join(parent_dir, "Data", "ChatLog.json")
-# Ensure the Data directory exists
-os.makedirs(os.path.dirname(chat_log_path), exist_ok=True)
+def _make_client(base_url, api_key):
+    import hedge
+    from llm_client import ResilientClient
+    config = get_config()
+    return ResilientClient(
+        api_key,
+        base_url=base_url,
+        connect_timeout=config.LLMConnectTimeout,
+        read_timeout=config.LLMReadTimeout,
+        max_retries=config.LLMMaxRetries,
+        scheduler=GetScheduler(),
+        hedging=hedge.from_config(config),
+    )
 
-# Load or initialize the chat log
-try:
-    with open(chat_log_path, "r") as f:
-        messages = json.load(f)
-except FileNotFoundError:
-    messages = []
-    with open(chat_log_path, "w") as f:
-        json.dump([], f)
+def GetScheduler():
+    # One rate-limit scheduler for every request made with the API key (see scheduler.py)
+    global _scheduler
+    if _scheduler is None:
+        with _init_lock:
+            if _scheduler is None:
+                import scheduler
+                _scheduler = scheduler.from_config(get_config())
+    return _scheduler
+
+def GetClient():
+    # Shared by ChatBot and the image analysis jobs
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                config = get_config()
+                # Optional exports of the timing spans and token counters (see metrics.py)
+                if config.MetricsTrace:
+                    metrics.enable_trace(data_path("..", config.MetricsTrace))
+                if config.MetricsPort:
+                    metrics.serve_prometheus(config.MetricsPort)
+                _client = _make_client(config.GroqBaseURL, config.GroqAPIKey)
+    return _client
+
+def GetAsyncClient():
+    # Pooled keep-alive client for the asyncio HTTP service; create it from inside the event loop
+    global _async_client
+    if _async_client is None:
+        import hedge
+        from llm_client import AsyncResilientClient
+        GetClient()  # same one-time metrics setup
+        config = get_config()
+        _async_client = AsyncResilientClient(
+            config.GroqAPIKey,
+            max_connections=config.ServicePoolSize,
+            max_concurrency=config.ServiceConcurrency,
+            base_url=config.GroqBaseURL,
+            connect_timeout=config.LLMConnectTimeout,
+            read_timeout=config.LLMReadTimeout,
+            max_retries=config.LLMMaxRetries,
+            scheduler=GetScheduler(),
+            hedging=hedge.from_config(config),
+        )
+    return _async_client
+
+def GetChatLog():
+    # Conversation store (append-only); a legacy ChatLog.json is migrated into it once
+    global _chat_log
+    if _chat_log is None:
+        with _init_lock:
+            if _chat_log is None:
+                _chat_log = open_chat_log(
+                    data_path(), get_config().ChatLogBackend, legacy_path=data_path("ChatLog.json")
+                )
+    return _chat_log
+
+def GetResponseCache():
+    # Opt-in cache for one-shot transforms (see ChatBotStateless)
+    global _response_cache
+    if _response_cache is None:
+        with _init_lock:
+            if _response_cache is None:
+                from cache import ResponseCache
+                config = get_config()
+                _response_cache = ResponseCache(
+                    data_path("ResponseCache.sqlite3"), config.ResponseCacheSize, config.ResponseCacheTTL
+                )
+    return _response_cache
+
+def UseEndpoint(base_url, api_key=None):
+    # Point every LLM call at another endpoint (e.g. fake_groq.py for benchmarks)
+    global _client, _async_client
+    config = get_config()
+    config.GroqBaseURL = base_url
+    config.GroqAPIKey = api_key or config.GroqAPIKey
+    _client = _make_client(config.GroqBaseURL, config.GroqAPIKey)
+    _async_client = None  # recreated against the new endpoint on next use
+    return _client
+
+def UseScheduler(scheduler):
+    # Swap the rate-limit scheduler of the current and future clients
+    # (scheduler.Scheduler({}, 0, 0) admits everything at once)
+    global _scheduler
+    _scheduler = scheduler
+    for client in (_client, _async_client):
+        if client is not None:
+            client.scheduler = scheduler
+
+def UseChatLog(store):
+    # Swap the conversation store and forget the cached context windows
+    global _chat_log
+    with _context_lock:
+        _chat_log = store
+        _windows.clear()
+
+def UseResponseCache(cache):
+    global _response_cache
+    _response_cache = cache
+
+def GetContext(session_id=DEFAULT_SESSION):
+    with _context_lock:
+        if session_id in _windows:
+            _windows.move_to_end(session_id)
+            return _windows[session_id]
+        loading = _loading.setdefault(session_id, threading.Lock())
+    with loading:
+        with _context_lock:
+            if session_id in _windows:
+                return _windows[session_id]
+        config = get_config()
+        window = ContextWindow(config.ContextTokens, config.SummaryTokens,
+                               recall_turns=config.RecallTurns, recall_tokens=config.RecallTokens)
+        # The last HistoryLimit messages are sent as they are; older ones are
+        # indexed so they can still be recalled when relevant
+        history = GetChatLog().tail(max(config.HistoryLimit, config.RecallHistory), session_id)
+        window.load(history, config.HistoryLimit)
+        with _context_lock:
+            _windows[session_id] = window
+            _loading.pop(session_id, None)
+            while len(_windows) > config.SessionCacheSize:
+                _windows.popitem(last=False)
+        return window
+
+# Callers get the window before taking _context_lock: a session's loader holds
+# its loading lock and then needs _context_lock, so waiting for the load while
+# holding _context_lock would deadlock.
+
+def BuildMessages(Query, system_messages, session_id=DEFAULT_SESSION):
+    window = GetContext(session_id)
+    with _context_lock:
+        return window.build(Query, system_messages)
+
+def ContextText(budget_tokens, session_id=DEFAULT_SESSION, query=None):
+    window = GetContext(session_id)
+    with _context_lock:
+        return window.as_text(budget_tokens, query)
+
+def RecordTurn(Query, Answer, session_id=DEFAULT_SESSION):
+    window = GetContext(session_id)
+    turn = (("user", Query), ("assistant", Answer))
+    # The store has its own lock and may fsync; _context_lock only guards the
+    # in-memory window, so one session's append never holds up the others
+    chat_log = GetChatLog()
+    with metrics.span("chatlog_append"):
+        for role, content in turn:
+            chat_log.append(session_id, role, content)
+    with _context_lock:
+        for role, content in turn:
+            window.add(role, content)
+
+RealtimeHeader = "Please use this real-time information"
+
+def CoalesceKey(model, messages, **params):
+    # Requests that differ only in the real-time stamp ask the same question
+    return request_key(model, [m for m in messages if not str(m["content"]).startswith(RealtimeHeader)], **params)
 
 def RealtimeInformation():
     current_date_time = datetime.datetime.now()
@@ -40,7 +213,7 @@ def RealtimeInformation():
     minute = current_date_time.strftime("%M")
     second = current_date_time.strftime("%S")
     
-    data = f"Please use this real-time information if needed, \n"
+    data = f"{RealtimeHeader} if needed, \n"
     data += f"Day: {day}, Date: {date} {month} {year}, Time: {hour} hours {minute} minutes {second} seconds.\n"
     return data
 
@@ -50,51 +223,279 @@ def AnswerModifier(Answer):
     modified_answer = '\n'.join(non_empty_lines)
     return modified_answer
 
-System = f"""Hello, I am {Username}, You are a very accurate and advanced AI chatbot named {Assistantname} which also has real-time up-to-date information from the internet.
+SystemTemplate = """Hello, I am {Username}, You are a very accurate and advanced AI chatbot named {Assistantname} which also has real-time up-to-date information from the internet.
 *** Do not tell time until I ask, do not talk too much, just answer the question.***
 *** Reply in all language***
 *** Do not provide notes in the output, just answer the question and never mention your training data. ***
 """
 
-SystemChatBot = [
-    {"role": "system", "content": System}
-]
+_system_messages = None
+
+def SystemChatBot():
+    # Built on first use so the .env file is only read when a request is made
+    global _system_messages
+    if _system_messages is None:
+        config = get_config()
+        System = SystemTemplate.format(Username=config.Username, Assistantname=config.Assistantname)
+        _system_messages = [{"role": "system", "content": System}]
+    return _system_messages
+
+def ChatMessages(Query, session_id=DEFAULT_SESSION):
+    system_messages = SystemChatBot() + [{"role": "system", "content": RealtimeInformation()}]
+    with metrics.span("context_build"):
+        return BuildMessages(Query, system_messages, session_id)
+
+class AnswerFilter:
+    """Incremental AnswerModifier: drops "</s>" markers and blank lines chunk by chunk.
+
+    feed(text) returns what can be shown now; a possible start of a marker, a line
+    break and the leading whitespace of a line are held back until the next chunk
+    shows whether they are kept. The concatenated output equals
+    AnswerModifier(answer.replace("</s>", "")) for any answer without nested markers.
+    """
+
+    MARKER = "</s>"
+
+    def __init__(self):
+        self.pending = ""          # a possible start of MARKER
+        self.line_started = False  # the current line has visible text
+        self.held = ""             # leading whitespace of the current line
+        self.shown = False         # any line has been output
+
+    def feed(self, text):
+        text = (self.pending + text).replace(self.MARKER, "")
+        self.pending = ""
+        for size in range(len(self.MARKER) - 1, 0, -1):
+            if text.endswith(self.MARKER[:size]):
+                text, self.pending = text[:-size], text[-size:]
+                break
+        return self._lines(text)
+
+    def flush(self):
+        text, self.pending = self.pending, ""
+        return self._lines(text)
 
-def ChatBot(Query):
-    global messages
+    def _lines(self, text):
+        out = []
+        for line_index, part in enumerate(text.split("\n")):
+            if line_index:
+                # A line break: the next line only shows if it has visible text
+                self.line_started = False
+                self.held = ""
+            if not part:
+                continue
+            if self.line_started:
+                out.append(part)
+                continue
+            stripped = part.lstrip()
+            if not stripped:
+                self.held += part
+                continue
+            if self.shown:
+                out.append("\n")
+            out.append(self.held + part)
+            self.held = ""
+            self.line_started = self.shown = True
+        return "".join(out)
+
+
+def FinishAnswer(Query, Answer, session_id=DEFAULT_SESSION):
+    with metrics.span("answer_postprocess"):
+        Answer = Answer.replace("</s>", "")
+        Modified = AnswerModifier(Answer)
+
+    # Persist the completed turn; nothing is written for a failed request
+    RecordTurn(Query, Answer, session_id)
+
+    return Modified
+
+def CannedReply(Query):
+    # Templated reply for a greeting or an off-topic query, or None to ask the model.
+    # Canned turns carry nothing clinical, so they are not added to the chat log.
+    config = get_config()
+    _route, reply = triage.route(Query, Username=config.Username, Assistantname=config.Assistantname)
+    return reply
+
+def StreamChatBot(Query, session_id=DEFAULT_SESSION, cancel=None, route=True):
+    # Generator form of ChatBot: yields the answer's text as it streams in, already
+    # cleaned, and returns the whole answer (StopIteration.value) once the turn is
+    # recorded. Raises LLMError on failure. If `cancel` gets set or the caller
+    # closes the generator early, the stream is abandoned, nothing is recorded and
+    # the generator returns None.
+    if route:
+        reply = CannedReply(Query)
+        if reply is not None:
+            yield reply
+            return reply
+    messages = ChatMessages(Query, session_id)
+    params = dict(max_tokens=1024, temperature=0.7, top_p=1, stream=True, stop=None)
+    started = time.perf_counter()
     try:
-        # Load the existing chat log
-        with open(chat_log_path, "r") as f:
-            messages = json.load(f)
-
-        # Append the user's query to the chat log
-        messages.append({"role": "user", "content": Query})
-
-        # Request a response from the Groq-based chatbot
-        completion = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages = SystemChatBot + [{"role": "system", "content": RealtimeInformation()}] + messages,
-            max_tokens=1024,
-            temperature=0.7,
-            top_p=1,
-            stream=True,
-            stop=None
+        # Request a response from the Groq-based chatbot (with retries and fallback
+        # models); an identical request already in flight is joined instead
+        model, completion = GetClient().complete(
+            ChatModel,
+            messages,
+            cancel=cancel,
+            coalesce_key=CoalesceKey(ChatModel, messages, **params),
+            session=session_id,
+            **params
         )
-        Answer = ""
+    except LLMError as e:
+        if e.kind == "cancelled":
+            return None
+        metrics.inc("llm_errors_total", kind=e.kind)
+        raise
+    metrics.observe("llm_response_headers_seconds", time.perf_counter() - started, model=model)
+    parts = []
+    output = AnswerFilter()
+    first_token = None
+    try:
         for chunk in completion:
-            if chunk.choices[0].delta.content:
-                Answer += chunk.choices[0].delta.content
-        Answer = Answer.replace("</s>", "")
+            if cancel is not None and cancel.is_set():
+                return None
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    metrics.observe("llm_ttft_seconds", first_token - started, model=model)
+                parts.append(chunk.choices[0].delta.content)
+                text = output.feed(chunk.choices[0].delta.content)
+                if text:
+                    yield text
+    except Exception as e:
+        error = stream_error(e, model)
+        metrics.inc("llm_errors_total", kind=error.kind)
+        raise error from e
+    finally:
+        # Also runs when the caller stops iterating (GeneratorExit)
+        completion.close()
+    metrics.observe("llm_stream_seconds", time.perf_counter() - started, model=model)
+    text = output.flush()
+    if text:
+        yield text
+    return FinishAnswer(Query, "".join(parts), session_id)
 
-        # Append the assistant's response and update the chat log
-        messages.append({"role": "assistant", "content": Answer})
-        with open(chat_log_path, "w") as f:
-            json.dump(messages, f, indent=4)
+def ChatBot(Query, session_id=DEFAULT_SESSION, on_token=None, cancel=None, route=True):
+    # on_token(text) is called for each streamed chunk as it arrives. If `cancel`
+    # (a threading.Event) gets set, the stream is abandoned, nothing is recorded
+    # and None is returned. A failed request returns a short error message and
+    # leaves the chat log untouched. route=False skips the local pre-classifier,
+    # for prompts built by the app itself.
+    stream = StreamChatBot(Query, session_id, cancel, route)
+    try:
+        while True:
+            text = next(stream)
+            if on_token:
+                on_token(text)
+    except StopIteration as done:
+        return done.value
+    except LLMError as e:
+        # Already counted in llm_errors_total; the caller shows the message
+        return error_message(e)
 
-        return AnswerModifier(Answer)
-    
+
+async def StreamChatBotAsync(Query, session_id=DEFAULT_SESSION, route=True):
+    # Async-iterator form of ChatBot for the HTTP service, on the pooled async
+    # client: yields cleaned text as it streams in and records the turn after the
+    # last piece. Raises LLMError on failure. Cancelling the consuming task or
+    # closing the iterator early abandons the stream and records nothing.
+    import asyncio
+    if route:
+        reply = CannedReply(Query)
+        if reply is not None:
+            yield reply
+            return
+    messages = ChatMessages(Query, session_id)
+    params = dict(max_tokens=1024, temperature=0.7, top_p=1, stream=True, stop=None)
+    started = time.perf_counter()
+    try:
+        model, completion = await GetAsyncClient().complete(
+            ChatModel,
+            messages,
+            coalesce_key=CoalesceKey(ChatModel, messages, **params),
+            session=session_id,
+            **params
+        )
+    except LLMError as e:
+        metrics.inc("llm_errors_total", kind=e.kind)
+        raise
+    metrics.observe("llm_response_headers_seconds", time.perf_counter() - started, model=model)
+    parts = []
+    output = AnswerFilter()
+    first_token = None
+    try:
+        async for chunk in completion:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    metrics.observe("llm_ttft_seconds", first_token - started, model=model)
+                parts.append(chunk.choices[0].delta.content)
+                text = output.feed(chunk.choices[0].delta.content)
+                if text:
+                    yield text
     except Exception as e:
-        print(f"Error: {e}")
-        with open(chat_log_path, "w") as f:
-            json.dump([], f, indent=4)
-        return ChatBot(Query)
+        error = stream_error(e, model)
+        metrics.inc("llm_errors_total", kind=error.kind)
+        raise error from e
+    finally:
+        await completion.close()
+    metrics.observe("llm_stream_seconds", time.perf_counter() - started, model=model)
+    text = output.flush()
+    if text:
+        yield text
+    # The chat log append may fsync; keep it off the event loop
+    await asyncio.to_thread(FinishAnswer, Query, "".join(parts), session_id)
+
+async def ChatBotAsync(Query, session_id=DEFAULT_SESSION, on_token=None, route=True):
+    # asyncio counterpart of ChatBot; cancelling the calling task abandons the
+    # stream and records nothing.
+    parts = []
+    stream = StreamChatBotAsync(Query, session_id, route)
+    try:
+        async for text in stream:
+            parts.append(text)
+            if on_token:
+                on_token(text)
+    except LLMError as e:
+        return error_message(e)
+    finally:
+        await stream.aclose()
+    return "".join(parts)
+
+
+def ChatBotStateless(Query, with_model=False):
+    # One-shot request without the chat log or the real-time stamp, so identical
+    # queries produce identical requests; raises LLMError on failure. with_model
+    # returns (model that answered, answer), since a fallback model may have.
+    messages = SystemChatBot() + [{"role": "user", "content": Query}]
+    params = dict(max_tokens=1024, temperature=0.7, top_p=1, stream=False, stop=None)
+    started = time.perf_counter()
+    try:
+        model, completion = GetClient().complete(
+            ChatModel,
+            messages,
+            coalesce_key=request_key(ChatModel, messages, **params),
+            **params
+        )
+    except LLMError as e:
+        metrics.inc("llm_errors_total", kind=e.kind)
+        raise
+    metrics.observe("llm_stream_seconds", time.perf_counter() - started, model=model)
+    Answer = AnswerModifier((completion.choices[0].message.content or "").replace("</s>", ""))
+    return (model, Answer) if with_model else Answer
+
+def CachedAnswer(Task, Template, Text):
+    # What CachedChatBot would answer from the response cache, or None
+    from cache import cache_key
+    return GetResponseCache().get(cache_key(Task, ChatModel, Template, Text))
+
+def CachedChatBot(Task, Template, Text):
+    # Stateless request for Template.format(text=Text), served from the response cache when possible
+    from cache import cache_key
+    Answer = CachedAnswer(Task, Template, Text)
+    if Answer is None:
+        model, Answer = ChatBotStateless(Template.format(text=Text), with_model=True)
+        # A fallback model's answer must not be served later as ChatModel's
+        if Answer and model == ChatModel:
+            GetResponseCache().put(cache_key(Task, ChatModel, Template, Text), Answer)
+    return Answer
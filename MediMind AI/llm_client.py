@@ -0,0 +1,569 @@
+import time
+import random
+import socket
+import threading
+
+import metrics
+from singleflight import SingleFlight, FlightStream, AsyncFlight, AsyncFlightStream
+
+# Resilient wrapper around the Groq client, shared by the text and vision paths.
+#
+# Each request gets connect/read timeouts, retries with capped exponential
+# backoff and full jitter (honouring Retry-After on 429), a per-model circuit
+# breaker, and an ordered list of fallback models. Failures surface as LLMError
+# with a `kind` instead of being swallowed. `base_url` can point at a local
+# OpenAI/Groq-compatible fake endpoint for testing. Identical concurrent
+# requests can share one upstream call (see singleflight.py), and every attempt
+# is admitted by the shared rate-limit scheduler when one is set (scheduler.py).
+# With a hedging policy, a stream whose first token is late is raced against a
+# second request (see hedge.py).
+#
+# The groq SDK (and httpx under it) is imported on first use, not at module
+# import, because it dominates the start-up time of the GUI and the CLI.
+
+DEFAULT_FALLBACKS = {
+    "llama3-70b-8192": ["llama3-8b-8192"],
+    "llama-3.2-90b-vision-preview": ["llama-3.2-11b-vision-preview"],
+}
+
+
+class LLMError(Exception):
+    """A request that failed on every model it was allowed to try.
+
+    kind is one of "auth", "bad_request", "rate_limited", "timeout",
+    "connection", "server", "circuit_open" or "cancelled".
+    """
+
+    def __init__(self, kind, message, status=None, model=None, attempts=0):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+        self.model = model
+        self.attempts = attempts
+
+    def to_dict(self):
+        return {"kind": self.kind, "message": str(self), "status": self.status,
+                "model": self.model, "attempts": self.attempts}
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; lets one probe through after `reset_after` seconds."""
+
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_after:
+                # Half-open: allow a probe, re-open immediately if it fails
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return "open" if self.opened_at is not None else "closed"
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(error):
+    # -> (kind, status, retryable on the same model, worth trying a fallback model)
+    import groq
+    if isinstance(error, groq.APITimeoutError):
+        return "timeout", None, True, True
+    if isinstance(error, groq.APIConnectionError):
+        return "connection", None, True, True
+    if isinstance(error, groq.APIStatusError):
+        status = error.status_code
+        if status == 429:
+            return "rate_limited", status, True, True
+        if status in (401, 403):
+            return "auth", status, False, False
+        if status == 404:
+            return "bad_request", status, False, True  # e.g. a decommissioned model
+        if status >= 500:
+            return "server", status, True, True
+        return "bad_request", status, False, False
+    return "connection", None, False, False
+
+
+class ResilientClient:
+    def __init__(self, api_key, base_url=None, connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=3, backoff_base=0.5, backoff_cap=8.0, max_retry_after=20.0,
+                 fallbacks=None, breaker_threshold=5, breaker_reset=30.0, scheduler=None, hedging=None):
+        self.client = self.make_sdk_client(api_key, base_url, connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_retry_after = max_retry_after
+        self.fallbacks = DEFAULT_FALLBACKS if fallbacks is None else fallbacks
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.breakers = {}
+        self.stats = {"requests": 0, "retries": 0, "fallbacks": 0, "failures": 0}
+        self.flights = SingleFlight()
+        self.scheduler = scheduler
+        self.hedging = hedging
+        self._lock = threading.Lock()
+
+    def make_sdk_client(self, api_key, base_url, connect_timeout, read_timeout):
+        import httpx
+        from groq import Groq
+        return Groq(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            max_retries=0,  # retries are handled here
+        )
+
+    def breaker(self, model):
+        with self._lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+            return self.breakers[model]
+
+    def models_for(self, model):
+        return [model] + [m for m in self.fallbacks.get(model, []) if m != model]
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def on_error(self, error, candidate, attempt, attempts, breaker):
+        # -> (LLMError, seconds to wait before retrying the same model, or None to move on)
+        kind, status, retryable, fallback = classify(error)
+        last_error = LLMError(kind, str(error), status=status, model=candidate, attempts=attempts)
+        if not fallback:
+            # Our request or key is at fault, not the model; no other model will help
+            self.stats["failures"] += 1
+            raise last_error from error
+        breaker.record_failure()
+        if not retryable or attempt == self.max_retries or not breaker.allow():
+            return last_error, None
+        delay = retry_after_seconds(error) if kind == "rate_limited" else None
+        if kind == "rate_limited" and self.scheduler is not None:
+            # The limit is per key, so every caller of this model holds off
+            self.scheduler.pause(candidate, self.backoff(attempt) if delay is None else delay)
+        if delay is not None and delay > self.max_retry_after:
+            return last_error, None  # saturated for a while; move on to the next model
+        self.stats["retries"] += 1
+        metrics.inc("llm_retries_total", model=candidate, kind=kind)
+        return last_error, self.backoff(attempt) if delay is None else delay
+
+    def complete(self, model, messages, cancel=None, coalesce_key=None, session=None, **params):
+        """Create a chat completion (streaming or not), retrying and falling back as needed.
+
+        Returns (model_used, completion), where a stream comes back as a
+        FlightStream. Concurrent calls with the same coalesce_key (see
+        singleflight.request_key) share one upstream request. `session` is the
+        scheduler's fairness key. Token usage and mid-stream failures are
+        recorded here, once per upstream request. Raises LLMError when every
+        model failed.
+        """
+        streaming = bool(params.get("stream"))
+        while True:
+            flight, leader = self.flights.join(coalesce_key)
+            if leader:
+                try:
+                    send = self.hedged_request if streaming and self.hedging is not None else self.request
+                    model_used, result, ticket = send(model, messages, cancel, session, **params)
+                except BaseException as e:
+                    flight.fail(e if isinstance(e, LLMError) else LLMError("cancelled", "Request cancelled", model=model))
+                    raise
+                self.watch(flight, model_used, ticket)
+                flight.start(model_used, result, streaming)
+            else:
+                try:
+                    model_used = flight.wait(cancel)
+                except LLMError as e:
+                    if e.kind == "cancelled" and not (cancel is not None and cancel.is_set()):
+                        continue  # the caller we joined gave up; go upstream ourselves
+                    raise
+                if model_used is None:
+                    raise LLMError("cancelled", "Request cancelled", model=model)
+            if not streaming:
+                return model_used, flight.result
+            return model_used, FlightStream(flight, joined=not leader)
+
+    def watch(self, flight, model, ticket=None):
+        def on_item(item):
+            usage = chunk_usage(item)
+            record_usage(model, usage)
+            if usage is not None and self.scheduler is not None:
+                self.scheduler.settle(ticket, getattr(usage, "total_tokens", None))
+        flight.on_item = on_item
+        flight.on_error = lambda: self.breaker(model).record_failure()
+
+    def forfeit(self, ticket):
+        # An admitted request that produced no tokens: give back its token reservation
+        if ticket is not None and self.scheduler is not None:
+            self.scheduler.settle(ticket, 0)
+
+    def estimate(self, messages, params):
+        from scheduler import estimate_tokens
+        return estimate_tokens(messages, params.get("max_tokens"))
+
+    def request(self, model, messages, cancel=None, session=None, **params):
+        # One upstream request with retries and fallbacks -> (model_used, completion, scheduler ticket)
+        import groq
+        self.stats["requests"] += 1
+        last_error = None
+        attempts = 0
+        for index, candidate in enumerate(self.models_for(model)):
+            if index:
+                self.stats["fallbacks"] += 1
+                metrics.inc("llm_fallbacks_total", model=candidate)
+            breaker = self.breaker(candidate)
+            if not breaker.allow():
+                last_error = LLMError("circuit_open", f"Circuit open for {candidate}", model=candidate, attempts=attempts)
+                continue
+            for attempt in range(self.max_retries + 1):
+                if cancel is not None and cancel.is_set():
+                    raise LLMError("cancelled", "Request cancelled", model=candidate, attempts=attempts)
+                ticket = None
+                if self.scheduler is not None:
+                    ticket = self.scheduler.acquire(candidate, self.estimate(messages, params), session, cancel)
+                    if ticket is None:
+                        raise LLMError("cancelled", "Request cancelled", model=candidate, attempts=attempts)
+                attempts += 1
+                try:
+                    completion = self.client.chat.completions.create(model=candidate, messages=messages, **params)
+                except groq.APIError as e:
+                    self.forfeit(ticket)
+                    last_error, wait = self.on_error(e, candidate, attempt, attempts, breaker)
+                    if wait is None:
+                        break
+                    if cancel is not None:
+                        cancel.wait(wait)
+                    else:
+                        time.sleep(wait)
+                    continue
+                breaker.record_success()
+                return candidate, completion, ticket
+        self.stats["failures"] += 1
+        raise last_error or LLMError("connection", "No model available", model=model, attempts=attempts)
+
+    def hedged_request(self, model, messages, cancel=None, session=None, **params):
+        # request() for a stream, raced against a second request if its first token is late
+        import queue
+        import contextvars
+        from hedge import HeadStream, read_head
+        policy = self.hedging
+        number = policy.begin()
+        results = queue.Queue()
+        stops = []
+        streams = {}  # attempt index -> its stream, once the response headers are in
+        winner = []   # the winning attempt's index, or None once nobody may win
+        lock = threading.Lock()
+
+        def attempt(index, target, stop):
+            started = time.perf_counter()
+            stream = ticket = None
+            try:
+                model_used, stream, ticket = self.request(target, messages, stop, session, **params)
+                with lock:
+                    streams[index] = stream
+                    lost = bool(winner)
+                if lost:
+                    raise LLMError("cancelled", "Hedged request lost", model=model_used)
+                try:
+                    head, rest = read_head(stream)
+                except Exception as e:
+                    raise e if isinstance(e, LLMError) else stream_error(e, model_used)
+            except Exception as e:
+                if stream is not None:
+                    stream.close()
+                    self.forfeit(ticket)
+                results.put((index, None, e))
+                return
+            with lock:
+                won = not winner
+                winner.append(index)
+            if not won:
+                stream.close()
+                self.forfeit(ticket)
+                return
+            policy.observe(model_used, time.perf_counter() - started)
+            results.put((index, (model_used, HeadStream(stream, head, rest), ticket), None))
+
+        def launch(target):
+            stop = threading.Event()
+            stops.append(stop)
+            # In a copy of the caller's context, so the request keeps its scheduler priority
+            threading.Thread(target=contextvars.copy_context().run, args=(attempt, len(stops) - 1, target, stop),
+                             name="medimind-hedge", daemon=True).start()
+
+        started = time.perf_counter()
+        deadline = started + policy.deadline(model)
+        hedged = False
+        errors = {}
+        launch(model)
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    raise LLMError("cancelled", "Request cancelled", model=model)
+                wait = 0.1 if hedged else min(0.1, max(0.0, deadline - time.perf_counter()))
+                try:
+                    index, result, error = results.get(timeout=wait)
+                except queue.Empty:
+                    if not hedged and time.perf_counter() >= deadline:
+                        hedged = True
+                        if policy.hedge(number, model):
+                            launch(policy.alternate(model, self.fallbacks))
+                    continue
+                if error is None:
+                    break
+                errors[index] = error
+                if len(errors) == len(stops):
+                    if len(stops) > 1:
+                        policy.finished(model, "failed")
+                    raise errors[0]
+        finally:
+            for stop in stops:
+                stop.set()
+            with lock:
+                if not winner:
+                    winner.append(None)
+                losers = [stream for i, stream in streams.items() if i != winner[0]]
+            # A loser still waiting for its first token is woken up now instead of at
+            # its first token or read timeout; its thread then closes it and frees its ticket
+            for stream in losers:
+                abort_stream(stream)
+        if len(stops) > 1:
+            if index:
+                # The primary's first token was at least this late
+                policy.observe(model, time.perf_counter() - started)
+            policy.finished(model, "hedge_won" if index else "primary_won")
+        return result
+
+
+class AsyncResilientClient(ResilientClient):
+    """ResilientClient for asyncio callers (the HTTP service).
+
+    Uses AsyncGroq over one keep-alive connection pool of `max_connections`.
+    At most `max_concurrency` upstream requests (including their streams) are
+    in flight; callers sharing a request through coalescing share its slot.
+    """
+
+    def __init__(self, api_key, max_connections=32, max_concurrency=16, **kwargs):
+        self.max_connections = max_connections
+        import asyncio
+        super().__init__(api_key, **kwargs)
+        self.flights = SingleFlight(AsyncFlight)
+        self.slots = asyncio.Semaphore(max_concurrency)
+
+    def make_sdk_client(self, api_key, base_url, connect_timeout, read_timeout):
+        import httpx
+        from groq import AsyncGroq
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        limits = httpx.Limits(max_connections=self.max_connections,
+                              max_keepalive_connections=self.max_connections, keepalive_expiry=60)
+        return AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0,
+            http_client=httpx.AsyncClient(timeout=timeout, limits=limits),
+        )
+
+    async def complete(self, model, messages, cancel=None, coalesce_key=None, session=None, **params):
+        """Async complete(); cancelling the calling task abandons the request."""
+        streaming = bool(params.get("stream"))
+        while True:
+            flight, leader = self.flights.join(coalesce_key)
+            if leader:
+                try:
+                    await self.slots.acquire()
+                    flight.release = self.slots.release
+                    send = self.hedged_request if streaming and self.hedging is not None else self.request
+                    model_used, result, ticket = await send(model, messages, cancel, session, **params)
+                except BaseException as e:
+                    flight.fail(e if isinstance(e, LLMError) else LLMError("cancelled", "Request cancelled", model=model))
+                    raise
+                self.watch(flight, model_used, ticket)
+                flight.start(model_used, result, streaming)
+            else:
+                try:
+                    model_used = await flight.wait()
+                except LLMError as e:
+                    if e.kind == "cancelled" and not (cancel is not None and cancel.is_set()):
+                        continue
+                    raise
+            if not streaming:
+                return model_used, flight.result
+            return model_used, AsyncFlightStream(flight, joined=not leader)
+
+    async def request(self, model, messages, cancel=None, session=None, **params):
+        import asyncio
+        import groq
+        self.stats["requests"] += 1
+        last_error = None
+        attempts = 0
+        for index, candidate in enumerate(self.models_for(model)):
+            if index:
+                self.stats["fallbacks"] += 1
+                metrics.inc("llm_fallbacks_total", model=candidate)
+            breaker = self.breaker(candidate)
+            if not breaker.allow():
+                last_error = LLMError("circuit_open", f"Circuit open for {candidate}", model=candidate, attempts=attempts)
+                continue
+            for attempt in range(self.max_retries + 1):
+                if cancel is not None and cancel.is_set():
+                    raise LLMError("cancelled", "Request cancelled", model=candidate, attempts=attempts)
+                ticket = None
+                if self.scheduler is not None:
+                    ticket = await self.scheduler.acquire_async(candidate, self.estimate(messages, params), session)
+                attempts += 1
+                try:
+                    completion = await self.client.chat.completions.create(model=candidate, messages=messages, **params)
+                except groq.APIError as e:
+                    self.forfeit(ticket)
+                    last_error, wait = self.on_error(e, candidate, attempt, attempts, breaker)
+                    if wait is None:
+                        break
+                    await asyncio.sleep(wait)
+                    continue
+                breaker.record_success()
+                return candidate, completion, ticket
+        self.stats["failures"] += 1
+        raise last_error or LLMError("connection", "No model available", model=model, attempts=attempts)
+
+    async def hedged_request(self, model, messages, cancel=None, session=None, **params):
+        import asyncio
+        from hedge import AsyncHeadStream, read_head_async
+        policy = self.hedging
+        number = policy.begin()
+
+        async def attempt(target):
+            started = time.perf_counter()
+            model_used, stream, ticket = await self.request(target, messages, cancel, session, **params)
+            try:
+                head, rest = await read_head_async(stream)
+            except BaseException as e:
+                await stream.close()
+                self.forfeit(ticket)
+                if isinstance(e, Exception) and not isinstance(e, LLMError):
+                    raise stream_error(e, model_used) from e
+                raise
+            return model_used, AsyncHeadStream(stream, head, rest), ticket, time.perf_counter() - started
+
+        started = time.perf_counter()
+        attempts = [asyncio.ensure_future(attempt(model))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=policy.deadline(model))
+            if not done and policy.hedge(number, model):
+                attempts.append(asyncio.ensure_future(attempt(policy.alternate(model, self.fallbacks))))
+            pending = set(attempts)
+            while winner is None and pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in attempts if task in done and task.exception() is None), None)
+        finally:
+            for task in attempts:
+                if task is not winner:
+                    task.cancel()
+                    if task.done() and not task.cancelled() and task.exception() is None:
+                        # Finished together with the winner
+                        await task.result()[1].close()
+                        self.forfeit(task.result()[2])
+        if winner is None:
+            if len(attempts) > 1:
+                policy.finished(model, "failed")
+            raise attempts[0].exception()
+        model_used, stream, ticket, ttft = winner.result()
+        policy.observe(model_used, ttft)
+        if len(attempts) > 1:
+            hedge_won = winner is not attempts[0]
+            if hedge_won:
+                # The primary's first token was at least this late
+                policy.observe(model, time.perf_counter() - started)
+            policy.finished(model, "hedge_won" if hedge_won else "primary_won")
+        return model_used, stream, ticket
+
+    async def close(self):
+        await self.client.close()
+
+
+def chunk_usage(chunk):
+    # Groq reports stream usage under x_groq; OpenAI-style servers use chunk.usage
+    x_groq = getattr(chunk, "x_groq", None)
+    usage = getattr(x_groq, "usage", None) if x_groq is not None else None
+    if usage is None and isinstance(x_groq, dict):
+        usage = x_groq.get("usage")
+    return usage or getattr(chunk, "usage", None)
+
+
+def record_usage(model, usage):
+    # Token counts as reported by the API (final stream chunk or completion.usage)
+    if usage is None:
+        return
+    metrics.inc("llm_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, kind="prompt", model=model)
+    metrics.inc("llm_tokens_total", getattr(usage, "completion_tokens", 0) or 0, kind="completion", model=model)
+
+
+def abort_stream(stream):
+    # Close a sync stream that another thread may be blocked reading: closing the
+    # response does not wake a blocked read, shutting its socket down does
+    response = getattr(stream, "response", None)
+    network = response.extensions.get("network_stream") if response is not None else None
+    sock = network.get_extra_info("socket") if network is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def stream_error(error, model):
+    # Wrap an exception raised while iterating a stream
+    import httpx
+    import groq
+    kind = "timeout" if isinstance(error, (httpx.TimeoutException, groq.APITimeoutError)) else "connection"
+    return LLMError(kind, f"Stream interrupted: {error}", model=model)
+
+
+def error_message(error):
+    # User-facing text for an LLMError
+    messages = {
+        "auth": "The AI service rejected the API key. Please check GroqAPIKey in the .env file.",
+        "rate_limited": "The AI service is busy right now (rate limited). Please try again in a moment.",
+        "timeout": "The AI service took too long to respond. Please try again.",
+        "connection": "Could not reach the AI service. Please check your internet connection.",
+        "server": "The AI service is having problems right now. Please try again later.",
+        "circuit_open": "The AI service is temporarily unavailable. Please try again shortly.",
+        "bad_request": "The AI service could not process this request.",
+        "cancelled": "Request cancelled.",
+    }
+    return messages.get(error.kind, str(error))
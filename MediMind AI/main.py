@@ -1,28 +1,100 @@
-from diagnosis import analyze_symptoms
-from prescription import parse_prescription
+import startup
 import sys
 
+USAGE = """Usage: python main.py [diagnose|parse] [--cache] [--no-local] [--no-stream]
+       python main.py batch <input> [options]  (see: python main.py batch --help)
+       python main.py ocr <image> [<image> ...] [--workers N] [--timings]
+       python main.py serve [--host HOST] [--port PORT]  (multi-session HTTP service)
+
+Answers are printed as they stream in; --no-stream prints them once complete (for scripts).
+Add --profile-startup to any mode to print import and initialization timings."""
+
+def warm_up():
+    # Initialize what the first request would otherwise pay for, so it shows up in the profile
+    import llm
+    startup.mark("import llm")
+    llm.GetClient()
+    startup.mark("create Groq client")
+    llm.GetChatLog()
+    startup.mark("open chat log")
+    llm.GetContext()
+    startup.mark("load and index history")
+
+def show(header, run, streaming):
+    # run(on_token) -> result; with streaming, tokens are printed as they arrive
+    print(header)
+    if not streaming:
+        print(run(None))
+        return
+    printed = []
+
+    def on_token(text):
+        printed.append(text)
+        print(text, end="", flush=True)
+
+    result = run(on_token)
+    # Cached answers and error messages arrive whole, without tokens
+    if printed:
+        print()
+    else:
+        print(result)
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python main.py [diagnose|parse]")
-        sys.exit(1)
-    
-    mode = sys.argv[1].lower()
-    
+    profile = startup.requested()
+    args = [arg for arg in sys.argv[1:] if arg != startup.FLAG]
+    if not args or args[0] in ("-h", "--help"):
+        print(USAGE)
+        sys.exit(0 if args else 1)
+
+    mode = args[0].lower()
+    cacheable = "--cache" in args[1:]
+    streaming = "--no-stream" not in args[1:]
+
     if mode == "diagnose":
+        from diagnosis import analyze_symptoms
+        startup.mark("import diagnosis")
+        if profile:
+            warm_up()
+            startup.report()
         symptoms = input("Enter your symptoms: ")
-        result = analyze_symptoms(symptoms)
-        print("\nDiagnosis and recommended cure:")
-        print(result)
-        
+        show("\nDiagnosis and recommended cure:",
+             lambda on_token: analyze_symptoms(symptoms, cacheable=cacheable, on_token=on_token), streaming)
+
     elif mode == "parse":
+        from prescription import parse_prescription
+        startup.mark("import prescription")
+        if profile:
+            warm_up()
+            startup.report()
         prescription_text = input("Enter your prescription text: ")
-        result = parse_prescription(prescription_text)
-        print("\nParsed prescription details:")
-        print(result)
-        
+        local = "--no-local" not in args[1:]
+        show("\nParsed prescription details:",
+             lambda on_token: parse_prescription(prescription_text, cacheable=cacheable, on_token=on_token, local=local),
+             streaming)
+
+    elif mode == "ocr":
+        from ocr import run_cli
+        startup.mark("import ocr")
+        if profile:
+            startup.report()
+        run_cli(args[1:])
+
+    elif mode == "batch":
+        from batch import run_cli
+        startup.mark("import batch")
+        if profile:
+            startup.report()
+        run_cli(args[1:])
+
+    elif mode == "serve":
+        from service import main as serve
+        startup.mark("import service")
+        if profile:
+            startup.report()
+        serve(args[1:])
+
     else:
-        print("Invalid mode. Use 'diagnose' or 'parse'.")
+        print("Invalid mode. Use 'diagnose', 'parse', 'ocr', 'batch' or 'serve'.")
 
 if __name__ == "__main__":
     main()
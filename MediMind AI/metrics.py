@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+# Lightweight in-process instrumentation.
+#
+#   with span("chatlog_append"):      # duration histogram `medimind_chatlog_append_seconds`
+#       ...
+#   observe("llm_ttft_seconds", 0.4, model="llama3-70b-8192")
+#   inc("llm_tokens_total", 120, kind="prompt", model=...)
+#   gauge("scheduler_queue_depth", 3, priority="batch")   # current value, not traced
+#
+# Aggregates are kept in memory (a dict update under a lock per event) and can be
+# rendered in the Prometheus text format, dumped to a file or served over HTTP.
+# Setting a trace file additionally appends every event as a JSON line, buffered.
+
+PREFIX = "medimind_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+_gauges = {}      # (name, labels) -> value
+_trace_file = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _trace(event):
+    if _trace_file is not None:
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with _lock:
+            _trace_file.write(line)
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    if _trace_file is not None:
+        _trace({"ts": time.time(), "type": "counter", "name": name, "value": amount, "labels": labels})
+
+
+def gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += 1
+        histogram[-1] += seconds
+    if _trace_file is not None:
+        _trace({"ts": time.time(), "type": "observation", "name": name, "value": seconds, "labels": labels})
+
+
+@contextmanager
+def span(name, **labels):
+    """Time the enclosed block into the `<name>_seconds` histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - started, **labels)
+
+
+def enable_trace(path):
+    """Append every event to `path` as JSON lines (buffered; flushed at exit)."""
+    global _trace_file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _lock:
+        if _trace_file is not None:
+            _trace_file.close()
+        _trace_file = open(path, "a", encoding="utf-8", buffering=64 * 1024)
+    atexit.register(flush)
+
+
+def flush():
+    with _lock:
+        if _trace_file is not None:
+            _trace_file.flush()
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = []
+    for k, v in items:
+        value = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{k}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters), {key: list(value) for key, value in _histograms.items()}
+
+
+def render_prometheus():
+    counters, histograms = snapshot()
+    with _lock:
+        gauges = dict(_gauges)
+    lines = []
+    for name in sorted({name for name, _ in gauges}):
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_labels_text(labels)} {value}")
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_labels_text(labels)} {value}")
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{PREFIX}{name}_count{_labels_text(labels)} {values[-2]}")
+            lines.append(f"{PREFIX}{name}_sum{_labels_text(labels)} {values[-1]:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def dump_prometheus(path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+
+
+def serve_prometheus(port, host="127.0.0.1"):
+    """Serve /metrics in the Prometheus text format on a background thread."""
+    # http.server is slow to import and only needed here
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
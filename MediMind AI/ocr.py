@@ -0,0 +1,200 @@
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, ImageSequence
+import pytesseract
+
+from cache import ResponseCache
+from config import data_path
+
+# OCR pipeline for prescription images, shared by the GUI and the CLI.
+#
+#   preprocess: grayscale -> downscale to ~300 DPI -> deskew -> binarize (Otsu)
+#   recognize:  Tesseract with an explicit engine / page-segmentation mode, on
+#               every page of a multi-page file (TIFF), pages joined by a blank line
+#
+# Results are cached by the SHA-256 of the image bytes plus the OCR settings,
+# and every result carries per-stage timings in seconds.
+
+TARGET_DPI = 300
+# Longest side used when the file carries no DPI information (an A4/letter page at 300 DPI)
+MAX_SIDE = 3300
+DESKEW_ANGLES = [a / 2 for a in range(-10, 11)]  # -5 to +5 degrees in half-degree steps
+# Deskew only when the best angle scores this much better than leaving the page alone
+DESKEW_MIN_GAIN = 1.5
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(data_path("OCRCache.sqlite3"), max_entries=128, ttl=30 * 24 * 3600)
+    return _cache
+
+
+def downscale(img):
+    dpi = img.info.get("dpi", (0, 0))[0]
+    scale = TARGET_DPI / dpi if dpi and dpi > TARGET_DPI else 1.0
+    scale = min(scale, MAX_SIDE / max(img.size))
+    if scale < 1.0:
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+    return img
+
+
+def _row_profile_score(img):
+    # Text lines aligned with the rows give sharp steps between the darkness of
+    # adjacent rows; a width-1 box resize yields the per-row means without
+    # touching pixels in Python. Summing the steps rather than the variance
+    # keeps slow shading across a photographed page from scoring.
+    rows = img.resize((1, img.height), Image.BOX).tobytes()
+    return sum((b - a) ** 2 for a, b in zip(rows, rows[1:]))
+
+
+def estimate_skew(gray):
+    """Angle in degrees to rotate `gray` by to level its text lines; 0 unless clearly skewed."""
+    thumb = ImageOps.invert(gray)
+    thumb.thumbnail((600, 600))
+    # Fill the rotated-in corners with the paper, and score only the middle of
+    # the page, which stays inside the image at every angle
+    histogram = thumb.histogram()
+    background = max(range(256), key=histogram.__getitem__)
+    width, height = thumb.size
+    box = (width // 6, height // 6, width - width // 6, height - height // 6)
+    scores = {angle: _row_profile_score(thumb.rotate(angle, resample=Image.BILINEAR, fillcolor=background).crop(box))
+              for angle in DESKEW_ANGLES}
+    best_angle = max(scores, key=scores.get)
+    # A best angle at the edge of the range means the curve never peaked, i.e. no text lines were found
+    if best_angle in (DESKEW_ANGLES[0], DESKEW_ANGLES[-1]) or scores[best_angle] < DESKEW_MIN_GAIN * scores[0.0]:
+        return 0.0
+    return best_angle
+
+
+def otsu_threshold(gray):
+    histogram = gray.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = weight_background = 0
+    best_threshold, best_variance = 127, -1.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def preprocess(img, timings):
+    started = time.perf_counter()
+    gray = ImageOps.exif_transpose(img).convert("L")
+    timings["grayscale"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    gray = downscale(gray)
+    timings["downscale"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    angle = estimate_skew(gray)
+    if angle:
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    timings["deskew"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    threshold = otsu_threshold(gray)
+    binary = gray.point(lambda p: 255 if p > threshold else 0, mode="1")
+    timings["binarize"] = time.perf_counter() - started
+    return binary
+
+
+def recognize(path, config=TESSERACT_CONFIG):
+    """OCR one image file without the cache; returns {"text", "timings", "pages"}."""
+    timings = {}
+    pages = []
+    with Image.open(path) as img:
+        # Every frame of a multi-page file (e.g. a scanned TIFF); timings add up across pages
+        for frame in ImageSequence.Iterator(img):
+            started = time.perf_counter()
+            frame.load()
+            page_timings = {"decode": time.perf_counter() - started}
+            prepared = preprocess(frame, page_timings)
+            started = time.perf_counter()
+            pages.append(pytesseract.image_to_string(prepared, config=config).strip())
+            page_timings["tesseract"] = time.perf_counter() - started
+            for stage, seconds in page_timings.items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+    return {"text": "\n\n".join(page for page in pages if page), "timings": timings, "pages": len(pages)}
+
+
+def _content_key(path, config):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return f"ocr:{config}:{digest.hexdigest()}"
+
+
+def ocr_image(path, config=TESSERACT_CONFIG, use_cache=True):
+    """OCR one image file, returning {"text", "timings", "cached"}."""
+    started = time.perf_counter()
+    key = _content_key(path, config) if use_cache else None
+    hash_time = time.perf_counter() - started
+    if key:
+        text = get_cache().get(key)
+        if text is not None:
+            return {"text": text, "timings": {"hash": hash_time}, "cached": True}
+    result = recognize(path, config)
+    result["timings"]["hash"] = hash_time
+    result["cached"] = False
+    if key:
+        get_cache().put(key, result["text"])
+    return result
+
+
+def ocr_many(paths, workers=None, config=TESSERACT_CONFIG, use_cache=True):
+    """OCR several files (or pages) in a process pool; results follow the order of `paths`."""
+    results = [None] * len(paths)
+    keys = {}
+    todo = []
+    for i, path in enumerate(paths):
+        key = _content_key(path, config) if use_cache else None
+        text = get_cache().get(key) if key else None
+        if text is not None:
+            results[i] = {"text": text, "timings": {}, "cached": True}
+        else:
+            keys[i] = key
+            todo.append(i)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, result in zip(todo, pool.map(recognize, [paths[i] for i in todo], [config] * len(todo))):
+                result["cached"] = False
+                results[i] = result
+                if keys[i]:
+                    get_cache().put(keys[i], result["text"])
+    return results
+
+
+def run_cli(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog="main.py ocr", description="Extract text from prescription images.")
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="OCR processes (default: CPU count)")
+    parser.add_argument("--psm", type=int, default=6, help="Tesseract page segmentation mode")
+    parser.add_argument("--timings", action="store_true", help="print per-stage timings")
+    args = parser.parse_args(argv)
+
+    config = f"--oem 1 --psm {args.psm}"
+    for path, result in zip(args.images, ocr_many(args.images, args.workers, config)):
+        print(f"===== {path}{' (cached)' if result['cached'] else ''}")
+        print(result["text"])
+        if args.timings:
+            print(", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in result["timings"].items()))
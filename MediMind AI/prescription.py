@@ -1,6 +1,48 @@
-from llm import ChatBot
+import metrics
+from llm import ChatBot, ChatBotAsync, CachedChatBot, RecordTurn
+from rxparse import extract, format_medications
 
-def parse_prescription(prescription_text):
-    prompt = f"Parse the following prescription text and list the medication, dosage, and timing details: {prescription_text}"
-    response = ChatBot(prompt)
+PROMPT_TEMPLATE = "Parse the following prescription text and list the medication, dosage, and timing details: {text}"
+
+def parse_prescription(prescription_text, cacheable=False, on_token=None, cancel=None, local=True):
+    # cacheable=True runs statelessly and reuses earlier answers for the same text.
+    # local=True answers from the rule-based extractor when it is confident and
+    # only sends the text to the LLM otherwise.
+    with metrics.span("task", task="parse_prescription", cached=cacheable):
+        prompt = PROMPT_TEMPLATE.format(text=prescription_text)
+        if local:
+            with metrics.span("prescription_extract"):
+                extraction = extract(prescription_text)
+            reason = extraction.reason()
+            metrics.inc("prescription_route_total", route="llm" if reason else "local", reason=reason or "confident")
+            if reason is None:
+                response = format_medications(extraction.medications)
+                if not cacheable:
+                    if on_token:
+                        on_token(response)
+                    RecordTurn(prompt, response)
+                return response
+        if cacheable:
+            return CachedChatBot("parse_prescription", PROMPT_TEMPLATE, prescription_text)
+        response = ChatBot(prompt, on_token=on_token, cancel=cancel, route=False)
     return response
+
+async def parse_prescription_async(prescription_text, session_id, on_token=None, local=True):
+    # HTTP service variant: returns {"result", "source", "medications"} for one session
+    import asyncio
+    with metrics.span("task", task="parse_prescription", cached=False):
+        prompt = PROMPT_TEMPLATE.format(text=prescription_text)
+        if local:
+            with metrics.span("prescription_extract"):
+                extraction = extract(prescription_text)
+            reason = extraction.reason()
+            metrics.inc("prescription_route_total", route="llm" if reason else "local", reason=reason or "confident")
+            if reason is None:
+                response = format_medications(extraction.medications)
+                if on_token:
+                    on_token(response)
+                await asyncio.to_thread(RecordTurn, prompt, response, session_id)
+                return {"result": response, "source": "local",
+                        "medications": [m.to_dict() for m in extraction.medications]}
+        response = await ChatBotAsync(prompt, session_id, on_token=on_token, route=False)
+    return {"result": response, "source": "llm", "medications": None}
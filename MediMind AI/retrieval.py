@@ -0,0 +1,121 @@
+import re
+import math
+import heapq
+from bisect import bisect_left
+
+# Local lexical retrieval over a conversation (BM25, no network).
+#
+# HistoryIndex is an inverted index that is updated one message at a time, so
+# adding a turn costs a few dict appends and nothing is ever re-indexed. A query
+# scores only the postings of its own terms. The rarest terms are scored first,
+# and a term that occurs in very many messages is only scored over its most
+# recent `max_postings` occurrences: such a term carries little weight, and a
+# recent occurrence is the more useful one. That bounds a search to a few
+# thousand postings however long the history grows, so it stays well under a
+# millisecond at tens of thousands of messages.
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a about above after again all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his
+how i if in into is it its itself just me more most my no nor not now of off on once only or other our ours out
+over own same she should so some such than that the their them then there these they this those through to too
+under until up very was we were what when where which while who whom why will with would you your yours yourself
+also get got like please thanks thank ok okay yes hi hello hey tell know need want feel im ive dont
+""".split())
+
+
+def _stem(word):
+    # Plural and verb endings only; enough for "allergies"/"allergy" or "rashes"/"rash"
+    if len(word) > 4:
+        if word.endswith("ies"):
+            return word[:-3] + "y"
+        for suffix in ("ing", "ed", "es", "s"):
+            if word.endswith(suffix) and not word.endswith("ss"):
+                return word[:-len(suffix)]
+    return word
+
+
+_stems = {}
+
+
+def _term(word):
+    term = _stems[word] = "" if word in STOPWORDS or len(word) < 2 else _stem(word)
+    return term
+
+
+def terms(text):
+    # Stems are memoized (the vocabulary is small next to the number of words seen)
+    if len(_stems) > 200000:
+        _stems.clear()
+    get = _stems.get
+    return [term for term in [get(word) if word in _stems else _term(word) for word in _WORD_RE.findall(text.lower())]
+            if term]
+
+
+class HistoryIndex:
+    """Incremental BM25 index; documents are numbered 0, 1, 2, ... in the order added."""
+
+    def __init__(self, k1=1.2, b=0.75, max_postings=512, max_query_postings=2048):
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        self.max_query_postings = max_query_postings
+        self.postings = {}  # term -> ([doc ids], [BM25 term weights]), doc ids ascending
+        self.lengths = []
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, text):
+        """Index `text`; returns its document id."""
+        doc = len(self.lengths)
+        words = terms(text)
+        self.lengths.append(len(words))
+        self._total_length += len(words)
+        # The BM25 term-frequency part is computed once here, with the average
+        # length at indexing time; the average settles after a few dozen messages
+        k1 = self.k1
+        norm = k1 * (1 - self.b + self.b * len(words) / (self._total_length / len(self.lengths) or 1.0))
+        counts = {}
+        for term in words:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            weight = count * (k1 + 1) / (count + norm)
+            entry = self.postings.get(term)
+            if entry is None:
+                self.postings[term] = ([doc], [weight])
+            else:
+                entry[0].append(doc)
+                entry[1].append(weight)
+        return doc
+
+    def search(self, query, k=5, before=None):
+        """Top `k` (score, doc id) pairs for `query`, best first, among documents below `before`."""
+        n = len(self.lengths)
+        if not n or k <= 0:
+            return []
+        before = n if before is None else min(before, n)
+        query_terms = []
+        for term in set(terms(query)):
+            entry = self.postings.get(term)
+            if entry is not None:
+                df = len(entry[0])
+                query_terms.append((df, math.log(1 + (n - df + 0.5) / (df + 0.5)), entry))
+        query_terms.sort(key=lambda item: item[0])
+
+        scores = {}
+        get = scores.get
+        budget = self.max_query_postings
+        for df, idf, (docs, weights) in query_terms:
+            if budget <= 0:
+                break
+            # Skip occurrences at or after `before`, then keep only the most recent ones
+            end = df if docs[-1] < before else bisect_left(docs, before)
+            start = max(0, end - min(self.max_postings, budget))
+            budget -= end - start
+            for doc, weight in zip(docs[start:end], weights[start:end]):
+                scores[doc] = get(doc, 0.0) + idf * weight
+        return heapq.nlargest(k, ((score, doc) for doc, score in scores.items()))
@@ -0,0 +1,582 @@
+import re
+from functools import lru_cache
+from collections import deque
+
+# Local structured extractor for prescriptions, tried before the LLM.
+#
+#   extraction = extract("Tab Amoxicillin 500mg TDS x 5 days, Syp Benadryl 10ml HS")
+#   extraction.medications[0].to_dict()
+#   -> {"name": "Amoxicillin", "form": "tablet", "strength": "500 mg",
+#       "frequency": "three times a day (TDS)", "route": "oral", "duration": "5 days", ...}
+#
+# Drug names are found with an Aho-Corasick automaton over a lexicon of common
+# generics and brands, with a bounded edit-distance fallback for OCR errors
+# (e.g. "Amoxici1in"). Strength, frequency, route, duration and meal timing come
+# from small regex grammars applied to the text between one drug and the next on
+# the same line. Every field carries a confidence in [0, 1]; parse_prescription
+# only calls the LLM when the extraction as a whole is not confident. Dosing text
+# that belongs to no recognized drug (an unknown name before a strength, or a
+# line with a strength, frequency or duration but no drug) makes the extraction
+# unconfident, so a drug is never silently dropped. So does a line that stops,
+# holds or conditions a drug ("STOP Aspirin", "If allergic, use ...", "max 3 per
+# day"), and any free text in a drug's segment the grammars do not account for:
+# those lines are read by the LLM, never listed as plain doses.
+
+CONFIDENCE_THRESHOLD = 0.75
+
+# Canonical name -> extra spellings. Multi-word entries are matched as phrases.
+DRUGS = {
+    "Paracetamol": ["acetaminophen", "dolo", "crocin", "calpol"],
+    "Ibuprofen": ["brufen"],
+    "Ibuprofen + Paracetamol": ["combiflam"],
+    "Diclofenac": ["voveran"],
+    "Aceclofenac": [],
+    "Tramadol": [],
+    "Aspirin": ["ecosprin"],
+    "Amoxicillin": ["amoxycillin", "mox"],
+    "Amoxicillin + Clavulanate": ["augmentin", "amoxicillin clavulanate", "co-amoxiclav", "amoxyclav"],
+    "Azithromycin": ["azithral", "azee"],
+    "Cefixime": ["taxim-o"],
+    "Cefuroxime": [],
+    "Cefpodoxime": [],
+    "Ceftriaxone": [],
+    "Ciprofloxacin": ["ciplox"],
+    "Levofloxacin": [],
+    "Ofloxacin": [],
+    "Norfloxacin": [],
+    "Nitrofurantoin": [],
+    "Metronidazole": ["flagyl"],
+    "Doxycycline": [],
+    "Clarithromycin": [],
+    "Linezolid": [],
+    "Fluconazole": [],
+    "Albendazole": [],
+    "Ivermectin": [],
+    "Acyclovir": ["aciclovir"],
+    "Oseltamivir": [],
+    "Pantoprazole": ["pan 40", "pantop"],
+    "Omeprazole": ["omez"],
+    "Rabeprazole": ["razo"],
+    "Esomeprazole": ["nexpro"],
+    "Ranitidine": ["rantac"],
+    "Famotidine": [],
+    "Domperidone": [],
+    "Ondansetron": ["emeset"],
+    "Loperamide": [],
+    "Lactulose": [],
+    "Sucralfate": [],
+    "Metformin": ["glycomet"],
+    "Glimepiride": ["amaryl"],
+    "Gliclazide": [],
+    "Sitagliptin": ["januvia"],
+    "Vildagliptin": [],
+    "Empagliflozin": [],
+    "Dapagliflozin": [],
+    "Insulin": [],
+    "Insulin Glargine": ["lantus", "basalog"],
+    "Insulin Detemir": ["levemir"],
+    "Insulin Degludec": ["tresiba"],
+    "Insulin Lispro": ["humalog"],
+    "Insulin Aspart": ["novorapid"],
+    "Insulin Glulisine": ["apidra"],
+    "Regular Insulin": ["insulin regular", "actrapid", "human actrapid"],
+    "Isophane Insulin": ["insulin nph", "nph insulin", "insulatard"],
+    "Amlodipine": ["amlong"],
+    "Telmisartan": ["telma"],
+    "Losartan": [],
+    "Olmesartan": [],
+    "Atenolol": [],
+    "Metoprolol": [],
+    "Bisoprolol": [],
+    "Carvedilol": [],
+    "Propranolol": [],
+    "Ramipril": [],
+    "Enalapril": [],
+    "Hydrochlorothiazide": [],
+    "Chlorthalidone": [],
+    "Furosemide": ["frusemide", "lasix"],
+    "Torsemide": [],
+    "Spironolactone": [],
+    "Atorvastatin": ["atorva"],
+    "Rosuvastatin": ["rosuvas"],
+    "Clopidogrel": ["clopilet"],
+    "Warfarin": [],
+    "Isosorbide Mononitrate": [],
+    "Levothyroxine": ["thyroxine", "thyronorm", "eltroxin"],
+    "Prednisolone": ["wysolone"],
+    "Methylprednisolone": ["medrol"],
+    "Dexamethasone": [],
+    "Hydrocortisone": [],
+    "Deflazacort": [],
+    "Cetirizine": ["zyrtec"],
+    "Levocetirizine": [],
+    "Fexofenadine": ["allegra"],
+    "Loratadine": [],
+    "Chlorpheniramine": [],
+    "Diphenhydramine": ["benadryl"],
+    "Montelukast": ["montair"],
+    "Salbutamol": ["albuterol", "asthalin"],
+    "Budesonide": [],
+    "Ambroxol": [],
+    "Dextromethorphan": [],
+    "Guaifenesin": [],
+    "Cholecalciferol": ["vitamin d3", "vit d3"],
+    "Calcium Carbonate": ["shelcal"],
+    "Folic Acid": [],
+    "Ferrous Sulfate": ["ferrous sulphate"],
+    "Methylcobalamin": [],
+    "Vitamin B Complex": ["b complex", "becosules"],
+    "Vitamin C": ["ascorbic acid", "limcee"],
+    "Multivitamin": [],
+    "Oral Rehydration Salts": ["ors"],
+    "Pregabalin": [],
+    "Gabapentin": [],
+    "Amitriptyline": [],
+    "Sertraline": [],
+    "Escitalopram": [],
+    "Fluoxetine": [],
+    "Alprazolam": [],
+    "Clonazepam": [],
+    "Zolpidem": [],
+    "Mupirocin": [],
+    "Clotrimazole": [],
+    "Betamethasone": [],
+}
+
+FORMS = {
+    "tab": "tablet", "tabs": "tablet", "tablet": "tablet", "tablets": "tablet", "t": "tablet",
+    "cap": "capsule", "caps": "capsule", "capsule": "capsule", "capsules": "capsule",
+    "syp": "syrup", "syr": "syrup", "syrup": "syrup", "susp": "suspension", "suspension": "suspension",
+    "inj": "injection", "injection": "injection",
+    "oint": "ointment", "ointment": "ointment", "cream": "cream", "gel": "gel", "lotion": "lotion",
+    "drop": "drops", "drops": "drops", "gtt": "drops", "inhaler": "inhaler", "neb": "nebulizer",
+    "sachet": "sachet", "powder": "powder",
+}
+FORM_ROUTES = {
+    "tablet": "oral", "capsule": "oral", "syrup": "oral", "suspension": "oral", "sachet": "oral",
+    "powder": "oral", "ointment": "topical", "cream": "topical", "gel": "topical", "lotion": "topical",
+    "inhaler": "inhaled", "nebulizer": "inhaled", "injection": "injection",
+}
+
+FREQUENCY_CODES = {
+    "od": "once a day", "qd": "once a day", "bd": "twice a day", "bid": "twice a day",
+    "tds": "three times a day", "tid": "three times a day", "qid": "four times a day",
+    "qds": "four times a day", "hs": "at bedtime", "qhs": "at bedtime", "sos": "when needed",
+    "prn": "when needed", "stat": "immediately, once", "ac": "before meals", "pc": "after meals",
+    "qod": "every other day", "weekly": "once a week",
+}
+FREQUENCY_WORDS = {
+    "once": "once a day", "twice": "twice a day", "thrice": "three times a day",
+    "three times": "three times a day", "four times": "four times a day",
+}
+DOSE_SLOTS = ("morning", "afternoon", "night")
+DOSE_SLOTS_4 = ("morning", "afternoon", "evening", "night")
+
+ROUTES = {
+    "po": "oral", "oral": "oral", "orally": "oral", "by mouth": "oral",
+    "iv": "intravenous", "im": "intramuscular", "sc": "subcutaneous", "s/c": "subcutaneous",
+    "subcut": "subcutaneous", "sl": "sublingual", "sublingual": "sublingual",
+    "topical": "topical", "apply": "topical", "local application": "topical",
+    "inhale": "inhaled", "inhaled": "inhaled", "puffs": "inhaled",
+    "eye": "ophthalmic", "ear": "otic", "nasal": "nasal", "pr": "rectal",
+}
+
+STRENGTH_RE = re.compile(
+    r"(?<![\w.])(\d[\dOo]*(?:\.\d+)?(?:\s*/\s*\d+(?:\.\d+)?)?)\s*(mg|mcg|µg|g|gm|ml|iu|units?|%)(?![a-z])",
+    re.IGNORECASE)
+FREQUENCY_CODE_RE = re.compile(r"\b(" + "|".join(sorted(FREQUENCY_CODES, key=len, reverse=True)) + r")\b",
+                               re.IGNORECASE)
+FREQUENCY_WORD_RE = re.compile(r"\b(once|twice|thrice|three times|four times)\s*(?:a|per|every)?\s*(?:day|daily)\b",
+                               re.IGNORECASE)
+INTERVAL_RE = re.compile(r"\b(?:q\s*(\d{1,2})\s*h|every\s+(\d{1,2})\s*(?:hours|hrs?|h))\b", re.IGNORECASE)
+SLOTS_RE = re.compile(r"(?<![\d/])([0-2](?:[.,]5)?|½)\s*-\s*([0-2](?:[.,]5)?|½)\s*-\s*([0-2](?:[.,]5)?|½)"
+                      r"(?:\s*-\s*([0-2](?:[.,]5)?|½))?(?![\d/])")
+ROUTE_RE = re.compile(r"(?<![\w/])(" + "|".join(re.escape(r) for r in sorted(ROUTES, key=len, reverse=True))
+                      + r")(?![\w/])", re.IGNORECASE)
+DURATION_RE = re.compile(r"(?:\bx|×|\bfor)\s*(\d{1,3})\s*(days?|d|weeks?|wks?|w|months?|mo)\b", re.IGNORECASE)
+DURATION_SLASH_RE = re.compile(r"(?<![\d/])(\d{1,2})\s*/\s*(7|52|12)(?![\d/])")
+MEAL_RE = re.compile(r"\b(after|before|with)\s+(food|meals?|breakfast|lunch|dinner)\b|\b(empty stomach)\b",
+                     re.IGNORECASE)
+DURATION_UNITS = {"d": "day", "day": "day", "days": "day", "w": "week", "wk": "week", "wks": "week",
+                  "week": "week", "weeks": "week", "mo": "month", "month": "month", "months": "month"}
+SLASH_UNITS = {"7": "day", "52": "week", "12": "month"}
+
+# Words that stop, hold or condition a drug; their lines are never taken as plain doses
+QUALIFIER_RE = re.compile(
+    r"\b(stop|stopped|discontinue|discontinued|d/c|hold|withhold|avoid|omit|skip|if|unless|instead|replace"
+    r"|switch|change to|max|maximum|not more than|not to exceed|do not|don't|only)\b", re.IGNORECASE)
+# Words a dosing segment may contain besides what the grammars match
+FILLER_WORDS = frozenset("""
+a an and the of to per each every day days daily take taken then one two three half at in on with
+morning afternoon evening night noon bedtime water orally dose doses as needed required
+""".split())
+
+# Names that are ambiguous without a qualifier ("Insulin" but not which insulin)
+NEEDS_QUALIFIER = {"Insulin"}
+
+# Characters Tesseract commonly returns for letters inside words
+OCR_LETTER_FIXES = str.maketrans({"0": "o", "1": "l", "5": "s", "8": "b", "|": "l", "$": "s"})
+FUZZY_MIN_LENGTH = 5
+
+
+class Automaton:
+    """Aho-Corasick multi-pattern matcher over lowercase text."""
+
+    def __init__(self, patterns):
+        # patterns: {text: value}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern, value in patterns.items():
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append((len(pattern), value))
+        # Breadth-first, so every failure link points at an already finished state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """Yield (start, end, value) for every occurrence of every pattern."""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.output[state]:
+                yield index + 1 - length, index + 1, value
+
+
+def _normalize_name(name):
+    return " ".join(re.sub(r"[^a-z0-9+\-/ ]", " ", name.lower()).split())
+
+
+def _bigrams(word):
+    return {word[i:i + 2] for i in range(len(word) - 1)}
+
+
+def _build_lexicon():
+    patterns = {}
+    for canonical, aliases in DRUGS.items():
+        for spelling in [canonical] + aliases:
+            patterns[_normalize_name(spelling)] = canonical
+    by_length = {}
+    for spelling, canonical in patterns.items():
+        if " " not in spelling and len(spelling) >= FUZZY_MIN_LENGTH:
+            by_length.setdefault(len(spelling), []).append((spelling, canonical, _bigrams(spelling)))
+    return Automaton(patterns), by_length
+
+
+_automaton, _fuzzy_index = _build_lexicon()
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 once it is known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        best = i
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            best = min(best, current[j])
+        if best > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+@lru_cache(maxsize=4096)
+def fuzzy_lookup(word):
+    """Closest lexicon spelling for an OCR-damaged word -> (canonical, confidence) or None."""
+    word = word.lower().translate(OCR_LETTER_FIXES)
+    limit = 1 if len(word) < 8 else 2
+    bigrams = _bigrams(word)
+    best = None
+    for length in range(len(word) - limit, len(word) + limit + 1):
+        # Each edit destroys at most two bigrams, so far-off spellings are skipped
+        # before the quadratic distance computation (q-gram filter)
+        needed = max(length, len(word)) - 1 - 2 * limit
+        for spelling, canonical, spelling_bigrams in _fuzzy_index.get(length, ()):
+            if len(bigrams & spelling_bigrams) < needed:
+                continue
+            distance = edit_distance(word, spelling, limit)
+            if distance == 0:
+                return canonical, 0.95  # only the OCR character fixes were needed
+            if distance <= limit and (best is None or distance < best[0]):
+                best = (distance, canonical, len(spelling))
+    if best is None:
+        return None
+    distance, canonical, length = best
+    return canonical, round(max(0.0, 1.0 - distance / length - 0.1), 2)
+
+
+class Medication:
+    FIELDS = ("name", "form", "strength", "frequency", "route", "duration", "instructions")
+
+    def __init__(self, name, matched, start, end, name_confidence):
+        self.name = name
+        self.matched = matched  # the text as written
+        self.start = start
+        self.end = end
+        self.form = None
+        self.strength = None
+        self.frequency = None
+        self.route = None
+        self.duration = None
+        self.instructions = None
+        self.confidence = {"name": name_confidence}
+
+    def score(self):
+        # Name, strength and frequency are what a reader needs; the rest are optional
+        return min(self.confidence.get(field, 0.0) for field in ("name", "strength", "frequency"))
+
+    def to_dict(self):
+        record = {field: getattr(self, field) for field in self.FIELDS}
+        record["matched"] = self.matched
+        record["confidence"] = dict(self.confidence, overall=round(self.score(), 2))
+        return record
+
+    def describe(self):
+        parts = [self.name if self.matched.lower() == self.name.lower() else f"{self.name} ({self.matched})"]
+        if self.strength:
+            parts.append(self.strength)
+        if self.form:
+            parts.append(self.form)
+        details = [value for value in (self.frequency, self.instructions) if value]
+        if self.route:
+            details.append(f"{self.route} route")
+        if self.duration:
+            details.append(f"for {self.duration}")
+        return " ".join(parts) + (": " + ", ".join(details) if details else "")
+
+
+class Extraction:
+    def __init__(self, medications, unresolved):
+        self.medications = medications
+        self.unresolved = unresolved  # text that looks like a medication line but was not understood
+
+    @property
+    def confidence(self):
+        if not self.medications or self.unresolved:
+            return 0.0
+        return min(medication.score() for medication in self.medications)
+
+    def is_confident(self, threshold=CONFIDENCE_THRESHOLD):
+        return self.confidence >= threshold
+
+    def reason(self, threshold=CONFIDENCE_THRESHOLD):
+        # Why the LLM is needed (a short metrics label), or None
+        if not self.medications:
+            return "no_medications"
+        if self.unresolved:
+            return "unresolved_text"
+        if self.confidence < threshold:
+            return "low_confidence"
+        return None
+
+    def to_dict(self):
+        return {"medications": [m.to_dict() for m in self.medications], "unresolved": self.unresolved,
+                "confidence": round(self.confidence, 2)}
+
+
+def _is_boundary(text, index):
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+def _find_names(text):
+    # Exact lexicon hits, leftmost-longest and on word boundaries
+    lowered = text.lower()
+    hits = [(start, end, canonical) for start, end, canonical in _automaton.find(lowered)
+            if _is_boundary(lowered, start - 1) and _is_boundary(lowered, end)]
+    hits.sort(key=lambda hit: (hit[0], -(hit[1] - hit[0])))
+    names, covered = [], -1
+    for start, end, canonical in hits:
+        if start >= covered:
+            names.append(Medication(canonical, text[start:end], start, end, 1.0))
+            covered = end
+    return names
+
+
+def _form_before(text, start):
+    # "Tab", "Cap.", "Syp" etc. directly before the drug name -> (form, where the form word starts)
+    window_start = max(0, start - 12)
+    match = re.search(r"([A-Za-z]+)\.?\s*$", text[window_start:start])
+    if match and match.group(1).lower() in FORMS:
+        return FORMS[match.group(1).lower()], window_start + match.start()
+    return None, start
+
+
+def _strength_after(text, end):
+    # A strength right after `end` on the same line ("Xxxx 10mg", "Xxxx 5 mg")
+    return STRENGTH_RE.match(text, re.compile(r"[ \t]*").match(text, end).end())
+
+
+def _find_fuzzy_names(text, names):
+    # Unknown words in a drug position ("Tab Xxxx", "Xxxx 500mg") are tried against
+    # the lexicon -> (fuzzy matches, [(start, unresolved text)])
+    taken = [(m.start, m.end) for m in names]
+    found, unresolved = [], []
+    for match in re.finditer(r"(?<![\w-])([A-Za-z][A-Za-z0-9|$]{3,}(?:-[A-Za-z0-9]+)?)", text):
+        start, end = match.span(1)
+        if any(s <= start < e for s, e in taken):
+            continue
+        word = match.group(1)
+        if word.lower() in FORMS or word.lower() in FREQUENCY_CODES or word.lower() in ROUTES:
+            continue
+        after_form = _form_before(text, start)[0] is not None
+        with_strength = _strength_after(text, end) is not None
+        if not after_form and not with_strength and not re.match(r"\s+\d", text[end:end + 3]):
+            continue
+        hit = fuzzy_lookup(word)
+        if hit:
+            found.append(Medication(hit[0], word, start, end, hit[1]))
+        elif after_form or with_strength:
+            # Looks like a drug we don't know; its line needs the LLM
+            unresolved.append((start, text[start:].split("\n", 1)[0][:40].strip()))
+    return found, unresolved
+
+
+def _fill_fields(medication, segment):
+    strength = STRENGTH_RE.search(segment)
+    if strength:
+        amount, unit = strength.group(1), strength.group(2).lower()
+        fixed = re.sub(r"[Oo]", "0", amount)
+        unit = {"gm": "g", "µg": "mcg", "unit": "units"}.get(unit, unit)
+        medication.strength = f"{fixed.replace(' ', '')} {unit}"
+        medication.confidence["strength"] = 1.0 if fixed == amount else 0.8
+
+    frequencies = []
+    slots = SLOTS_RE.search(segment)
+    if slots:
+        counts = [c for c in slots.groups() if c is not None]
+        names = DOSE_SLOTS_4 if len(counts) == 4 else DOSE_SLOTS
+        taken = [f"{count.replace(',', '.')} {slot}" if count not in ("1",) else slot
+                 for count, slot in zip(counts, names) if count not in ("0",)]
+        if taken:
+            frequencies.append(f"{' and '.join(taken)} ({'-'.join(counts)})")
+            medication.confidence["frequency"] = 1.0
+    for code in FREQUENCY_CODE_RE.finditer(segment):
+        key = code.group(1).lower()
+        if key in ("ac", "pc"):
+            medication.instructions = medication.instructions or FREQUENCY_CODES[key]
+            continue
+        frequencies.append(f"{FREQUENCY_CODES[key]} ({code.group(1).upper()})")
+        medication.confidence["frequency"] = 1.0
+    words = FREQUENCY_WORD_RE.search(segment)
+    if words:
+        frequencies.append(FREQUENCY_WORDS[words.group(1).lower()])
+        medication.confidence["frequency"] = 1.0
+    interval = INTERVAL_RE.search(segment)
+    if interval:
+        frequencies.append(f"every {interval.group(1) or interval.group(2)} hours")
+        medication.confidence["frequency"] = 1.0
+    if frequencies:
+        medication.frequency = ", ".join(dict.fromkeys(frequencies))
+
+    route = ROUTE_RE.search(segment)
+    if route:
+        medication.route = ROUTES[route.group(1).lower()]
+        medication.confidence["route"] = 0.9
+    elif medication.form in FORM_ROUTES:
+        medication.route = FORM_ROUTES[medication.form]
+        medication.confidence["route"] = 0.7
+
+    duration = DURATION_RE.search(segment)
+    if duration:
+        count, unit = int(duration.group(1)), DURATION_UNITS[duration.group(2).lower()]
+        medication.duration = f"{count} {unit}{'s' if count != 1 else ''}"
+        medication.confidence["duration"] = 1.0
+    else:
+        slash = DURATION_SLASH_RE.search(segment)
+        if slash:
+            count, unit = int(slash.group(1)), SLASH_UNITS[slash.group(2)]
+            medication.duration = f"{count} {unit}{'s' if count != 1 else ''}"
+            medication.confidence["duration"] = 0.8
+
+    meal = MEAL_RE.search(segment)
+    if meal:
+        medication.instructions = meal.group(0).lower()
+        medication.confidence["instructions"] = 1.0
+
+
+def _leftover_words(segment):
+    # Words in a drug's segment that no grammar accounts for (e.g. "until review")
+    for pattern in (STRENGTH_RE, SLOTS_RE, FREQUENCY_WORD_RE, INTERVAL_RE, DURATION_RE, DURATION_SLASH_RE, MEAL_RE,
+                    FREQUENCY_CODE_RE, ROUTE_RE):
+        segment = pattern.sub(" ", segment)
+    return [word for word in re.findall(r"[a-z]+", segment.lower())
+            if word not in FILLER_WORDS and word not in FORMS]
+
+
+def _has_dosing(segment):
+    return bool(STRENGTH_RE.search(segment) or SLOTS_RE.search(segment) or FREQUENCY_CODE_RE.search(segment)
+                or FREQUENCY_WORD_RE.search(segment) or INTERVAL_RE.search(segment) or DURATION_RE.search(segment))
+
+
+def extract(text):
+    """Extract medication records from prescription text (typically OCR output)."""
+    text = text or ""
+    names = _find_names(text)
+    fuzzy, unknown = _find_fuzzy_names(text, names)
+    medications = sorted(names + fuzzy, key=lambda m: m.start)
+    unresolved = [snippet for _start, snippet in unknown]
+
+    def segment_end(position):
+        line_end = text.find("\n", position)
+        return min([line_end if line_end >= 0 else len(text)] + [b for b in boundaries if b > position])
+
+    # Each drug owns the text up to the next drug (or its form word), an unknown
+    # drug or the end of its line, whichever comes first
+    starts = []
+    for medication in medications:
+        medication.form, form_start = _form_before(text, medication.start)
+        if medication.form:
+            medication.confidence["form"] = 1.0
+        starts.append(form_start)
+    boundaries = sorted(starts + [start for start, _snippet in unknown])
+    owned = [(start, segment_end(start)) for start, _snippet in unknown]
+    for medication, form_start in zip(medications, starts):
+        stop = segment_end(medication.end)
+        segment = text[medication.end:stop]
+        _fill_fields(medication, segment)
+        owned.append((form_start, stop))
+        if _leftover_words(segment) and not QUALIFIER_RE.search(segment):
+            unresolved.append(f"{medication.matched}{segment}".strip()[:40])
+        if medication.name in NEEDS_QUALIFIER:
+            medication.confidence["name"] = min(medication.confidence["name"], 0.5)
+
+    # Dosing text outside every drug's segment belongs to something we did not recognize
+    position = 0
+    for start, stop in sorted(owned) + [(len(text), len(text))]:
+        for line in text[position:start].splitlines():
+            if _has_dosing(line):
+                unresolved.append(line.strip()[-40:])
+        position = max(position, stop)
+
+    # Stopped, held or conditional drugs, and limits such as "max 3 per day"
+    for line in text.splitlines():
+        if QUALIFIER_RE.search(line):
+            unresolved.append(line.strip()[:40])
+    return Extraction(medications, unresolved)
+
+
+def format_medications(medications):
+    lines = ["Medications found in the prescription:"]
+    for number, medication in enumerate(medications, 1):
+        lines.append(f"{number}. {medication.describe()}")
+    return "\n".join(lines)
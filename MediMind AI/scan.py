@@ -0,0 +1,217 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import llm
+import metrics
+from chatlog import DEFAULT_SESSION
+from config import get_config
+from llm_client import LLMError
+from retrieval import terms
+from singleflight import request_key
+
+# Scan analysis over several images and/or tiles of one large image.
+#
+# Each selected image is one view of a study (e.g. PA and lateral chest X-ray).
+# Every view is analyzed whole, and when it is much larger than the vision model's
+# input, also as overlapping full-resolution tiles (ingest.prepare_tiles). The
+# regions are sent as parallel vision requests, at most ScanConcurrency at a time,
+# so a multi-view study takes about as long as its slowest single request. Each
+# region is asked for one finding per bullet; the merge step groups bullets that
+# say the same thing (term overlap) across tiles and views into one report, noting
+# where each finding was seen. Progress is reported as regions complete.
+
+REGION_MAX_TOKENS = 768
+# Findings whose term sets overlap this much are treated as the same finding
+SAME_FINDING = 0.5
+
+REGION_PROMPT = (
+    "Analyze this medical image. List the visible anatomical structures and every abnormality or notable "
+    "finding as short bullet points starting with '- ', one finding per line. Then write one line starting "
+    "with 'Impression:' with the most likely conditions and next diagnostic steps. If the image looks normal, "
+    "say so in one bullet."
+)
+
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.*)")
+_IMPRESSION_RE = re.compile(r"^\s*\**\s*impression\s*\**\s*:\s*\**\s*(.*)", re.IGNORECASE)
+
+
+class Region:
+    def __init__(self, label, view, image, tile=None):
+        self.label = label  # e.g. "chest-pa.png", "chest-pa.png, upper left" or "upper left"
+        self.view = view    # index of the selected file
+        self.image = image  # ingest.PreparedImage
+        self.tile = tile    # tile position, or None for the whole image
+        self.result = None
+        self.error = None
+        self.cached = False
+
+
+def prepare_regions(paths, tiling=True):
+    """-> [Region], the whole image of each path first, then its tiles."""
+    from ingest import prepare_image, prepare_tiles
+
+    def prepare(view, path):
+        # Labels name the file only when there are several
+        name = os.path.basename(path) if len(paths) > 1 else ""
+        regions = [Region(name or "whole image", view, prepare_image(path))]
+        if tiling:
+            regions += [Region(f"{name}, {label}" if name else label, view, tile, label)
+                        for label, tile in prepare_tiles(path)]
+        return regions
+
+    # PIL releases the GIL while decoding and resizing
+    with metrics.span("image_prepare", images=len(paths)):
+        with ThreadPoolExecutor(max_workers=min(4, len(paths)) or 1) as pool:
+            prepared = list(pool.map(prepare, range(len(paths)), paths))
+    return [region for regions in prepared for region in regions]
+
+
+def region_messages(region, views, tiled, context_text):
+    if region.tile:
+        where = (f"This is the {region.tile} part (overlapping its neighbours) of a larger scan, shown at full "
+                 f"resolution. Describe only what is visible in this part. ")
+    elif views > 1:
+        where = f"This is view {region.view + 1} of {views} of the same study. "
+    elif tiled:
+        where = "This is the whole scan at reduced resolution; its parts are examined separately in detail. "
+    else:
+        where = ""
+    return [
+        {"role": "user", "content": [
+            {"type": "text", "text": f"{context_text}{where}{REGION_PROMPT}"},
+            {"type": "image_url", "image_url": {"url": region.image.data_url()}}
+        ]}
+    ]
+
+
+def analyze_region(region, messages, cancel, store, session_id=DEFAULT_SESSION):
+    from jobs import VISION_MODEL
+    previous = store.find(region.image, VISION_MODEL, session_id)
+    if previous:
+        region.result = previous
+        region.cached = True
+        return region
+    params = dict(max_tokens=REGION_MAX_TOKENS, stream=False)
+    with metrics.span("scan_region", tile=region.tile is not None):
+        model, completion = llm.GetClient().complete(
+            VISION_MODEL, messages, cancel=cancel, session=session_id,
+            coalesce_key=request_key(VISION_MODEL, messages, **params), **params
+        )
+    region.result = (completion.choices[0].message.content or "").replace("</s>", "").strip()
+    # Only analyses from the primary vision model are reused later
+    if region.result and model == VISION_MODEL:
+        store.save(region.image, VISION_MODEL, region.result, session_id)
+    return region
+
+
+def analyze_scan(paths, on_progress=None, cancel=None, session_id=DEFAULT_SESSION, tiling=None, max_workers=None):
+    """Analyze the images in `paths` as one study; returns the merged report, or
+    None if cancelled. Raises LLMError if no region could be analyzed."""
+    from ingest import get_analysis_store
+    from jobs import IMAGE_CONTEXT_TOKENS, IMAGE_RECALL_QUERY
+    config = get_config()
+    tiling = config.ScanTiling if tiling is None else tiling
+    max_workers = max_workers or config.ScanConcurrency
+    emit = on_progress or (lambda text: None)
+    started = time.perf_counter()
+
+    regions = prepare_regions(paths, tiling)
+    if cancel is not None and cancel.is_set():
+        return None
+    views = len(paths)
+    tiles = sum(1 for region in regions if region.tile)
+    emit(f"Analyzing {_count(views, 'image')}" + (f" and {_count(tiles, 'tile')}" if tiles else "") + "...\n")
+    context_text = llm.ContextText(IMAGE_CONTEXT_TOKENS, session_id, query=IMAGE_RECALL_QUERY)
+    if context_text:
+        context_text = f"Based on our previous conversation:\n{context_text}\n"
+
+    store = get_analysis_store()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(regions)), thread_name_prefix="medimind-scan") as pool:
+        futures = {pool.submit(analyze_region, region, region_messages(region, views, bool(tiles), context_text),
+                               cancel, store, session_id): region for region in regions}
+        for done, future in enumerate(as_completed(futures), 1):
+            region = futures[future]
+            try:
+                future.result()
+            except LLMError as e:
+                region.error = e
+            if cancel is not None and cancel.is_set():
+                for pending in futures:
+                    pending.cancel()
+                return None
+            status = f"failed ({region.error})" if region.error else "done" + (" (earlier analysis)" if region.cached else "")
+            emit(f"[{done}/{len(regions)}] {region.label}: {status}\n")
+
+    analyzed = [region for region in regions if region.result]
+    metrics.inc("scan_regions_total", len(regions), tiled=bool(tiles))
+    metrics.observe("scan_seconds", time.perf_counter() - started, regions=len(regions))
+    if not analyzed:
+        raise next(region.error for region in regions if region.error)
+    return merge_findings(regions, views)
+
+
+def _count(n, noun):
+    return f"{n} {noun}{'s' if n != 1 else ''}"
+
+
+def _split_findings(text):
+    # -> (findings, impressions); text without bullets falls back to one finding per sentence
+    findings, impressions = [], []
+    for line in text.splitlines():
+        impression = _IMPRESSION_RE.match(line)
+        bullet = _BULLET_RE.match(line)
+        if impression:
+            impressions.append(impression.group(1).strip(" *"))
+        elif bullet:
+            findings.append(bullet.group(1).strip(" *"))
+    if not findings and not impressions:
+        findings = [sentence for sentence in re.split(r"(?<=[.!?])\s+", " ".join(text.split())) if sentence]
+    return [f for f in findings if f], [i for i in impressions if i]
+
+
+def _group(items):
+    # items: [(text, label)] -> [[text, [labels], term set]] with near-duplicates merged
+    groups = []
+    for text, label in items:
+        words = set(terms(text))
+        for group in groups:
+            union = words | group[2]
+            if union and len(words & group[2]) / len(union) >= SAME_FINDING:
+                if label not in group[1]:
+                    group[1].append(label)
+                if len(text) > len(group[0]):
+                    group[0] = text
+                group[2] = union
+                break
+        else:
+            groups.append([text, [label], words])
+    return groups
+
+
+def merge_findings(regions, views):
+    """One report from the per-region analyses, with duplicate findings merged."""
+    findings, impressions, failed = [], [], []
+    for region in regions:
+        if region.error:
+            failed.append(f"{region.label}: {region.error}")
+            continue
+        region_findings, region_impressions = _split_findings(region.result)
+        findings += [(text, region.label) for text in region_findings]
+        impressions += [(text, region.label) for text in region_impressions]
+
+    analyzed = sum(1 for region in regions if region.result)
+    lines = [f"Combined analysis of {_count(views, 'image')} ({_count(analyzed, 'region')} analyzed):", "", "Findings:"]
+    for text, labels, _terms in _group(findings):
+        if analyzed == 1:
+            lines.append(f"- {text}")
+        else:
+            lines.append(f"- {text} [{'all regions' if len(labels) == analyzed else '; '.join(labels)}]")
+    grouped_impressions = _group(impressions)
+    if grouped_impressions:
+        lines += ["", "Impression:"]
+        lines += [f"- {text}" for text, _labels, _terms in grouped_impressions]
+    if failed:
+        lines += ["", "Not analyzed:"] + [f"- {item}" for item in failed]
+    return "\n".join(lines)
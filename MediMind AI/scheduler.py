@@ -0,0 +1,328 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+# Central admission control for every request made with the shared Groq API key.
+#
+# Both ResilientClient and AsyncResilientClient ask the scheduler before each
+# upstream attempt (retries and fallback models included). Per model, two token
+# buckets hold the provider's requests/min and tokens/min limits. A request is
+# charged its estimated prompt tokens plus max_tokens up front, and the unused
+# part is given back once the API reports the real usage. A 429 pauses the model
+# for everyone, not just the caller that got it.
+#
+# Waiting requests are admitted by priority class (interactive before batch), and
+# round-robin across sessions within a class, so one session's burst of uploads
+# cannot starve another's chat. A request that has to wait for its model's bucket
+# holds back lower-priority requests for that model only; requests for other
+# models still go ahead.
+#
+# The priority is taken from the calling context:
+#
+#     with scheduler.priority(scheduler.BATCH):
+#         parse_prescription(text)
+#
+# Metrics: scheduler_wait_seconds{priority, model}, scheduler_requests_total
+# {priority, model}, scheduler_paused_total{model} and the gauge
+# scheduler_queue_depth{priority}.
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Provider limits per model as (requests/min, tokens/min); override with RateLimits
+DEFAULT_LIMITS = {
+    "llama3-70b-8192": (30, 6000),
+    "llama3-8b-8192": (30, 30000),
+    "llama-3.2-90b-vision-preview": (15, 7000),
+    "llama-3.2-11b-vision-preview": (30, 7000),
+}
+# Rough number of prompt tokens an image costs
+IMAGE_TOKENS = 1600
+
+_priority = contextvars.ContextVar("medimind_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """Run the enclosed block's LLM requests at `level` (INTERACTIVE or BATCH)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Prompt estimate plus the completion reservation, as the provider counts them."""
+    from context import estimate_tokens as text_tokens, MESSAGE_OVERHEAD
+    total = max_tokens or 1024
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            total += text_tokens(content) + MESSAGE_OVERHEAD
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                total += text_tokens(part["text"])
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKENS
+        total += MESSAGE_OVERHEAD
+    return total
+
+
+def parse_limits(text):
+    # "model=rpm/tpm, model2=rpm/tpm" -> {model: (rpm, tpm)}
+    limits = {}
+    for item in (text or "").split(","):
+        if "=" in item:
+            model, values = item.split("=", 1)
+            rpm, _, tpm = values.partition("/")
+            limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+class Bucket:
+    """Token bucket refilled at `per_minute`; 0 means unlimited. The level may go
+    negative when a request turns out to cost more than it was charged."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount, now):
+        # Seconds until `amount` is available (a request larger than the whole bucket waits for a full one)
+        if self.rate <= 0:
+            return 0.0
+        self.refill(now)
+        needed = min(amount, self.capacity) - self.level
+        return needed / self.rate if needed > 0 else 0.0
+
+    def take(self, amount):
+        if self.rate > 0:
+            self.level -= amount
+
+    def give(self, amount):
+        if self.rate > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class ModelLimit:
+    def __init__(self, rpm, tpm):
+        self.requests = Bucket(rpm)
+        self.tokens = Bucket(tpm)
+        self.paused_until = 0.0
+
+    def wait(self, tokens, now):
+        return max(self.paused_until - now, self.requests.wait(1, now), self.tokens.wait(tokens, now))
+
+    def take(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+
+class Ticket:
+    """One admitted (or waiting) request; settle() it with the real token usage."""
+
+    def __init__(self, model, tokens, level, session):
+        self.model = model
+        self.tokens = tokens
+        self.priority = level
+        self.session = session
+        self.granted = False
+        self.settled = False
+        self.queued_at = time.monotonic()
+        self.wake = None
+
+
+class Scheduler:
+    def __init__(self, limits=None, default_rpm=30, default_tpm=6000):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.models = {}
+        self.queues = {}  # priority -> {session: deque of tickets}
+        self.order = {}   # priority -> deque of sessions with waiting tickets (round robin)
+        self.stats = {"admitted": 0, "waited": 0, "paused": 0}
+        self._lock = threading.Lock()
+
+    def limit(self, model):
+        if model not in self.models:
+            rpm, tpm = self.limits.get(model, (self.default_rpm, self.default_tpm))
+            self.models[model] = ModelLimit(rpm, tpm)
+        return self.models[model]
+
+    def _enqueue(self, ticket):
+        sessions = self.queues.setdefault(ticket.priority, {})
+        if ticket.session not in sessions:
+            sessions[ticket.session] = deque()
+            self.order.setdefault(ticket.priority, deque()).append(ticket.session)
+        sessions[ticket.session].append(ticket)
+
+    def _remove(self, ticket):
+        queue = self.queues.get(ticket.priority, {}).get(ticket.session)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.priority][ticket.session]
+                self.order[ticket.priority].remove(ticket.session)
+
+    def _dispatch(self):
+        # Admit every head-of-line ticket that fits; -> seconds until the next one might
+        now = time.monotonic()
+        blocked = set()  # models a higher-priority or earlier ticket is waiting for
+        next_wait = None
+        for level in sorted(self.order):
+            sessions = self.order[level]
+            passes = len(sessions)
+            while passes > 0 and sessions:
+                passes -= 1
+                session = sessions[0]
+                queue = self.queues[level][session]
+                ticket = queue[0]
+                if ticket.model in blocked:
+                    sessions.rotate(-1)
+                    continue
+                limit = self.limit(ticket.model)
+                wait = limit.wait(ticket.tokens, now)
+                if wait > 0:
+                    blocked.add(ticket.model)
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    sessions.rotate(-1)
+                    continue
+                limit.take(ticket.tokens)
+                queue.popleft()
+                ticket.granted = True
+                ticket.wake()
+                if queue:
+                    # The session goes to the back of the line; its next ticket gets another pass
+                    sessions.rotate(-1)
+                    passes += 1
+                else:
+                    sessions.popleft()
+                    del self.queues[level][session]
+        for level, name in PRIORITY_NAMES.items():
+            depth = sum(len(queue) for queue in self.queues.get(level, {}).values())
+            metrics.gauge("scheduler_queue_depth", depth, priority=name)
+        return next_wait
+
+    def _admitted(self, ticket):
+        waited = time.monotonic() - ticket.queued_at
+        labels = dict(priority=PRIORITY_NAMES.get(ticket.priority, str(ticket.priority)), model=ticket.model)
+        self.stats["admitted"] += 1
+        if waited > 0.001:
+            self.stats["waited"] += 1
+        metrics.inc("scheduler_requests_total", **labels)
+        metrics.observe("scheduler_wait_seconds", waited, **labels)
+        return ticket
+
+    def acquire(self, model, tokens, session=None, cancel=None):
+        """Block until a request to `model` costing `tokens` may be sent; -> Ticket,
+        or None if `cancel` (a threading.Event) was set while waiting."""
+        event = threading.Event()
+        ticket = Ticket(model, tokens, current_priority(), session)
+        ticket.wake = event.set
+        with self._lock:
+            self._enqueue(ticket)
+            wait = self._dispatch()
+        while not ticket.granted:
+            # Waiters re-run the dispatch when the bucket they wait on should have refilled
+            event.wait(min(max(wait or 1.0, 0.01), 1.0))
+            with self._lock:
+                if cancel is not None and cancel.is_set() and not ticket.granted:
+                    self._remove(ticket)
+                    self._dispatch()
+                    return None
+                wait = self._dispatch()
+        return self._admitted(ticket)
+
+    async def acquire_async(self, model, tokens, session=None):
+        """acquire() for asyncio callers; cancelling the task leaves the queue."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket = Ticket(model, tokens, current_priority(), session)
+        # Another thread's dispatch may admit this ticket
+        ticket.wake = lambda: loop.call_soon_threadsafe(event.set)
+        with self._lock:
+            self._enqueue(ticket)
+            wait = self._dispatch()
+        try:
+            while not ticket.granted:
+                try:
+                    await asyncio.wait_for(event.wait(), min(max(wait or 1.0, 0.01), 1.0))
+                except asyncio.TimeoutError:
+                    pass
+                with self._lock:
+                    wait = self._dispatch()
+        except BaseException:
+            with self._lock:
+                if ticket.granted:
+                    self._release(ticket)
+                else:
+                    self._remove(ticket)
+                self._dispatch()
+            raise
+        return self._admitted(ticket)
+
+    def _release(self, ticket):
+        # Give back a whole admission that was never used
+        limit = self.limit(ticket.model)
+        limit.requests.give(1)
+        limit.tokens.give(ticket.tokens)
+        ticket.settled = True
+
+    def settle(self, ticket, used_tokens):
+        """Correct the charge of an admitted request to what the API reported."""
+        if ticket is None or ticket.settled or used_tokens is None:
+            return
+        with self._lock:
+            ticket.settled = True
+            bucket = self.limit(ticket.model).tokens
+            if used_tokens < ticket.tokens:
+                bucket.give(ticket.tokens - used_tokens)
+            else:
+                bucket.take(used_tokens - ticket.tokens)
+            self._dispatch()
+
+    def pause(self, model, seconds):
+        """Hold all requests to `model` for `seconds`, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            limit = self.limit(model)
+            limit.paused_until = max(limit.paused_until, time.monotonic() + seconds)
+            self.stats["paused"] += 1
+        metrics.inc("scheduler_paused_total", model=model)
+
+    def snapshot(self):
+        """Queue depths and bucket levels, for /health."""
+        with self._lock:
+            now = time.monotonic()
+            queued = {PRIORITY_NAMES.get(level, str(level)): sum(len(queue) for queue in sessions.values())
+                      for level, sessions in self.queues.items()}
+            models = {}
+            for model, limit in self.models.items():
+                limit.requests.refill(now)
+                limit.tokens.refill(now)
+                models[model] = {"requests": round(limit.requests.level, 1), "tokens": round(limit.tokens.level),
+                                 "paused": round(max(0.0, limit.paused_until - now), 1)}
+            return {"queued": queued, "models": models, **self.stats}
+
+
+def from_config(config):
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(parse_limits(config.RateLimits))
+    return Scheduler(limits, config.RateLimitRPM, config.RateLimitTPM)
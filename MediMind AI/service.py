@@ -0,0 +1,455 @@
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import traceback
+import weakref
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+import llm
+import metrics
+from config import get_config
+from chatlog import new_session_id
+from llm_client import LLMError, error_message, stream_error
+from prescription import parse_prescription_async
+from jobs import VISION_MODEL, image_messages
+from singleflight import request_key
+
+# Multi-session HTTP service on asyncio (stdlib only, HTTP/1.1 with keep-alive).
+#
+#   POST /chat            {"message": "..."}                 -> SSE: token events, then done
+#   POST /prescription    {"text": "..."} or an image upload -> JSON
+#   POST /image           an image upload                    -> JSON
+#   POST /sessions                                           -> {"session": "<new id>"}
+#   GET  /sessions/<id>/history?n=50
+#   GET  /health, GET /metrics
+#
+# The session is taken from the X-Session-Id header (or "session" in the JSON
+# body or the query string); a new one is issued when absent and returned in the
+# X-Session-Id response header. Each session has its own context window and chat
+# log entries, and requests within one session run one at a time so their turns
+# don't interleave; different sessions run concurrently. /prescription and /image
+# stream too when the client sends Accept: text/event-stream (/chat always does).
+# Uploads are either a raw body with an image/* Content-Type or multipart/form-data.
+#
+# LLM calls go through one pooled keep-alive AsyncGroq client with at most
+# ServiceConcurrency requests in flight, and identical concurrent requests share
+# one upstream call; the shared scheduler admits them within the API rate limits,
+# taking turns across sessions. OCR and image preparation run on threads.
+
+SESSION_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+    413: "Payload Too Large", 415: "Unsupported Media Type", 500: "Internal Server Error",
+}
+IMAGE_UPLOAD_MESSAGE = "I've uploaded a medical image for analysis."
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers  # lower-case names
+        self.body = body
+        self._json = None
+
+    @property
+    def content_type(self):
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    def json(self):
+        if self._json is None:
+            if self.content_type != "application/json":
+                self._json = {}
+            else:
+                try:
+                    self._json = json.loads(self.body or b"{}")
+                except ValueError:
+                    raise HTTPError(400, "Invalid JSON body")
+                if not isinstance(self._json, dict):
+                    raise HTTPError(400, "Expected a JSON object")
+        return self._json
+
+    def keep_alive(self):
+        return self.headers.get("connection", "").lower() != "close"
+
+    def wants_stream(self):
+        return "text/event-stream" in self.headers.get("accept", "")
+
+    def session_id(self):
+        session_id = self.headers.get("x-session-id") or self.query.get("session") or self.json().get("session")
+        if not session_id:
+            return new_session_id()
+        if not SESSION_RE.match(session_id):
+            raise HTTPError(400, "Invalid session id")
+        return session_id
+
+
+async def read_request(reader, writer, max_body):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None  # connection closed between requests
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "Request headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "Send a Content-Length instead of a chunked body")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > max_body:
+        raise HTTPError(413, f"Body larger than {max_body} bytes")
+    if length and headers.get("expect", "").lower() == "100-continue":
+        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        await writer.drain()
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+
+def response_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'OK')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_body(writer, status, body, content_type, headers=None, keep_alive=True):
+    headers = dict(headers or {})
+    headers.update({"Content-Type": content_type, "Content-Length": str(len(body)),
+                    "Connection": "keep-alive" if keep_alive else "close"})
+    writer.write(response_head(status, headers) + body)
+    await writer.drain()
+
+
+async def send_json(writer, status, payload, headers=None, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send_body(writer, status, body, "application/json", headers, keep_alive)
+
+
+class EventStream:
+    """Server-sent events over a chunked response, so the connection stays reusable."""
+
+    def __init__(self, writer, headers):
+        self.writer = writer
+        self.headers = headers
+
+    async def start(self):
+        headers = dict(self.headers, **{"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                        "Transfer-Encoding": "chunked"})
+        self.writer.write(response_head(200, headers))
+        await self.writer.drain()
+
+    async def send(self, event, data):
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.writer.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        await self.writer.drain()
+
+    async def end(self):
+        self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+
+def read_upload(request):
+    # -> (bytes, file suffix) from a raw image body or the first file of a multipart form
+    if request.content_type.startswith("image/"):
+        if not request.body:
+            raise HTTPError(400, "Empty upload")
+        return request.body, "." + request.content_type.split("/", 1)[1]
+    if request.content_type == "multipart/form-data":
+        from email.parser import BytesParser
+        from email.policy import HTTP
+        header = f"Content-Type: {request.headers['content-type']}\r\n\r\n".encode("latin-1")
+        message = BytesParser(policy=HTTP).parsebytes(header + request.body)
+        for part in message.iter_parts():
+            filename = part.get_filename()
+            if filename:
+                return part.get_payload(decode=True), os.path.splitext(filename)[1] or ".img"
+        raise HTTPError(400, "No file in the form")
+    raise HTTPError(415, "Upload an image (image/* body or multipart/form-data)")
+
+
+def with_upload(data, suffix, fn):
+    # Thread helper: the OCR and imaging pipelines work on files
+    handle, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+        return fn(path)
+    finally:
+        os.remove(path)
+
+
+async def chat(request, session_id, emit):
+    message = request.json().get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPError(400, 'Expected {"message": "..."}')
+    answer = await llm.ChatBotAsync(message, session_id, on_token=emit)
+    return {"answer": answer}
+
+
+async def prescription(request, session_id, emit):
+    result = {}
+    if request.content_type in ("application/json", "text/plain"):
+        text = request.json().get("text") if request.content_type == "application/json" else request.body.decode("utf-8", "replace")
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, 'Expected {"text": "..."} or an image upload')
+    else:
+        from ocr import ocr_image
+        from pytesseract import TesseractNotFoundError
+        data, suffix = read_upload(request)
+        try:
+            ocr = await asyncio.to_thread(with_upload, data, suffix, ocr_image)
+        except TesseractNotFoundError:
+            raise
+        except OSError as e:  # PIL.UnidentifiedImageError, a truncated file, ...
+            raise HTTPError(400, f"Could not read the image: {e}")
+        for stage, seconds in ocr["timings"].items():
+            metrics.observe("ocr_stage_seconds", seconds, stage=stage)
+        metrics.inc("ocr_requests_total", cached=ocr["cached"])
+        text = result["ocr_text"] = ocr["text"] or "No text detected in image."
+    result.update(await parse_prescription_async(text, session_id, on_token=emit))
+    return result
+
+
+async def image(request, session_id, emit):
+    from ingest import prepare_image, get_analysis_store
+    data, suffix = read_upload(request)
+    with metrics.span("image_prepare"):
+        try:
+            prepared = await asyncio.to_thread(with_upload, data, suffix, prepare_image)
+        except OSError as e:
+            raise HTTPError(400, f"Could not read the image: {e}")
+
+    store = get_analysis_store()
+    previous = await asyncio.to_thread(store.find, prepared, VISION_MODEL, session_id)
+    if previous:
+        result = f"(This image matches one analyzed earlier.)\n{previous}"
+        emit(result)
+        await asyncio.to_thread(llm.RecordTurn, IMAGE_UPLOAD_MESSAGE, result, session_id)
+        return {"analysis": result, "reused": True}
+
+    messages = image_messages(prepared, session_id)
+    started = time.perf_counter()
+    parts = []
+    try:
+        model, stream = await llm.GetAsyncClient().complete(
+            VISION_MODEL, messages, coalesce_key=request_key(VISION_MODEL, messages, max_tokens=1024, stream=True),
+            session=session_id, max_tokens=1024, stream=True)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        metrics.observe("llm_ttft_seconds", time.perf_counter() - started, model=model)
+                    parts.append(chunk.choices[0].delta.content)
+                    emit(chunk.choices[0].delta.content)
+        except asyncio.CancelledError:
+            await stream.close()
+            raise
+        except Exception as e:
+            raise stream_error(e, model) from e
+        metrics.observe("llm_stream_seconds", time.perf_counter() - started, model=model)
+    except LLMError as e:
+        metrics.inc("llm_errors_total", kind=e.kind)
+        return {"analysis": error_message(e), "error": e.kind}
+    result = "".join(parts)
+    if result and model == VISION_MODEL:
+        await asyncio.to_thread(store.save, prepared, VISION_MODEL, result, session_id)
+    await asyncio.to_thread(llm.RecordTurn, IMAGE_UPLOAD_MESSAGE, result, session_id)
+    return {"analysis": result, "reused": False, "model": model}
+
+
+HANDLERS = {"/chat": chat, "/prescription": prescription, "/image": image}
+
+
+class Service:
+    def __init__(self, max_body, max_sessions=1000):
+        self.max_body = max_body
+        self.max_sessions = max_sessions
+        self.started = time.time()
+        self.in_flight = 0
+        self.sessions = OrderedDict()  # recently active session ids, least recent first
+        self._session_locks = weakref.WeakValueDictionary()
+
+    def session_lock(self, session_id):
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, writer, self.max_body)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                await self.dispatch(request, writer)
+                if not request.keep_alive():
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request, writer):
+        keep_alive = request.keep_alive()
+        started = time.perf_counter()
+        status = 200
+        try:
+            status = await self.route(request, writer, keep_alive)
+        except HTTPError as e:
+            status = e.status
+            await send_json(writer, e.status, {"error": str(e)}, keep_alive=keep_alive)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            status = 500
+            traceback.print_exc()
+            await send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"}, keep_alive=keep_alive)
+        finally:
+            metrics.observe("http_request_seconds", time.perf_counter() - started,
+                            path=request.path if request.path in HANDLERS else "other", status=status)
+
+    async def route(self, request, writer, keep_alive):
+        if request.method == "GET" and request.path == "/health":
+            client = llm.GetAsyncClient()
+            await send_json(writer, 200, {"status": "ok", "uptime": round(time.time() - self.started, 1),
+                                          "sessions": len(self.sessions), "in_flight": self.in_flight,
+                                          "coalesced": client.flights.stats,
+                                          "scheduler": llm.GetScheduler().snapshot(),
+                                          "hedging": client.hedging.stats if client.hedging else None},
+                            keep_alive=keep_alive)
+        elif request.method == "GET" and request.path == "/metrics":
+            await send_body(writer, 200, metrics.render_prometheus().encode("utf-8"),
+                            "text/plain; version=0.0.4", keep_alive=keep_alive)
+        elif request.method == "POST" and request.path == "/sessions":
+            await send_json(writer, 200, {"session": new_session_id()}, keep_alive=keep_alive)
+        elif request.method == "GET" and request.path.startswith("/sessions/") and request.path.endswith("/history"):
+            session_id = request.path[len("/sessions/"):-len("/history")]
+            if not SESSION_RE.match(session_id):
+                raise HTTPError(400, "Invalid session id")
+            try:
+                n = min(int(request.query.get("n", 50)), 1000)
+            except ValueError:
+                raise HTTPError(400, "n must be a number")
+            messages = await asyncio.to_thread(llm.GetChatLog().tail, n, session_id)
+            await send_json(writer, 200, {"session": session_id, "messages": messages}, keep_alive=keep_alive)
+        elif request.path in HANDLERS:
+            if request.method != "POST":
+                raise HTTPError(405, "Use POST")
+            handler = HANDLERS[request.path]
+            await self.run(handler, request, writer, keep_alive, request.path == "/chat" or request.wants_stream())
+        else:
+            raise HTTPError(404, f"No route for {request.method} {request.path}")
+        return 200
+
+    async def run(self, handler, request, writer, keep_alive, stream):
+        session_id = request.session_id()
+        self.sessions[session_id] = time.time()
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        headers = {"X-Session-Id": session_id}
+        tokens = asyncio.Queue()
+        self.in_flight += 1
+        try:
+            async with self.session_lock(session_id):
+                # A new session's history is read from the chat log off the event loop
+                await asyncio.to_thread(llm.GetContext, session_id)
+                task = asyncio.ensure_future(handler(request, session_id, tokens.put_nowait))
+                if not stream:
+                    result = await task
+                    await send_json(writer, 200, dict(result, session=session_id), headers, keep_alive)
+                    return
+                events = EventStream(writer, dict(headers, Connection="keep-alive" if keep_alive else "close"))
+                try:
+                    await events.start()
+                    await self.pump(task, tokens, events)
+                except (ConnectionError, asyncio.CancelledError):
+                    # The client went away: abandon the upstream request (nothing gets recorded)
+                    task.cancel()
+                    raise
+        finally:
+            self.in_flight -= 1
+
+    async def pump(self, task, tokens, events):
+        # Forward tokens as they arrive, then the final result (or the error) as "done"
+        while True:
+            getter = asyncio.ensure_future(tokens.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                await events.send("token", {"text": getter.result()})
+                continue
+            getter.cancel()
+            break
+        while not tokens.empty():
+            await events.send("token", {"text": tokens.get_nowait()})
+        try:
+            result = task.result()
+        except HTTPError as e:
+            await events.send("error", {"error": str(e), "status": e.status})
+        except Exception as e:
+            traceback.print_exc()
+            await events.send("error", {"error": f"{type(e).__name__}: {e}", "status": 500})
+        else:
+            await events.send("done", result)
+        await events.end()
+
+
+async def serve(host, port, ready=None):
+    config = get_config()
+    service = Service(config.MaxUploadBytes, config.SessionCacheSize)
+    llm.GetAsyncClient()  # bind the connection pool to this event loop
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    address = server.sockets[0].getsockname()
+    print(f"MediMind AI service on http://{address[0]}:{address[1]}")
+    if ready is not None:
+        ready(address)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await llm.GetAsyncClient().close()
+
+
+def main(argv=None):
+    config = get_config()
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Multi-session HTTP service.")
+    parser.add_argument("--host", default=config.ServiceHost)
+    parser.add_argument("--port", type=int, default=config.ServicePort)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import json
+import hashlib
+import threading
+
+import metrics
+
+# Request coalescing ("single flight") for the LLM and vision calls.
+#
+# Concurrent calls with the same request key (model, normalized messages and
+# parameters) share one upstream request. Its chunks are kept on the Flight, so
+# every caller iterates the stream from the start at its own pace, including
+# callers that join after the first tokens arrived. Whoever is behind the
+# newest chunk pulls the next one from upstream; the others wait for it, so no
+# extra thread is needed. The upstream stream is closed when the last caller
+# closes its copy early. Once the response is complete the key is released and
+# the next identical request goes upstream again (the response cache covers reuse
+# after that).
+#
+# Counters: singleflight_requests_total{role="leader"|"join"}.
+
+ABANDONED = "abandoned"
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def request_key(model, messages, **params):
+    """Hash of everything that determines the response (whitespace-insensitive)."""
+    payload = json.dumps({"model": model, "messages": _normalize(messages), "params": params},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One upstream request and the callers sharing it (threads)."""
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+        self.on_item = None   # called once per upstream chunk (or with the whole non-streamed result)
+        self.on_error = None  # called once if the upstream stream fails
+        self.started = threading.Event()
+        self.model = None
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.done = False
+        self.readers = 1
+        self._upstream = None
+        self._reading = False
+        self._cond = threading.Condition()
+
+    def start(self, model, result, streaming):
+        self.model = model
+        self.result = result
+        if streaming:
+            self._upstream = iter(result)
+        else:
+            if self.on_item:
+                self.on_item(result)
+            self._finish()
+        self.started.set()
+
+    def fail(self, error):
+        self.error = error
+        self._finish()
+        self.started.set()
+
+    def _finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+        self.registry.discard(self)
+
+    def join(self):
+        # False if the flight was abandoned and must not be joined any more
+        with self._cond:
+            if self.error is ABANDONED:
+                return False
+            self.readers += 1
+            return True
+
+    def wait(self, cancel=None):
+        # Follower: block until the leader has a response (or failed); returns the model used
+        while not self.started.wait(0.1):
+            if cancel is not None and cancel.is_set():
+                self.detach()
+                return None
+        if self.error is not None:
+            self.detach()
+            raise self.error if self.error is not ABANDONED else RuntimeError("flight abandoned")
+        return self.model
+
+    def chunk(self, index):
+        # The index-th chunk of the stream, pulling it from upstream if nobody else is
+        while True:
+            with self._cond:
+                if index < len(self.chunks):
+                    return self.chunks[index]
+                if self.done:
+                    if self.error is not None and self.error is not ABANDONED:
+                        raise self.error
+                    raise StopIteration
+                if self._reading:
+                    self._cond.wait()
+                    continue
+                self._reading = True
+            try:
+                item = next(self._upstream)
+                if self.on_item:
+                    self.on_item(item)
+            except StopIteration:
+                item = StopIteration
+            except Exception as e:
+                self.error = e
+                item = StopIteration
+                if self.on_error:
+                    self.on_error()
+            with self._cond:
+                self._reading = False
+                if item is StopIteration:
+                    self.done = True
+                else:
+                    self.chunks.append(item)
+                self._cond.notify_all()
+            if item is StopIteration:
+                self.registry.discard(self)
+
+    def detach(self):
+        with self._cond:
+            self.readers -= 1
+            abandon = self.readers <= 0 and not self.done
+            if abandon:
+                self.done = True
+                self.error = ABANDONED
+                self._cond.notify_all()
+        if abandon:
+            self.registry.discard(self)
+            if self._upstream is not None:
+                self.result.close()
+
+
+class FlightStream:
+    """A caller's view of a shared stream; iterate it like the SDK stream."""
+
+    def __init__(self, flight, joined):
+        self.flight = flight
+        self.joined = joined
+        self.index = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise StopIteration
+        try:
+            chunk = self.flight.chunk(self.index)
+        except Exception:  # including StopIteration at the end
+            self.close()
+            raise
+        self.index += 1
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.flight.detach()
+
+
+class SingleFlight:
+    """Registry of in-flight requests by key."""
+
+    def __init__(self, flight_class=Flight):
+        self.flight_class = flight_class
+        self.stats = {"leaders": 0, "joins": 0}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """-> (flight, is_leader). A key of None always gets a private flight."""
+        with self._lock:
+            flight = self._flights.get(key) if key is not None else None
+            if flight is not None and flight.join():
+                self.stats["joins"] += 1
+                metrics.inc("singleflight_requests_total", role="join")
+                return flight, False
+            flight = self.flight_class(self, key)
+            if key is not None:
+                self._flights[key] = flight
+                self.stats["leaders"] += 1
+                metrics.inc("singleflight_requests_total", role="leader")
+            return flight, True
+
+    def discard(self, flight):
+        with self._lock:
+            if flight.key is not None and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class AsyncFlight(Flight):
+    """Flight for asyncio callers; the upstream is an async stream.
+
+    `release` (e.g. a concurrency slot) is called once when the upstream request
+    is over: completed, failed or abandoned.
+    """
+
+    def __init__(self, registry, key):
+        import asyncio
+        super().__init__(registry, key)
+        self.started = asyncio.Event()
+        self.release = None
+        self._cond = asyncio.Condition()
+        self._released = False
+        self._pull = None
+
+    def _release(self):
+        if self.release and not self._released:
+            self._released = True
+            self.release()
+
+    def start(self, model, result, streaming):
+        self.model = model
+        self.result = result
+        if streaming:
+            self._upstream = result.__aiter__()
+        else:
+            if self.on_item:
+                self.on_item(result)
+            self.done = True
+            self._release()
+            self.registry.discard(self)
+        self.started.set()
+
+    def fail(self, error):
+        self.error = error
+        self.done = True
+        self._release()
+        self.registry.discard(self)
+        self.started.set()
+
+    def join(self):
+        # Called with no await in between, so no lock is needed on the event loop
+        if self.error is ABANDONED:
+            return False
+        self.readers += 1
+        return True
+
+    async def wait(self, cancel=None):
+        await self.started.wait()
+        if self.error is not None:
+            await self.detach()
+            raise self.error if self.error is not ABANDONED else RuntimeError("flight abandoned")
+        return self.model
+
+    async def chunk(self, index):
+        import asyncio
+        while True:
+            async with self._cond:
+                if index < len(self.chunks):
+                    return self.chunks[index]
+                if self.done:
+                    if self.error is not None and self.error is not ABANDONED:
+                        raise self.error
+                    raise StopAsyncIteration
+                if self._reading:
+                    await self._cond.wait()
+                    continue
+                self._reading = True
+            try:
+                # Shielded, so a reader that is cancelled mid-read doesn't break the
+                # shared stream; the next reader picks up the same pending read
+                if self._pull is None:
+                    self._pull = asyncio.ensure_future(self._upstream.__anext__())
+                item = await asyncio.shield(self._pull)
+                self._pull = None
+                if self.on_item:
+                    self.on_item(item)
+            except StopAsyncIteration:
+                self._pull = None
+                item = StopAsyncIteration
+            except asyncio.CancelledError:
+                if self._pull is not None and self._pull.cancelled():
+                    self._pull = None
+                async with self._cond:
+                    self._reading = False
+                    self._cond.notify_all()
+                raise
+            except Exception as e:
+                self._pull = None
+                self.error = e
+                item = StopAsyncIteration
+                if self.on_error:
+                    self.on_error()
+            async with self._cond:
+                self._reading = False
+                if item is StopAsyncIteration:
+                    self.done = True
+                else:
+                    self.chunks.append(item)
+                self._cond.notify_all()
+            if item is StopAsyncIteration:
+                self._release()
+                self.registry.discard(self)
+
+    async def detach(self):
+        self.readers -= 1
+        if self.readers <= 0 and not self.done:
+            self.done = True
+            self.error = ABANDONED
+            async with self._cond:
+                self._cond.notify_all()
+            self.registry.discard(self)
+            self._release()
+            if self._pull is not None:
+                self._pull.cancel()
+            if self._upstream is not None:
+                await self.result.close()
+
+
+class AsyncFlightStream(FlightStream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self.flight.chunk(self.index)
+        except BaseException:
+            await self.close()
+            raise
+        self.index += 1
+        return chunk
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await self.flight.detach()
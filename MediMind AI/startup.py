@@ -0,0 +1,35 @@
+import sys
+import time
+
+# Start-up profiler behind the --profile-startup option of main.py and app.py.
+#
+#   startup.mark("import llm")   # records the time since the previous mark
+#   startup.report()             # prints the table to stderr
+#
+# Import this module first so the clock starts before the other imports. Marks
+# are always recorded (a list append); nothing is printed unless asked for.
+
+FLAG = "--profile-startup"
+
+_origin = time.perf_counter()
+_last = _origin
+_marks = []
+
+
+def requested(argv=None):
+    return FLAG in (sys.argv if argv is None else argv)
+
+
+def mark(name):
+    global _last
+    now = time.perf_counter()
+    _marks.append((name, now - _last, now - _origin))
+    _last = now
+
+
+def report(file=None):
+    file = file or sys.stderr
+    print(f"{'Start-up step':34s} {'step ms':>9s} {'total ms':>9s}", file=file)
+    for name, step, total in _marks:
+        print(f"{name:34s} {step * 1000:9.1f} {total * 1000:9.1f}", file=file)
+    print(f"{'modules loaded':34s} {len(sys.modules):>9d}", file=file)
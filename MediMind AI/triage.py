@@ -0,0 +1,135 @@
+import re
+
+import metrics
+
+# Local pre-classifier in front of ChatBot.
+#
+# Greetings, thanks and goodbyes get a templated reply and clearly non-medical
+# questions a canned refusal, without a model call. Everything else goes to the
+# model. That includes anything the classifier is unsure about, e.g. a follow-up
+# like "is that serious?", so it only skips calls when it is confident.
+#
+# The model is a keyword and character n-gram match:
+#   medical signal   - a medical word, or a 4/5-character piece of a medical root
+#                      or suffix ("cardi", "itis", "algia", ...), which also
+#                      catches terms that are not in the word list
+#   health context   - someone describing how they feel, or asking on behalf of
+#                      a baby, a patient or someone with a condition
+#   off-topic signal - a word or phrase from clearly unrelated domains
+# A query is off-topic only with an off-topic signal and neither a medical
+# signal nor health context; cooking, recipes and "how to make" questions are
+# never refused on their own, since many are about diets, ORS or first aid. It
+# builds a few small sets at import and classifies in microseconds.
+#
+# Counter: chat_route_total{route="medical"|"greeting"|"offtopic"}; the share of
+# non-medical routes is the share of model calls avoided.
+
+MEDICAL = "medical"
+GREETING = "greeting"
+OFFTOPIC = "offtopic"
+
+MEDICAL_WORDS = frozenset("""
+ache aches aching acne allergy allergies allergic anxiety appetite asthma back bite bleeding blister blood bp
+breath breathing bruise burn cancer chest chills cold constipation cough cramps cut cyst depressed depression
+diabetes diabetic diagnosis diarrhea diarrhoea dizziness dizzy doctor dose dosage drug drugs ear ears eye eyes
+faint fatigue fever flu fracture headache health heart hospital hurt hurts ill illness infection infected injury
+insomnia itch itching itchy lump medicine medicines medication medications medical migraine mg ml mri nausea
+nauseous numb numbness nurse ointment pain painful patient period pill pills pregnant pregnancy prescription
+pulse rash scan sick sickness sinus skin sleep sneezing sore sprain stomach stool stress surgery swelling
+swollen symptom symptoms syrup tablet tablets temperature therapy throat tired tooth toothache treatment
+ulcer urine vaccine vomit vomiting weak weakness wound xray x-ray injection inhaler bandage clinic
+head neck shoulder arm arms elbow wrist hand hands finger fingers hip leg legs knee knees ankle foot feet toe
+toes spine joint joints muscle muscles bone bones lung lungs liver kidney kidneys bladder brain belly abdomen
+mouth nose tongue teeth gum gums lip lips face
+accident fall fell fainted swallowed swallow choking choke poison poisoned overdose unconscious seizure
+emergency ambulance bleed bleeds bled sting stung bites bitten
+anxious panic nervous jaundice splint ors rehydration dehydration dehydrated diabetics formula infant newborn
+diet nutrition vitamin vitamins allergen calories first-aid cpr
+""".split())
+
+# Roots and suffixes of medical vocabulary; matched as character n-grams
+MEDICAL_ROOTS = (
+    "itis", "algia", "emia", "aemia", "ectomy", "otomy", "oscopy", "osis", "pathy", "plasia", "trophy", "uria",
+    "cardi", "derma", "neuro", "gastr", "hepat", "nephr", "pulmo", "pneum", "arthr", "osteo", "ophth", "oncol",
+    "onco", "hemat", "haemat", "thyro", "endocr", "immun", "psych", "pedia", "paedia", "gyne", "obstet", "uro",
+    "cortis", "cillin", "mycin", "statin", "prazole", "olol", "sartan", "pril", "fen", "amol", "azole",
+)
+
+OFFTOPIC_WORDS = frozenset("""
+weather football cricket soccer basketball tennis movie movies film song songs music lyrics netflix
+celebrity actor actress stock stocks crypto bitcoin ethereum investment trading forex
+politics election president minister government programming python javascript java coding compile
+laptop iphone android wifi gaming minecraft homework essay poem joke jokes riddle geography maths
+equation translate translation horoscope astrology zodiac fashion shopping
+""".split())
+
+OFFTOPIC_RE = re.compile(
+    r"\b(who (won|is the (president|prime minister|ceo))|capital of|write (me )?(a|an) (poem|story|essay|song)"
+    r"|tell (me )?a joke|what time is it|best (movie|phone|laptop|game))\b"
+)
+
+HEALTH_CONTEXT_RE = re.compile(
+    r"\b(i|we|he|she|they) (feel|felt|am feeling|are feeling|is feeling|keep feeling)\b"
+    r"|\b(for|with) (a |an |my |our |the )?(baby|babies|child|children|kid|kids|toddler|elderly|patient|someone"
+    r"|person|people)\b"
+)
+
+GREETING_RE = re.compile(
+    r"^(hi+|hello+|hey+|hiya|howdy|namaste|yo|greetings|good (morning|afternoon|evening|day))"
+    r"( there)?( (doctor|doc|bot|assistant|friend))?\s*[!.,]*\s*$"
+    r"|^how are you( doing| today)?\s*[?!.]*$"
+)
+THANKS_RE = re.compile(r"^(thanks?( you)?( so much| a lot| very much)?|thank u|thx|ty|ok(ay)? thanks?)"
+                       r"( (doctor|doc|bot))?\s*[!.]*\s*$")
+GOODBYE_RE = re.compile(r"^(bye+|goodbye|good night|see you( later)?|take care)( (doctor|doc|bot))?\s*[!.]*\s*$")
+
+GREETING_REPLY = ("Hello {Username}! I'm {Assistantname}. Tell me about your symptoms, ask about a medication, "
+                  "or upload a prescription or a medical image.")
+THANKS_REPLY = "You're welcome, {Username}. Let me know if there's anything else about your health I can help with."
+GOODBYE_REPLY = "Take care, {Username}! Come back any time you have a health question."
+OFFTOPIC_REPLY = ("I'm {Assistantname}, a medical assistant, so I can only help with health-related questions: "
+                  "symptoms, conditions, medications, prescriptions and medical images.")
+
+_WORD_RE = re.compile(r"[a-z][a-z0-9-]*")
+
+
+def _ngrams(word):
+    return {word[i:i + n] for n in (4, 5) for i in range(len(word) - n + 1)}
+
+
+# Roots shorter than 4 characters are only matched as whole words or word endings
+_ROOT_GRAMS = frozenset(root for root in MEDICAL_ROOTS if len(root) in (4, 5))
+_LONG_ROOTS = tuple(root for root in MEDICAL_ROOTS if len(root) > 5)
+_SHORT_ROOTS = tuple(root for root in MEDICAL_ROOTS if len(root) < 4)
+
+
+def _medical_word(word):
+    if word in MEDICAL_WORDS:
+        return True
+    if len(word) >= 5 and (_ngrams(word) & _ROOT_GRAMS or any(root in word for root in _LONG_ROOTS)):
+        return True
+    return len(word) >= 6 and word.endswith(_SHORT_ROOTS)
+
+
+def classify(text):
+    """-> (route, reply or None); reply is a template to fill with the user's settings."""
+    query = " ".join(text.lower().split())
+    if GREETING_RE.match(query):
+        return GREETING, GREETING_REPLY
+    if THANKS_RE.match(query):
+        return GREETING, THANKS_REPLY
+    if GOODBYE_RE.match(query):
+        return GREETING, GOODBYE_REPLY
+    words = _WORD_RE.findall(query)
+    if any(_medical_word(word) for word in words) or HEALTH_CONTEXT_RE.search(query):
+        return MEDICAL, None
+    if OFFTOPIC_RE.search(query) or any(word in OFFTOPIC_WORDS for word in words):
+        return OFFTOPIC, OFFTOPIC_REPLY
+    return MEDICAL, None
+
+
+def route(text, **names):
+    """Classify `text` and count the decision; -> (route, filled-in reply or None)."""
+    kind, reply = classify(text)
+    metrics.inc("chat_route_total", route=kind)
+    return kind, reply.format(**names) if reply else None
@@ -0,0 +1,106 @@
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Background job executor for the Tk GUI.
+#
+# Jobs run on worker threads and never touch widgets. Everything they report
+# (progress such as streamed tokens, the final result, errors) goes through a
+# thread-safe queue that the Tk main loop drains with root.after, so callbacks
+# always run on the UI thread.
+
+
+class Job:
+    def __init__(self, fn, args, on_progress=None, on_done=None, on_error=None):
+        self.fn = fn
+        self.args = args
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel_event = threading.Event()
+        self.submitted_at = time.perf_counter()
+        self.ttft = None  # seconds until the first progress item was shown
+        self._queue = None
+
+    def emit(self, value):
+        # Called from the worker thread
+        if not self.cancel_event.is_set():
+            self._queue.put(("progress", self, value))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class JobExecutor:
+    def __init__(self, root, max_workers=2, poll_ms=30):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.ttft_samples = deque(maxlen=200)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="medimind-job")
+        self._queue = queue.Queue()
+        self._active = set()
+        self.root.after(self.poll_ms, self._drain)
+
+    def submit(self, fn, *args, on_progress=None, on_done=None, on_error=None):
+        """Run fn(job, *args) on a worker thread; callbacks run on the Tk thread."""
+        job = Job(fn, args, on_progress, on_done, on_error)
+        job._queue = self._queue
+        self._active.add(job)
+        self._pool.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        if job.cancelled():
+            self._queue.put(("done", job, None))
+            return
+        try:
+            result = job.fn(job, *job.args)
+        except Exception as e:
+            self._queue.put(("error", job, e))
+        else:
+            self._queue.put(("done", job, None if job.cancelled() else result))
+
+    def _drain(self):
+        try:
+            while True:
+                kind, job, value = self._queue.get_nowait()
+                self._dispatch(kind, job, value)
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_ms, self._drain)
+
+    def _dispatch(self, kind, job, value):
+        if kind == "progress":
+            if job.cancelled():
+                return
+            if job.ttft is None:
+                job.ttft = time.perf_counter() - job.submitted_at
+                self.ttft_samples.append(job.ttft)
+                metrics.observe("gui_ttft_seconds", job.ttft)
+            if job.on_progress:
+                job.on_progress(value)
+            return
+        self._active.discard(job)
+        if kind == "error":
+            if job.on_error:
+                job.on_error(value)
+        elif job.on_done:
+            job.on_done(value)
+
+    def pending(self):
+        return len(self._active)
+
+    def cancel_all(self):
+        for job in list(self._active):
+            job.cancel()
+
+    def shutdown(self):
+        self.cancel_all()
+        self._pool.shutdown(wait=False, cancel_futures=True)
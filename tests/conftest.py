@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The application modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MediMind AI"))
+
+
+@pytest.fixture
+def fake_groq():
+    """A local fake Groq endpoint -> (FakeConfig, base URL); tweak the config per test."""
+    from fake_groq import FakeConfig, start_server
+    config = FakeConfig(ttft=0.01, token_delay=0.0, seed=1)
+    server, url = start_server(config)
+    yield config, url
+    server.shutdown()
+
+
+@pytest.fixture
+def offline_llm(fake_groq, tmp_path):
+    """Point the llm module at the fake endpoint, with a temporary chat log and no caches or rate limits."""
+    import llm
+    from cache import ResponseCache
+    from chatlog import open_chat_log
+    from scheduler import Scheduler
+    llm.UseEndpoint(fake_groq[1], api_key="test")
+    llm.UseResponseCache(ResponseCache(None))
+    llm.UseScheduler(Scheduler({}, 0, 0))
+    store = open_chat_log(str(tmp_path / "chat"), "jsonl")
+    llm.UseChatLog(store)
+    yield fake_groq
+    store.close()
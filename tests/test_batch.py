@@ -0,0 +1,51 @@
+import json
+
+from batch import read_records, run_batch
+
+
+def test_record_ids_fall_back_to_the_line_number_only_when_missing(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text("\n".join(json.dumps(row) for row in [
+        {"id": 0, "text": "a"}, {"text": "b"}, {"id": "rx-7", "text": "c"}, {"id": None, "text": "d"},
+    ]), encoding="utf-8")
+    assert [record["id"] for record in read_records(str(path), "parse")] == ["0", "2", "rx-7", "4"]
+
+
+def test_csv_ids(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("id,text\n0,a\n,b\n", encoding="utf-8")
+    assert [record["id"] for record in read_records(str(path), "parse")] == ["0", "2"]
+
+
+def test_bad_lines_get_an_error_result_and_the_run_goes_on(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text("\n".join([
+        json.dumps({"id": "a", "text": "Tab Amoxicillin 500mg TDS x 5 days"}),
+        "{not json",
+        json.dumps({"id": "b", "task": "summarize", "text": "x"}),
+        json.dumps({"id": "c", "text": "Tab Paracetamol 650mg BD x 3 days"}),
+    ]), encoding="utf-8")
+    output = tmp_path / "out.jsonl"
+    summary = run_batch(str(path), str(output), local=True)
+    results = {r["id"]: r for r in map(json.loads, output.read_text(encoding="utf-8").splitlines())}
+    assert summary["processed"] == 4 and summary["ok"] == 2 and summary["errors"] == 2
+    assert results["a"]["source"] == results["c"]["source"] == "local"
+    assert results["2"]["error"].startswith("Invalid JSON")
+    assert "Unknown task" in results["b"]["error"]
+
+
+def test_cached_answers_do_not_use_the_rpm_budget(offline_llm, tmp_path):
+    import llm
+    from diagnosis import PROMPT_TEMPLATE
+    from cache import cache_key
+    for text in ("fever", "cough"):
+        llm.GetResponseCache().put(cache_key("analyze_symptoms", llm.ChatModel, PROMPT_TEMPLATE, text), f"about {text}")
+    path = tmp_path / "input.jsonl"
+    path.write_text("\n".join(json.dumps({"id": text, "text": text}) for text in ("fever", "cough")), encoding="utf-8")
+    output = tmp_path / "out.jsonl"
+    # One request a minute: a second upstream call would wait a minute
+    summary = run_batch(str(path), str(output), task="diagnose", rpm=1)
+    assert summary["ok"] == 2 and summary["seconds"] < 5
+    results = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert {r["source"] for r in results} == {"cache"}
+    assert offline_llm[0].requests == 0
@@ -0,0 +1,43 @@
+import os
+
+import chatlog
+from chatlog import JSONLChatLog
+
+
+def fill(store, messages):
+    for i in range(messages):
+        store.append("busy", "user", f"message {i} " + "x" * 200)
+
+
+def test_tail_reads_only_the_sessions_segments(tmp_path, monkeypatch):
+    store = JSONLChatLog(str(tmp_path), segment_bytes=4096)
+    store.append("quiet", "user", "first")
+    fill(store, 200)
+    store.append("quiet", "assistant", "second")
+    store.close()
+    assert len(store._segments()) > 10
+
+    read = []
+    reverse_lines = chatlog._reverse_lines
+    monkeypatch.setattr(chatlog, "_reverse_lines", lambda path: (read.append(path), reverse_lines(path))[1])
+    reopened = JSONLChatLog(str(tmp_path), segment_bytes=4096)
+    assert [m["content"] for m in reopened.tail(5000, "quiet")] == ["first", "second"]
+    assert len(read) == 2
+    assert reopened.tail(5000, "missing") == []
+    assert len(read) == 2
+    assert len(reopened.tail(3, "busy")) == 3
+    reopened.close()
+
+
+def test_missing_session_index_is_rebuilt(tmp_path):
+    store = JSONLChatLog(str(tmp_path), segment_bytes=4096)
+    store.append("quiet", "user", "first")
+    fill(store, 50)
+    store.close()
+    for name in os.listdir(tmp_path):
+        if name.endswith(".sessions"):
+            os.remove(tmp_path / name)
+    reopened = JSONLChatLog(str(tmp_path), segment_bytes=4096)
+    assert [m["content"] for m in reopened.tail(10, "quiet")] == ["first"]
+    assert any(name.endswith(".sessions") for name in os.listdir(tmp_path))
+    reopened.close()
@@ -0,0 +1,62 @@
+import time
+import threading
+
+from hedge import HedgePolicy
+from llm_client import ResilientClient
+from scheduler import Scheduler
+
+PRIMARY, FALLBACK = "llama3-70b-8192", "llama3-8b-8192"
+MESSAGES = [{"role": "user", "content": "I have a fever"}]
+
+
+class RecordingScheduler(Scheduler):
+    def __init__(self):
+        super().__init__({}, 0, 0)
+        self.tickets = []
+
+    def acquire(self, model, tokens, session=None, cancel=None):
+        ticket = super().acquire(model, tokens, session, cancel)
+        self.tickets.append(ticket)
+        return ticket
+
+
+def hedge_threads():
+    return sum(thread.name == "medimind-hedge" for thread in threading.enumerate())
+
+
+def wait_for(condition, seconds=1.0):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_losing_stream_is_closed_and_its_ticket_released(fake_groq):
+    config, url = fake_groq
+    config.model_ttft = {PRIMARY: 5.0, FALLBACK: 0.01}
+    scheduler = RecordingScheduler()
+    policy = HedgePolicy(min_delay=0.1, max_delay=0.1)
+    client = ResilientClient("test", base_url=url, scheduler=scheduler, hedging=policy)
+
+    started = time.monotonic()
+    model, stream = client.complete(PRIMARY, MESSAGES, max_tokens=64, stream=True)
+    assert model == FALLBACK
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+    stream.close()
+    assert time.monotonic() - started < 2.0
+    assert policy.stats["hedge_won"] == 1
+
+    # The primary, still waiting for its first token, is given up right away
+    assert wait_for(lambda: hedge_threads() == 0)
+    primary = next(ticket for ticket in scheduler.tickets if ticket.model == PRIMARY)
+    assert primary.settled
+
+
+def test_fast_primary_is_not_hedged(fake_groq):
+    config, url = fake_groq
+    policy = HedgePolicy(min_delay=0.5, max_delay=0.5)
+    client = ResilientClient("test", base_url=url, hedging=policy)
+    model, stream = client.complete(PRIMARY, MESSAGES, max_tokens=64, stream=True)
+    list(stream)
+    assert model == PRIMARY
+    assert config.requests == 1 and policy.stats["hedged"] == 0
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageDraw
+
+from ingest import AnalysisStore, prepare_image
+
+XRAY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MediMind AI", "xray.jpg")
+MODEL = "vision"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AnalysisStore(str(tmp_path / "analyses.sqlite3"))
+
+
+def variant(tmp_path, name, change=None, quality=90):
+    img = Image.open(XRAY).convert("RGB")
+    if change:
+        change(img)
+    path = tmp_path / name
+    img.save(path, quality=quality)
+    return prepare_image(str(path))
+
+
+def opacity(img):
+    # A new round finding in one lung field
+    w, h = img.size
+    ImageDraw.Draw(img).ellipse((w * 0.3, h * 0.4, w * 0.3 + w // 12, h * 0.4 + w // 12), fill=(235, 235, 235))
+
+
+def test_exact_match_only_by_default(store, tmp_path):
+    original = prepare_image(XRAY)
+    store.save(original, MODEL, "analysis A", "session-a")
+    assert store.find(prepare_image(XRAY), MODEL, "session-a") == "analysis A"
+    assert store.find(variant(tmp_path, "copy.jpg", quality=85), MODEL, "session-a") is None
+
+
+def test_new_finding_never_matches(store, tmp_path):
+    store.save(prepare_image(XRAY), MODEL, "analysis A", "session-a")
+    changed = variant(tmp_path, "opacity.jpg", opacity)
+    assert store.find(changed, MODEL, "session-a") is None
+    assert store.find(changed, MODEL, "session-a", near=True) is None
+
+
+def test_near_match_for_reencoded_copy(store, tmp_path):
+    store.save(prepare_image(XRAY), MODEL, "analysis A", "session-a")
+    assert store.find(variant(tmp_path, "copy.jpg", quality=85), MODEL, "session-a", near=True) == "analysis A"
+
+
+def test_not_shared_across_sessions(store):
+    store.save(prepare_image(XRAY), MODEL, "analysis A", "session-a")
+    assert store.find(prepare_image(XRAY), MODEL, "other") is None
+    assert store.find(prepare_image(XRAY), MODEL, "other", near=True) is None
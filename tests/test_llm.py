@@ -0,0 +1,79 @@
+import time
+import threading
+
+import llm
+from llm_client import LLMError, error_message
+
+
+def open_breaker(model):
+    breaker = llm.GetClient().breaker(model)
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+
+def test_fallback_answers_are_not_cached(offline_llm):
+    config, _url = offline_llm
+    open_breaker(llm.ChatModel)
+    first = llm.CachedChatBot("summary", "Summarize: {text}", "fever for two days")
+    assert first and config.requests == 1
+    llm.CachedChatBot("summary", "Summarize: {text}", "fever for two days")
+    assert config.requests == 2  # the fallback model's answer was not reused
+
+    llm.GetClient().breaker(llm.ChatModel).record_success()
+    llm.CachedChatBot("summary", "Summarize: {text}", "fever for two days")
+    llm.CachedChatBot("summary", "Summarize: {text}", "fever for two days")
+    assert config.requests == 3
+
+
+def test_chatbot_errors_are_returned_not_printed(offline_llm, capsys):
+    open_breaker(llm.ChatModel)
+    open_breaker("llama3-8b-8192")
+    answer = llm.ChatBot("I have a headache", route=False)
+    assert answer == error_message(LLMError("circuit_open", "open"))
+    assert capsys.readouterr().out == ""
+
+
+def test_building_messages_while_the_session_loads_does_not_deadlock(offline_llm):
+    store = llm.GetChatLog()
+    tail = store.tail
+    loading = threading.Event()
+
+    def slow_tail(n, session_id):
+        loading.set()
+        time.sleep(0.3)
+        return tail(n, session_id)
+
+    store.tail = slow_tail
+    results = []
+    loader = threading.Thread(target=lambda: results.append(llm.GetContext("new")), daemon=True)
+    builder = threading.Thread(target=lambda: results.append(llm.BuildMessages("hi", [], "new")), daemon=True)
+    loader.start()
+    loading.wait(1.0)
+    builder.start()
+    loader.join(3.0)
+    builder.join(3.0)
+    assert not loader.is_alive() and not builder.is_alive()
+    assert len(results) == 2
+
+
+def test_chat_log_append_does_not_hold_the_context_lock(offline_llm):
+    llm.GetContext("slow")
+    llm.GetContext("other")
+    store = llm.GetChatLog()
+    append = store.append
+    appending = threading.Event()
+
+    def slow_append(session_id, role, content):
+        appending.set()
+        time.sleep(0.5)  # e.g. an fsync
+        append(session_id, role, content)
+
+    store.append = slow_append
+    recorder = threading.Thread(target=llm.RecordTurn, args=("q", "a", "slow"))
+    recorder.start()
+    appending.wait(1.0)
+    started = time.perf_counter()
+    llm.BuildMessages("hi", [], "other")
+    assert time.perf_counter() - started < 0.2
+    recorder.join()
+    assert [m["content"] for m in llm.BuildMessages("next", [], "slow")][-3:] == ["q", "a", "next"]
@@ -0,0 +1,127 @@
+import time
+import threading
+
+import pytest
+
+from llm_client import LLMError, ResilientClient
+from scheduler import Scheduler
+from singleflight import request_key
+
+PRIMARY, FALLBACK = "llama3-70b-8192", "llama3-8b-8192"
+MESSAGES = [{"role": "user", "content": "I have a fever"}]
+
+
+class Rolls:
+    """Stands in for FakeConfig.random: each request draws its error roll, then its slow roll."""
+
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def random(self):
+        return self.values.pop(0) if self.values else 0.99
+
+
+def make_client(url, **kwargs):
+    kwargs.setdefault("backoff_base", 0.01)
+    return ResilientClient("test", base_url=url, **kwargs)
+
+
+def test_retries_after_a_503(fake_groq):
+    config, url = fake_groq
+    config.error_rate = 0.5
+    config.random = Rolls(0.1, 0.99)  # the first request fails
+    client = make_client(url)
+    model, completion = client.complete(PRIMARY, MESSAGES, max_tokens=64)
+    assert model == PRIMARY and completion.choices[0].message.content
+    assert config.requests == 2 and client.stats["retries"] == 1
+
+
+def test_429_waits_for_retry_after_and_pauses_the_model(fake_groq):
+    config, url = fake_groq
+    config.rate_limit_rate = 0.5
+    config.retry_after = 0.3
+    config.random = Rolls(0.1, 0.99)
+    scheduler = Scheduler({}, 0, 0)
+    client = make_client(url, scheduler=scheduler)
+    started = time.monotonic()
+    model, _completion = client.complete(PRIMARY, MESSAGES, max_tokens=64)
+    assert model == PRIMARY
+    assert time.monotonic() - started >= 0.3
+    assert scheduler.stats["paused"] == 1
+
+
+def test_falls_back_when_the_primary_keeps_failing(fake_groq):
+    config, url = fake_groq
+    config.error_rate = 0.5
+    config.random = Rolls(0.1, 0.99)
+    client = make_client(url, max_retries=0)
+    model, completion = client.complete(PRIMARY, MESSAGES, max_tokens=64)
+    assert model == FALLBACK and completion.model == FALLBACK
+    assert client.stats["fallbacks"] == 1
+
+
+def test_circuit_breaker_opens_and_lets_one_probe_through(fake_groq):
+    config, url = fake_groq
+    config.error_rate = 1.0
+    client = make_client(url, max_retries=0, fallbacks={}, breaker_threshold=2, breaker_reset=0.2)
+    for _ in range(2):
+        with pytest.raises(LLMError) as error:
+            client.complete(PRIMARY, MESSAGES, max_tokens=64)
+        assert error.value.kind == "server"
+    with pytest.raises(LLMError) as error:
+        client.complete(PRIMARY, MESSAGES, max_tokens=64)
+    assert error.value.kind == "circuit_open" and config.requests == 2
+
+    # Half-open: a failed probe re-opens the circuit at once
+    time.sleep(0.25)
+    with pytest.raises(LLMError):
+        client.complete(PRIMARY, MESSAGES, max_tokens=64)
+    assert config.requests == 3 and client.breaker(PRIMARY).state == "open"
+
+    # A successful probe closes it
+    time.sleep(0.25)
+    config.error_rate = 0.0
+    model, _completion = client.complete(PRIMARY, MESSAGES, max_tokens=64)
+    assert model == PRIMARY and client.breaker(PRIMARY).state == "closed"
+
+
+def test_identical_concurrent_requests_share_one_upstream_call(fake_groq):
+    config, url = fake_groq
+    config.ttft = 0.3
+    client = make_client(url)
+    params = dict(max_tokens=64, temperature=0)
+    key = request_key(PRIMARY, MESSAGES, **params)
+    answers = []
+
+    def ask():
+        _model, completion = client.complete(PRIMARY, MESSAGES, coalesce_key=key, **params)
+        answers.append(completion.choices[0].message.content)
+
+    threads = [threading.Thread(target=ask) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(answers) == 4 and len(set(answers)) == 1
+    assert config.requests == 1
+
+
+def test_streams_are_coalesced_too(fake_groq):
+    config, url = fake_groq
+    config.ttft = 0.3
+    client = make_client(url)
+    params = dict(max_tokens=64, stream=True)
+    key = request_key(PRIMARY, MESSAGES, **params)
+    texts = []
+
+    def ask():
+        _model, stream = client.complete(PRIMARY, MESSAGES, coalesce_key=key, **params)
+        texts.append("".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices))
+
+    threads = [threading.Thread(target=ask) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert texts[0] and texts.count(texts[0]) == 3
+    assert config.requests == 1
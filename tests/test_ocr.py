@@ -0,0 +1,44 @@
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("pytesseract")
+from PIL import ImageDraw
+
+import ocr
+
+APP_DIR = ocr.__file__.rsplit("ocr.py", 1)[0]
+
+
+def page(angle=0.0):
+    img = Image.new("L", (1200, 1600), 235)
+    draw = ImageDraw.Draw(img)
+    for y in range(100, 1500, 40):
+        draw.text((100, y), "Paracetamol 500 mg twice daily after food for five days " * 2, fill=20)
+    return img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255) if angle else img
+
+
+def test_straight_pages_are_not_rotated():
+    assert ocr.estimate_skew(page()) == 0.0
+    with Image.open(APP_DIR + "Medical Report.jpg") as img:
+        assert ocr.estimate_skew(ocr.downscale(img.convert("L"))) == 0.0
+
+
+@pytest.mark.parametrize("angle", [2.0, -3.0, 4.5])
+def test_skewed_pages_are_levelled(angle):
+    assert ocr.estimate_skew(page(angle)) == -angle
+
+
+def test_pages_without_text_lines_are_not_rotated():
+    with Image.open(APP_DIR + "xray.jpg") as img:
+        assert ocr.estimate_skew(img.convert("L")) == 0.0
+
+
+def test_every_page_of_a_multi_page_tiff_is_read(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda img, config: calls.append(img) or f"page {len(calls)}")
+    path = str(tmp_path / "scan.tif")
+    first, *rest = [page(angle) for angle in (0, 0, 0)]
+    first.save(path, save_all=True, append_images=rest)
+    result = ocr.recognize(path)
+    assert result["pages"] == 3
+    assert result["text"] == "page 1\n\npage 2\n\npage 3"
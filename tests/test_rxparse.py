@@ -0,0 +1,81 @@
+import pytest
+
+from rxparse import extract
+
+
+def names(extraction):
+    return [medication.name for medication in extraction.medications]
+
+
+def test_confident_prescription():
+    extraction = extract("Tab Amoxicillin 500mg TDS x 5 days, Tab Paracetamol 650mg SOS, Syp Benadryl 10ml HS")
+    assert extraction.is_confident()
+    assert names(extraction) == ["Amoxicillin", "Paracetamol", "Diphenhydramine"]
+    amoxicillin = extraction.medications[0]
+    assert (amoxicillin.strength, amoxicillin.frequency, amoxicillin.duration) == \
+        ("500 mg", "three times a day (TDS)", "5 days")
+
+
+@pytest.mark.parametrize("text", [
+    "Paracetamol 500mg BD\nRivaroxaban 10mg OD",
+    "Tab Paracetamol 500mg BD x 5 days\nApixaban 5 mg BD",
+    "Paracetamol 500mg BD, Rivaroxaban 10mg OD",
+])
+def test_unknown_drug_with_strength_is_not_dropped(text):
+    extraction = extract(text)
+    assert not extraction.is_confident()
+    assert extraction.reason() == "unresolved_text"
+    assert any("aban" in snippet for snippet in extraction.unresolved)
+    # The unknown drug's frequency is not attached to Paracetamol
+    assert extraction.medications[0].frequency == "twice a day (BD)"
+
+
+def test_frequency_does_not_cross_lines():
+    extraction = extract("Tab Amoxicillin 500mg\nTDS x 5 days")
+    assert extraction.medications[0].frequency is None
+    assert extraction.unresolved == ["TDS x 5 days"]
+    assert not extraction.is_confident()
+
+
+def test_dosing_before_first_drug_is_unresolved():
+    extraction = extract("500mg BD\nTab Paracetamol 650mg SOS")
+    assert extraction.unresolved == ["500mg BD"]
+
+
+def test_insulin_keeps_its_type():
+    extraction = extract("Insulin glargine 10 units HS / Insulin lispro 4 units TDS")
+    assert names(extraction) == ["Insulin Glargine", "Insulin Lispro"]
+    assert [m.frequency for m in extraction.medications] == ["at bedtime (HS)", "three times a day (TDS)"]
+
+
+def test_insulin_without_type_is_not_confident():
+    extraction = extract("Insulin 10 units HS")
+    assert not extraction.is_confident()
+    assert extraction.reason() == "low_confidence"
+
+
+def test_ocr_damaged_name():
+    extraction = extract("Rx\nTab Amoxici1in 500mg TDS x 5 days")
+    assert names(extraction) == ["Amoxicillin"]
+    assert extraction.is_confident()
+
+
+@pytest.mark.parametrize("text", [
+    "STOP Aspirin 75mg OD",
+    "Discontinue Glimepiride 2mg OD",
+    "If allergic, use Azithromycin 500mg OD x 3 days",
+    "Tab Atorvastatin 10mg HS (hold if muscle pain)",
+    "Tab Paracetamol 500mg SOS\\nmax 3 per day",
+    "Tab Metformin 500mg BD until review",
+])
+def test_stopped_conditional_or_qualified_drugs_go_to_the_llm(text):
+    extraction = extract(text)
+    assert not extraction.is_confident()
+    assert extraction.reason() == "unresolved_text"
+
+
+def test_plain_instructions_stay_confident():
+    extraction = extract("Tab Metformin 500mg BD after food\nTab Cetirizine 10mg OD at night\n"
+                         "Cap Omeprazole 20mg OD empty stomach")
+    assert extraction.is_confident()
+    assert extraction.unresolved == []
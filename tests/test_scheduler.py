@@ -0,0 +1,76 @@
+import time
+import threading
+
+import scheduler
+from scheduler import Scheduler
+
+
+def queue_up(sched, requests, tokens):
+    # Start one waiting acquire per (priority, session), in order; -> the order they are admitted in
+    admitted = []
+    threads = []
+
+    def acquire(level, session):
+        with scheduler.priority(level):
+            sched.acquire("m", tokens, session)
+        admitted.append(session)
+
+    for level, session in requests:
+        threads.append(threading.Thread(target=acquire, args=(level, session)))
+        threads[-1].start()
+        time.sleep(0.02)  # enqueue in a known order
+    for thread in threads:
+        thread.join()
+    return admitted
+
+
+def test_interactive_requests_go_before_batch():
+    sched = Scheduler({"m": (0, 60000)})  # 1000 tokens/second
+    sched.acquire("m", 60000)  # drain the bucket
+    order = queue_up(sched, [(scheduler.BATCH, "batch-1"), (scheduler.BATCH, "batch-2"),
+                             (scheduler.INTERACTIVE, "chat")], 100)
+    assert order == ["chat", "batch-1", "batch-2"]
+
+
+def test_sessions_take_turns_within_a_priority():
+    sched = Scheduler({"m": (0, 60000)})
+    sched.acquire("m", 60000)
+    order = queue_up(sched, [(scheduler.BATCH, "a"), (scheduler.BATCH, "a"), (scheduler.BATCH, "a"),
+                             (scheduler.BATCH, "b")], 100)
+    assert order == ["a", "b", "a", "a"]
+
+
+def test_requests_per_minute_limit():
+    sched = Scheduler({"m": (120, 0)})  # two requests a second after a burst of 120
+    for _ in range(120):
+        sched.acquire("m", 1)
+    started = time.monotonic()
+    sched.acquire("m", 1)
+    assert 0.3 <= time.monotonic() - started < 1.5
+
+
+def test_unused_tokens_are_given_back():
+    sched = Scheduler({"m": (0, 1000)})
+    ticket = sched.acquire("m", 1000)
+    sched.settle(ticket, 100)
+    started = time.monotonic()
+    sched.acquire("m", 900)
+    assert time.monotonic() - started < 0.2
+
+
+def test_pause_holds_a_model():
+    sched = Scheduler({}, 0, 0)
+    sched.pause("m", 0.3)
+    started = time.monotonic()
+    sched.acquire("m", 1)
+    assert time.monotonic() - started >= 0.25
+    assert sched.acquire("other", 1) is not None
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    sched = Scheduler({"m": (1, 0)})
+    sched.acquire("m", 1)
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    assert sched.acquire("m", 1, cancel=cancel) is None
+    assert sched.snapshot()["queued"].get("interactive", 0) == 0
@@ -0,0 +1,85 @@
+import time
+import asyncio
+
+import pytest
+
+import llm
+import service
+from config import get_config
+
+
+def read(raw):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await service.read_request(reader, None, 1024)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-5", b"1e3"])
+def test_malformed_content_length_is_a_400(length):
+    with pytest.raises(service.HTTPError) as error:
+        read(b"POST /chat HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n")
+    assert error.value.status == 400
+
+
+def test_context_windows_are_evicted(offline_llm, monkeypatch):
+    monkeypatch.setattr(get_config(), "SessionCacheSize", 2)
+    for session in ("a", "b", "a", "c"):
+        llm.GetContext(session)
+    assert list(llm._windows) == ["a", "c"]
+
+
+def test_new_session_history_loads_off_the_event_loop(offline_llm):
+    store = llm.GetChatLog()
+    tail = store.tail
+
+    def slow_tail(n, session_id):
+        if session_id == "slow":
+            time.sleep(1.0)
+        return tail(n, session_id)
+
+    store.tail = slow_tail
+
+    async def request(port, raw):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(raw)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def main():
+        app = service.Service(1024 * 1024, max_sessions=2)
+        server = await asyncio.start_server(app.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        body = b'{"message": "I have a fever"}'
+        chat = asyncio.ensure_future(request(port, b"POST /chat HTTP/1.1\r\nX-Session-Id: slow\r\nConnection: close\r\n"
+                                                   b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                                                   % (len(body), body)))
+        await asyncio.sleep(0.2)
+        started = time.perf_counter()
+        health = await request(port, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+        health_seconds = time.perf_counter() - started
+        answer = await chat
+        server.close()
+        await server.wait_closed()
+        await llm.GetAsyncClient().close()
+        return health, health_seconds, answer
+
+    health, health_seconds, answer = asyncio.run(main())
+    assert health.startswith(b"HTTP/1.1 200")
+    assert health_seconds < 0.5
+    assert b"event: done" in answer
+
+
+def test_unreadable_prescription_upload_is_a_400(monkeypatch):
+    pytest.importorskip("PIL")
+    import ocr
+    from cache import ResponseCache
+    monkeypatch.setattr(ocr, "_cache", ResponseCache(None))
+    request = service.Request("POST", "/prescription", {"content-type": "image/png"}, b"not an image")
+    with pytest.raises(service.HTTPError) as error:
+        asyncio.run(service.prescription(request, "s", lambda text: None))
+    assert error.value.status == 400
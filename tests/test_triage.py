@@ -0,0 +1,33 @@
+import pytest
+
+import triage
+
+
+@pytest.mark.parametrize("query", [
+    "how to make ORS at home",
+    "how to make a splint",
+    "how to cook food for someone with jaundice",
+    "best recipe for diabetics",
+    "how to make baby formula",
+    "I got bitten by a python",
+    "I feel anxious about the election",
+    "is that serious?",
+    "what should I eat after my surgery",
+])
+def test_health_questions_reach_the_model(query):
+    assert triage.classify(query) == (triage.MEDICAL, None)
+
+
+@pytest.mark.parametrize("query", [
+    "who won the football match yesterday",
+    "write me a poem about the sea",
+    "what is the capital of France",
+    "how do I fix my python code",
+])
+def test_clearly_unrelated_questions_are_refused(query):
+    assert triage.classify(query)[0] == triage.OFFTOPIC
+
+
+@pytest.mark.parametrize("query", ["hello doctor", "thanks!", "bye"])
+def test_small_talk_gets_a_template(query):
+    assert triage.classify(query)[0] == triage.GREETING